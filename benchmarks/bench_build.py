@@ -0,0 +1,194 @@
+"""Benchmarks build.py on synthetic sites of increasing size.
+
+Each size preset generates a complete src/ tree under benchmarks/.work/<size>/, with blog posts,
+portfolio categories full of Pillow-drawn images, and long testimonial and client lists. It then
+times a cold full build and a no-op rebuild of it. Every build runs in a fresh interpreter against
+a copy of the working tree's build.py, so wall time and peak memory are measured in isolation.
+
+    python benchmarks/bench_build.py                       # all sizes, compared to baseline.json
+    python benchmarks/bench_build.py --sizes small medium
+    python benchmarks/bench_build.py --save-baseline       # record the current numbers as the baseline
+
+Exits with status 1 when a measurement regresses past --tolerance against the baseline.
+"""
+import os
+import sys
+import json
+import random
+import shutil
+import argparse
+import logging
+import platform
+import resource
+import subprocess
+from datetime import datetime, timedelta
+from PIL import Image, ImageDraw
+
+# --- Configuration ---
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+WORK_DIR = os.path.join(BENCH_DIR, '.work')
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+SIZES = {
+    # name: (blog posts, portfolio categories, images per category, testimonials, clients)
+    'small': (20, 3, 4, 20, 20),
+    'medium': (200, 10, 10, 100, 100),
+    'large': (1000, 30, 20, 500, 500),
+}
+IMAGE_SIZE = (1600, 1200)  # Wider than every IMAGE_WIDTHS entry, so all variants get encoded.
+TOLERANCE = 0.20  # Allowed slowdown/growth over the baseline before a run counts as a regression.
+SEED = 1234
+
+logger = logging.getLogger('bench')
+
+WORDS = ('brand identity design studio color type grid motion layout print web campaign logo poster '
+         'client story craft sketch concept palette texture balance contrast rhythm detail').split()
+
+# --- Synthetic Content ---
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def paragraph(rng, sentences=5):
+    return ' '.join(sentence(rng, rng.randint(8, 16)) for _ in range(sentences))
+
+def markdown_post(rng):
+    parts = [f"# {sentence(rng, 5)[:-1]}", paragraph(rng)]
+    for _ in range(rng.randint(2, 5)):
+        parts += [f"## {sentence(rng, 4)[:-1]}", paragraph(rng), '\n'.join(f"- {sentence(rng, 6)}" for _ in range(4)),
+                  f"> {sentence(rng)}", "```\n" + '\n'.join(f"step_{i} = '{rng.choice(WORDS)}'" for i in range(3)) + "\n```"]
+    return '\n\n'.join(parts) + '\n'
+
+def draw_image(rng, path, size=IMAGE_SIZE):
+    """Saves a JPEG with enough shapes and noise that encoding it costs about what a real photo does."""
+    img = Image.effect_noise(size, 64).convert('RGB')
+    draw = ImageDraw.Draw(img)
+    for _ in range(24):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.ellipse((x, y, x + rng.randint(50, 600), y + rng.randint(50, 600)), fill=tuple(rng.randrange(256) for _ in range(3)))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    img.save(path, 'JPEG', quality=85)
+
+def write_json(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+
+def generate_site(root, posts, categories, images_per_category, testimonials, clients, seed=SEED):
+    """Creates `root` with a copy of build.py and a synthetic src/ tree; templates and assets are the real ones."""
+    rng = random.Random(seed)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    src = os.path.join(root, 'src')
+    shutil.copytree(os.path.join(REPO_DIR, 'src', 'templates'), os.path.join(src, 'templates'))
+    shutil.copytree(os.path.join(REPO_DIR, 'src', 'assets'), os.path.join(src, 'assets'))
+    shutil.copytree(os.path.join(REPO_DIR, 'src', 'data'), os.path.join(src, 'data'))
+    images_dir = os.path.join(src, 'content', 'images')
+
+    blog, start = [], datetime(2024, 1, 1)
+    for i in range(posts):
+        slug = f"post-{i:05d}"
+        blog.append({'title': sentence(rng, 6)[:-1], 'date': (start + timedelta(days=i)).strftime('%B %d, %Y'), 'author': 'Bench Author',
+                     'image': f"{slug}.jpg", 'excerpt': sentence(rng, 20), 'slug': slug, 'tags': rng.sample(WORDS, 2)})
+        os.makedirs(os.path.join(src, 'content', 'blog'), exist_ok=True)
+        with open(os.path.join(src, 'content', 'blog', f"{slug}.md"), 'w', encoding='utf-8') as f:
+            f.write(markdown_post(rng))
+    for i in range(min(posts, 10)):  # A few banners are enough to exercise the blog image path.
+        draw_image(rng, os.path.join(images_dir, 'blog', f"post-{i:05d}.jpg"))
+
+    portfolio = []
+    for c in range(categories):
+        folder = f"category-{c:03d}"
+        for k in range(images_per_category):
+            draw_image(rng, os.path.join(images_dir, 'portfolio', folder, f"work-{k:03d}.jpg"))
+        portfolio.append({'label': f"Category {c}", 'folder': folder, 'image': f"{folder}/work-000.jpg"})
+
+    draw_image(rng, os.path.join(images_dir, 'team', 'client.jpg'), size=(400, 400))
+    draw_image(rng, os.path.join(images_dir, 'clients', 'client-logo.png'), size=(400, 200))
+    write_json(os.path.join(src, 'data', 'blog.json'), blog)
+    write_json(os.path.join(src, 'data', 'portfolio.json'), portfolio)
+    write_json(os.path.join(src, 'data', 'testimonials.json'), [
+        {'feedback': paragraph(rng, 2), 'stars': rng.randint(3, 5), 'image': 'client.jpg', 'client_name': f"Client {i}", 'client_company': 'Bench Inc.'}
+        for i in range(testimonials)])
+    write_json(os.path.join(src, 'data', 'clients.json'), [{'logo': 'client-logo.png', 'url': f"https://example.com/{i}"} for i in range(clients)])
+    shutil.copy2(os.path.join(REPO_DIR, 'build.py'), os.path.join(root, 'build.py'))
+
+# --- Measurement ---
+def run_build_in_child(root, full):
+    """Runs one build of the site at `root` in a fresh interpreter; returns its summary, wall time and peak RSS."""
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', root] + (['--full'] if full else []),
+                            capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def child_main(root, full):
+    sys.path.insert(0, root)
+    import build  # The copy in `root`, so all of its paths resolve inside the synthetic site.
+    summary = build.build(full=full)
+    # ru_maxrss is in KiB on Linux and bytes on macOS. Workers are reaped by the time build() returns.
+    scale = 1024 if platform.system() == 'Darwin' else 1
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) // scale
+    print(json.dumps({'seconds': summary['seconds'], 'pages_rendered': summary['pages_rendered'], 'peak_rss_kb': peak_kb}))
+
+def benchmark(size):
+    root = os.path.join(WORK_DIR, size)
+    logger.info(f"-> Generating '{size}' site ({'%d posts, %d categories x %d images, %d testimonials, %d clients' % SIZES[size]})...")
+    generate_site(root, *SIZES[size])
+    full = run_build_in_child(root, full=True)
+    noop = run_build_in_child(root, full=False)
+    full['pages_per_second'] = round(full['pages_rendered'] / full['seconds'], 1) if full['seconds'] else None
+    logger.info(f"  - full:  {full['seconds']:8.2f}s  {full['peak_rss_kb'] / 1024:7.1f} MB peak  {full['pages_rendered']} pages ({full['pages_per_second']}/s)")
+    logger.info(f"  - no-op: {noop['seconds']:8.2f}s  {noop['peak_rss_kb'] / 1024:7.1f} MB peak  {noop['pages_rendered']} pages")
+    return {'full': full, 'noop': noop}
+
+def compare(results, baseline, tolerance):
+    """Logs every metric against the baseline and returns the list of regressions."""
+    regressions = []
+    for size, runs in results.items():
+        for run, metrics in runs.items():
+            for metric in ('seconds', 'peak_rss_kb'):
+                before = baseline.get(size, {}).get(run, {}).get(metric)
+                if not before:
+                    continue
+                change = metrics[metric] / before - 1
+                flag = 'REGRESSION' if change > tolerance else 'ok'
+                logger.info(f"  - {size:<7} {run:<5} {metric:<12} {before:>12,} -> {metrics[metric]:>12,} ({change:+.0%}) {flag}")
+                if change > tolerance:
+                    regressions.append(f"{size}/{run}/{metric}")
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time full and no-op builds of synthetic sites and compare them against a baseline.")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES), help="Size presets to run (default: all).")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="Baseline JSON to compare against (default: benchmarks/baseline.json).")
+    parser.add_argument('--save-baseline', action='store_true', help="Write this run's results to the baseline file instead of comparing.")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help=f"Allowed relative increase before a metric is a regression (default: {TOLERANCE}).")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated sites in benchmarks/.work/ for inspection.")
+    parser.add_argument('--child', metavar='ROOT', help=argparse.SUPPRESS)
+    parser.add_argument('--full', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child_main(args.child, args.full)
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    results = {size: benchmark(size) for size in args.sizes}
+    if not args.keep:
+        shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r', encoding='utf-8') as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        write_json(args.baseline, baseline)
+        logger.info(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        logger.info(f"-> Comparing against {args.baseline} (tolerance {args.tolerance:.0%}):")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            logger.error(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        logger.info("No regressions.")
+    else:
+        logger.info(f"No baseline at {args.baseline}; run with --save-baseline to record one.")
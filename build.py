@@ -1,131 +1,2132 @@
 import os
+import re
 import shutil
 import json
+import hashlib
+import argparse
+import time
+import functools
+import threading
+import itertools
+import logging
+import multiprocessing
+import gzip
+import filecmp
+import cProfile
+import html
+import io
+import posixpath
+import urllib.parse
+import unicodedata
+from contextlib import contextmanager
+from html.parser import HTMLParser
+from datetime import datetime
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 import markdown2
-from jinja2 import Environment, FileSystemLoader
-from PIL import Image
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, pass_environment
+from jinja2.runtime import Context
+from markupsafe import Markup
+from PIL import Image, ImageOps, features
 import csscompressor
 import jsmin
+try:
+    import fcntl
+except ImportError:  # Windows: builds are only serialized within this process.
+    fcntl = None
+try:
+    import brotli
+except ImportError:  # Optional: without it only .gz siblings are written.
+    brotli = None
 
 # --- Configuration ---
-SRC_DIR = 'src'
-OUTPUT_DIR = 'docs'
+# Paths are anchored to this file so the build can also be imported and run from another
+# working directory (the CMS runs it in-process).
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(ROOT_DIR, 'src')
+OUTPUT_DIR = os.path.join(ROOT_DIR, 'docs')
 TEMPLATES_DIR = os.path.join(SRC_DIR, 'templates')
 DATA_DIR = os.path.join(SRC_DIR, 'data')
 CONTENT_DIR = os.path.join(SRC_DIR, 'content')
 ASSETS_DIR = os.path.join(SRC_DIR, 'assets')
 CONTENT_IMAGES_DIR = os.path.join(CONTENT_DIR, 'images')
 PORTFOLIO_IMAGES_DIR = os.path.join(CONTENT_IMAGES_DIR, 'portfolio')
+BUILD_CACHE_DIR = os.path.join(ROOT_DIR, '.build_cache')
+MANIFEST_FILE = os.path.join(BUILD_CACHE_DIR, 'manifest.json')
+MANIFEST_VERSION = 1
+IMAGE_CACHE_DIR = os.path.join(BUILD_CACHE_DIR, 'images')
+IMAGE_CACHE_MAX_AGE = 30 * 24 * 3600  # Entries no build has used for this long (replaced uploads, old settings) are pruned.
+WEBP_QUALITY = 80
+IMAGE_WORKERS = os.cpu_count() or 1
+IMAGE_WIDTHS = (320, 640, 960, 1280)
+IMAGE_AVIF = False
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+MEDIA_PREFIX = 'media/'  # Content-addressed uploads live in CONTENT_IMAGES_DIR/media/ and are referenced as 'media/<hash>.<ext>'.
+ASSET_BUNDLES = {'js/site.js': ['js/slider.js', 'js/video-player.js', 'js/logo-slider.js', 'js/search.js']}  # Bundle -> sources, in load order.
+ASSET_MANIFEST_NAME = 'manifest.json'
+PURGED_STYLESHEET = 'css/style.css'  # Purged of unused selectors and inlined per page by optimize_css().
+CSS_CACHE_FILE = os.path.join(BUILD_CACHE_DIR, 'css.json')
+MINIFY_HTML = True
+COMPRESS_EXTENSIONS = ('.html', '.css', '.js', '.svg', '.json', '.xml')
+COMPRESS_WORKERS = os.cpu_count() or 1  # Threads; zlib and brotli release the GIL.
+COMPRESS_MIN_SIZE = 256  # Bytes; smaller outputs (e.g. most search shards) are not worth a sibling, which can even be larger.
+SIZE_REPORT_FILE = os.path.join(BUILD_CACHE_DIR, 'size_report.json')
+MARKDOWN_CACHE_DIR = os.path.join(BUILD_CACHE_DIR, 'markdown')
+JINJA_CACHE_DIR = os.path.join(BUILD_CACHE_DIR, 'jinja')  # Compiled templates, reused across builds and processes.
+WRITE_BUFFER_SIZE = 1 << 16
+MARKDOWN_EXTRAS = []  # markdown2 extras used for blog posts; part of the render cache key.
+MARKDOWN_CACHE_MAX_AGE = 30 * 24 * 3600  # Entries not read for this long are pruned.
+MARKDOWN_POOL_MIN = 8  # Below this many cache misses, a process pool costs more to start than it saves.
+BLOG_PAGE_SIZE = 6  # Posts per blog index/tag/archive page.
+BLOG_DATE_FORMAT = '%B %d, %Y'  # e.g. "July 30, 2025", as entered in the CMS.
+FEED_ENTRIES = 20
+GALLERY_PAGE_SIZE = 24  # Images per portfolio category page.
+GALLERY_CACHE_DIR = os.path.join(BUILD_CACHE_DIR, 'galleries')  # Per-category image metadata manifests.
+PROFILE_FILE = os.path.join(BUILD_CACHE_DIR, 'build_profile.json')
+VALIDATION_FILE = os.path.join(BUILD_CACHE_DIR, 'validation.json')  # Structured report of the last build's validation.
+PUBLISHED_VALIDATION_FILE = os.path.join(BUILD_CACHE_DIR, 'validation_published.json')  # Report of the last published build.
+VALIDATION_LOG_LIMIT = 20  # Issues logged individually; the rest are only in VALIDATION_FILE.
+PROFILE_DUMP_DIR = os.path.join(BUILD_CACHE_DIR, 'profile')  # cProfile dumps of the slowest stage.
+SEARCH_DIR_NAME = 'search'  # Output subdirectory of the search index: index.json plus fingerprinted docs and shards.
+SEARCH_CACHE_FILE = os.path.join(BUILD_CACHE_DIR, 'search.json')  # Per-document terms, so only changed posts are re-tokenized.
+SEARCH_PREFIX_LENGTH = 2  # Terms are sharded by this many leading characters; search.js uses the same value from index.json.
+SEARCH_FIELD_WEIGHTS = {'title': 5, 'tags': 3, 'excerpt': 2, 'body': 1}
+SEARCH_MAX_TERM_COUNT = 5  # Occurrences of a term in one field beyond this add nothing to its score.
+SEARCH_SNIPPET_LENGTH = 160
+SEARCH_STOPWORDS = frozenset('a an and are as at be but by for from has have in is it its of on or that the this to was were will with'.split())
+PREVIEW_IMAGE_MAX_DIMENSION = 1600  # Longest side of the WebP images rendered on the fly for previews.
+UNPUBLISHED_FILE = os.path.join(BUILD_CACHE_DIR, 'unpublished.json')  # Outputs changed or removed since the last publish.
+BUILD_LOCK_FILE = os.path.join(BUILD_CACHE_DIR, 'build.lock')
+PROFILE_SLOWEST_OUTPUTS = 10  # Outputs listed by name in the profile log.
+STAGE_WORKERS = 6  # Build stages run at once; images and markdown fan out further to their own process pools.
+POOL_CONTEXT = multiprocessing.get_context('spawn')  # Pools start from stage threads (and inside the threaded CMS), where forking can copy held locks.
+
+logger = logging.getLogger('build')
+
+
+# --- Incremental Build Manifest ---
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class BuildManifest:
+    """Persists, for every file under OUTPUT_DIR, the hashes of the inputs it was built from.
+
+    An output is only rebuilt when its input signature differs from the one recorded by the
+    previous build. Outputs recorded last time but not produced by this build are stale and
+    get deleted, so the output tree never has to be wiped.
+    """
+
+    def __init__(self, path=None, output_dir=None, changed_paths=None):
+        self.path = path or MANIFEST_FILE
+        self.output_dir = output_dir or OUTPUT_DIR
+        # When set, only these files are re-checked; every other file keeps its recorded hash.
+        self.changed_paths = {os.path.relpath(os.path.abspath(p), ROOT_DIR) for p in changed_paths} if changed_paths is not None else None
+        self.previous = {}
+        self.current = {}
+        self.file_hashes = {}
+        self.raw_sizes = {}  # Output -> size before minification, for the size report.
+        self.links = {}  # Page -> internal URLs it links to or loads, for validate_outputs().
+        self.output_stats = {}  # Output -> [size, mtime_ns, hash] as left by the last build, to tell which outputs changed.
+        self.output_hashes = {}  # Output -> [size, mtime_ns, hash] hashed during this build; see output_hash().
+        self.build_signature = file_hash(os.path.abspath(__file__))
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get('version') == MANIFEST_VERSION:
+                    self.output_stats = saved.get('output_stats', {})
+                if saved.get('version') == MANIFEST_VERSION and saved.get('build_signature') == self.build_signature:
+                    self.previous = saved.get('outputs', {})
+                    self.file_hashes = saved.get('file_hashes', {})
+                    self.raw_sizes = saved.get('raw_sizes', {})
+                    self.links = saved.get('links', {})
+            except (json.JSONDecodeError, OSError) as e:
+                logger.warning(f"  - WARNING: Ignoring unreadable build manifest: {e}")
+
+    @property
+    def is_empty(self):
+        return not self.previous
+
+    def hash_file(self, path):
+        # Files whose size and mtime are unchanged are not re-read.
+        key = os.path.relpath(path, ROOT_DIR)
+        cached = self.file_hashes.get(key)
+        if cached and self.changed_paths is not None and key not in self.changed_paths:
+            return cached[2]
+        stat = os.stat(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        digest = file_hash(path)
+        self.file_hashes[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def needs_build(self, output_path, inputs):
+        """Records `output_path` as produced by this build and tells whether it must be (re)written."""
+        self.record(output_path, inputs)
+        return self.previous_inputs(output_path) != inputs or not os.path.exists(output_path)
+
+    def previous_inputs(self, output_path):
+        return self.previous.get(os.path.relpath(output_path, self.output_dir))
+
+    def record(self, output_path, inputs):
+        self.current[os.path.relpath(output_path, self.output_dir)] = inputs
+
+    def record_raw_size(self, output_path, size):
+        self.raw_sizes[os.path.relpath(output_path, self.output_dir)] = size
+
+    def record_links(self, output_path, links):
+        self.links[os.path.relpath(output_path, self.output_dir)] = links
+
+    def changed_outputs(self):
+        """Returns the outputs of this build whose content differs from what the last build left behind.
+
+        Only outputs whose size or mtime moved are re-hashed. Pages rewritten in two passes (rendered,
+        then given inlined critical CSS) can end up identical to the last build's file under a new
+        mtime; those get their old mtime back and are left out of the list.
+        """
+        changed = []
+        for key in sorted(self.current):
+            try:
+                stat = os.stat(os.path.join(self.output_dir, key))
+            except FileNotFoundError:
+                continue
+            recorded = self.output_stats.get(key)
+            if recorded and recorded[:2] == [stat.st_size, stat.st_mtime_ns]:
+                continue
+            digest = self.output_hash(key, stat)
+            if recorded and recorded[0] == stat.st_size and recorded[2] == digest:
+                os.utime(os.path.join(self.output_dir, key), ns=(stat.st_atime_ns, recorded[1]))
+                continue
+            changed.append(key)
+            self.output_stats[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return changed
+
+    def output_hash(self, key, stat):
+        """The content hash of output `key` (`stat` is its os.stat()); the file is only read if its size or mtime
+        moved since the last build recorded it, and at most once per build."""
+        for recorded in (self.output_stats.get(key), self.output_hashes.get(key)):
+            if recorded and recorded[:2] == [stat.st_size, stat.st_mtime_ns]:
+                return recorded[2]
+        digest = file_hash(os.path.join(self.output_dir, key))
+        self.output_hashes[key] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def remove_output(self, key):
+        output_path = os.path.join(self.output_dir, key)
+        existed = os.path.exists(output_path)
+        if existed:
+            os.remove(output_path)
+            logger.info(f"  - Removed stale output '{key}'")
+        parent = os.path.dirname(output_path)
+        while parent and os.path.abspath(parent) != os.path.abspath(self.output_dir) and os.path.isdir(parent) and not os.listdir(parent):
+            os.rmdir(parent)
+            parent = os.path.dirname(parent)
+        return existed
+
+    def remove_stale_outputs(self):
+        """Deletes outputs the last build produced and this one did not; returns their keys."""
+        return [key for key in sorted(set(self.previous) - set(self.current)) if self.remove_output(key)]
+
+    def remove_unrecorded_outputs(self):
+        """Deletes every file in the output directory this build did not produce; returns their keys.
+
+        Full builds use this instead of wiping the directory, so unchanged outputs keep their mtimes.
+        Dotfiles and dot-directories (e.g. .nojekyll) are left alone.
+        """
+        unrecorded = []
+        for dirpath, dirnames, filenames in os.walk(self.output_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), self.output_dir)
+                if not filename.startswith('.') and key not in self.current:
+                    unrecorded.append(key)
+        return [key for key in sorted(unrecorded) if self.remove_output(key)]
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        live_hashes = {key: entry for key, entry in self.file_hashes.items() if os.path.exists(os.path.join(ROOT_DIR, key))}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'build_signature': self.build_signature, 'outputs': self.current, 'file_hashes': live_hashes,
+                       'raw_sizes': {key: size for key, size in self.raw_sizes.items() if key in self.current},
+                       'links': {key: links for key, links in self.links.items() if key in self.current},
+                       'output_stats': {key: entry for key, entry in self.output_stats.items() if key in self.current}}, f)
+        os.replace(tmp_path, self.path)
+
+def replace_if_changed(tmp_path, path):
+    """Renames `tmp_path` over `path` unless `path` already has the same content.
+
+    An identical output keeps its mtime, so git and rsync never have to look at it again. Returns True if replaced.
+    """
+    if os.path.exists(path) and os.path.getsize(path) == os.path.getsize(tmp_path) and filecmp.cmp(tmp_path, path, shallow=False):
+        os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, path)
+    return True
+
+def write_text(path, content):
+    """Writes `content` (a string or an iterable of strings, e.g. a template stream) through a temp file renamed into place."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', buffering=WRITE_BUFFER_SIZE) as f:
+        if isinstance(content, str):
+            f.write(content)
+        else:
+            f.writelines(content)
+    return replace_if_changed(tmp_path, path)
+
+def write_bytes(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(content)
+    return replace_if_changed(tmp_path, path)
+
+def copy_file(source_path, output_path, manifest):
+    if manifest.needs_build(output_path, {'source': manifest.hash_file(source_path)}):
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        shutil.copy2(source_path, output_path + '.tmp')
+        replace_if_changed(output_path + '.tmp', output_path)
+        return True
+    return False
 
 
 # --- Optimization Functions ---
-def optimize_images_to_webp(source_root, output_root):
-    print("-> Optimizing and converting images to WebP...")
+def _encode_image(job):
+    """Encodes one source image into a cache directory holding every variant plus a meta.json.
+
+    Runs in a worker process. Variants are written to a temp directory that is renamed into place
+    at the end, so a killed build never leaves a half-written cache entry behind.
+    """
+    source_path, cache_dir, settings = job
+    tmp_dir = f"{cache_dir}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        formats = ['webp'] + (['avif'] if settings['avif'] else [])
+        with Image.open(source_path) as img:
+            img = ImageOps.exif_transpose(img)
+            if img.mode not in ('RGB', 'RGBA'):
+                img = img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+            width, height = img.size
+            widths = [w for w in settings['widths'] if w < width]
+            for fmt in formats:
+                img.save(os.path.join(tmp_dir, f"full.{fmt}"), fmt, quality=settings['quality'])
+            for w in widths:
+                resized = img.resize((w, max(1, round(height * w / width))), Image.LANCZOS)
+                for fmt in formats:
+                    resized.save(os.path.join(tmp_dir, f"{w}.{fmt}"), fmt, quality=settings['quality'])
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'width': width, 'height': height, 'widths': widths, 'formats': formats}, f)
+        if os.path.exists(cache_dir):
+            shutil.rmtree(tmp_dir)
+        else:
+            os.replace(tmp_dir, cache_dir)
+        return source_path, None
+    except Exception as e:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return source_path, str(e)
+
+def read_image_cache_meta(cache_dir):
+    try:
+        with open(os.path.join(cache_dir, 'meta.json'), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def image_settings(quality=WEBP_QUALITY, widths=IMAGE_WIDTHS, avif=IMAGE_AVIF):
+    return {'quality': quality, 'widths': sorted(widths), 'avif': avif}
+
+def image_cache_dir(source_hash, settings):
+    # Keyed by content and encoder settings, so renamed or moved images are never re-encoded.
+    return os.path.join(IMAGE_CACHE_DIR, hashlib.sha256(f"{source_hash}:{json.dumps(settings, sort_keys=True)}".encode()).hexdigest())
+
+def prepare_image(source_path, max_dimension=None, quality=WEBP_QUALITY, widths=IMAGE_WIDTHS, avif=IMAGE_AVIF):
+    """Normalizes an uploaded image in place and encodes its variants into the image cache ahead of the build.
+
+    The EXIF orientation is applied (and the EXIF block dropped), and the image is downscaled so neither
+    side exceeds `max_dimension`. Encoding uses the same settings and cache key as the build, which then
+    only copies the ready-made variants. The file is left alone if it was replaced while being processed.
+    Returns the image's metadata. The CMS runs this in a worker process.
+    """
+    if not source_path.lower().endswith(IMAGE_EXTENSIONS):
+        return {'bytes': os.path.getsize(source_path)}
+    stat = os.stat(source_path)
+    with Image.open(source_path) as img:
+        fmt, size, exif = img.format, img.size, img.getexif()
+        taken = exif.get(0x0132)  # DateTime
+        rotated = exif.get(0x0112, 1) != 1  # Orientation
+        oversized = bool(max_dimension) and max(size) > max_dimension
+        if rotated or oversized:
+            normalized = ImageOps.exif_transpose(img)
+            if oversized:
+                normalized.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+            tmp_path = f"{source_path}.{os.getpid()}.tmp"
+            save_options = {'quality': 90, 'optimize': True} if fmt == 'JPEG' else {'optimize': True}
+            normalized.save(tmp_path, fmt, icc_profile=img.info.get('icc_profile'), **save_options)
+            size = normalized.size
+            current = os.stat(source_path)
+            if (current.st_size, current.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                os.replace(tmp_path, source_path)
+            else:
+                os.remove(tmp_path)
+    settings = image_settings(quality, widths, avif and features.check('avif'))
+    cache_dir = image_cache_dir(file_hash(source_path), settings)
+    meta = read_image_cache_meta(cache_dir)
+    if meta is None:
+        _, error = _encode_image((source_path, cache_dir, settings))
+        if error:
+            raise RuntimeError(error)
+        meta = read_image_cache_meta(cache_dir)
+    return {'width': size[0], 'height': size[1], 'format': fmt, 'bytes': os.path.getsize(source_path), 'taken': taken,
+            'variants': len(meta['formats']) * (len(meta['widths']) + 1)}
+
+def image_variant_files(meta):
+    """Yields (cache filename, output suffix) pairs, e.g. ('480.webp', '-480w.webp')."""
+    for fmt in meta['formats']:
+        yield f"full.{fmt}", f".{fmt}"
+        for w in meta['widths']:
+            yield f"{w}.{fmt}", f"-{w}w.{fmt}"
+
+def optimize_images_to_webp(source_root, output_root, manifest, quality=WEBP_QUALITY, workers=IMAGE_WORKERS, widths=IMAGE_WIDTHS, avif=IMAGE_AVIF, profiler=None):
+    """Converts every JPEG/PNG under `source_root` into WebP (and optionally AVIF) files under `output_root`.
+
+    Next to the full-size `name.webp`, a `name-<width>w.webp` variant is emitted for every entry of
+    `widths` narrower than the source. Encoded files are cached in IMAGE_CACHE_DIR under a key made
+    of the source content hash and the encoder settings, so an image is only ever encoded once per
+    setting no matter how often it is renamed, moved or rebuilt. Cache misses are encoded in a
+    process pool. Every entry used is touched, so prune_image_cache() can drop the ones no build needs.
+
+    Returns the image metadata (intrinsic size and available variants) keyed by the source path
+    relative to `source_root`, which `responsive_image()` uses to render `srcset`, `width` and `height`.
+    """
+    logger.info("-> Optimizing and converting images to WebP...")
+    started = time.perf_counter()
+    os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+    if avif and not features.check('avif'):
+        logger.warning("  - WARNING: This Pillow build has no AVIF support, skipping AVIF variants.")
+        avif = False
+    settings = image_settings(quality, widths, avif)
+    image_meta = {}
+    pending = {}  # cache_dir -> [(source_path, relative_path), ...]
+    unchanged = cached = 0
     for dirpath, _, filenames in os.walk(source_root):
         for filename in filenames:
-            if filename.lower().endswith(('.png', '.jpg', '.jpeg')):
+            if filename.lower().endswith(IMAGE_EXTENSIONS):
                 source_path = os.path.join(dirpath, filename)
-                relative_path = os.path.relpath(source_path, source_root)
-                output_path = os.path.join(output_root, os.path.splitext(relative_path)[0] + '.webp')
-                os.makedirs(os.path.dirname(output_path), exist_ok=True)
-                try:
-                    with Image.open(source_path) as img:
-                        img.save(output_path, 'webp', quality=80)
-                except Exception as e:
-                    print(f"  - Could not convert {filename}: {e}")
-
-def minify_and_copy_assets(source_dir, output_dir):
-    print("-> Minifying and copying assets...")
-    os.makedirs(output_dir, exist_ok=True)
-    for item in os.listdir(source_dir):
-        source_item = os.path.join(source_dir, item)
-        output_item = os.path.join(output_dir, item)
-        if os.path.isdir(source_item):
-            minify_and_copy_assets(source_item, output_item)
-        elif item.endswith('.css'):
-            with open(source_item, 'r', encoding='utf-8') as f_in, open(output_item, 'w', encoding='utf-8') as f_out:
-                f_out.write(csscompressor.compress(f_in.read()))
-        elif item.endswith('.js'):
-            with open(source_item, 'r', encoding='utf-8') as f_in, open(output_item, 'w', encoding='utf-8') as f_out:
-                f_out.write(jsmin.jsmin(f_in.read()))
+                relative_path = os.path.relpath(source_path, source_root).replace(os.sep, '/')
+                cache_dir = image_cache_dir(manifest.hash_file(source_path), settings)
+                meta = read_image_cache_meta(cache_dir)
+                if meta:
+                    os.utime(os.path.join(cache_dir, 'meta.json'))  # Marks the entry as used for prune_image_cache().
+                    image_meta[relative_path] = meta
+                    if record_image_outputs(manifest, output_root, relative_path, cache_dir, meta):
+                        cached += 1
+                    else:
+                        unchanged += 1
+                    continue
+                if os.path.exists(cache_dir):
+                    shutil.rmtree(cache_dir)  # Entry without a readable meta.json is incomplete.
+                pending.setdefault(cache_dir, []).append((source_path, relative_path))
+
+    misses = [(targets[0][0], cache_dir, settings) for cache_dir, targets in pending.items()]
+    failed = set()
+    if misses:
+        if workers > 1 and len(misses) > 1:
+            with ProcessPoolExecutor(max_workers=min(workers, len(misses)), mp_context=POOL_CONTEXT) as pool:
+                results = list(pool.map(_encode_image, misses))
+        else:
+            results = [_encode_image(job) for job in misses]
+        for source_path, error in results:
+            if error:
+                failed.add(source_path)
+                logger.error(f"  - Could not convert {os.path.basename(source_path)}: {error}")
+
+    for cache_dir, targets in pending.items():
+        if targets[0][0] in failed:
+            continue
+        cached += len(targets) - 1
+        meta = read_image_cache_meta(cache_dir)
+        for _, relative_path in targets:
+            image_meta[relative_path] = meta
+            record_image_outputs(manifest, output_root, relative_path, cache_dir, meta, force=True)
+
+    elapsed = time.perf_counter() - started
+    logger.info(f"  - {len(misses) - len(failed)} converted, {cached} from cache, {unchanged} unchanged, {len(failed)} failed in {elapsed:.2f}s.")
+    if profiler:
+        profiler.cache('images', hits=cached + unchanged, misses=len(misses))
+    return image_meta
+
+def prune_image_cache(max_age=IMAGE_CACHE_MAX_AGE):
+    """Deletes image cache entries whose meta.json (or, for an incomplete entry, whose directory) is older than `max_age`."""
+    if not os.path.isdir(IMAGE_CACHE_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(IMAGE_CACHE_DIR):
+        if not entry.is_dir():
+            continue
+        try:
+            used = os.stat(os.path.join(entry.path, 'meta.json')).st_mtime
+        except FileNotFoundError:
+            used = entry.stat().st_mtime
+        if used < cutoff:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+def record_image_outputs(manifest, output_root, relative_path, cache_dir, meta, force=False):
+    """Registers every variant of one image with the manifest and copies the stale ones out of the cache."""
+    base = os.path.join(output_root, os.path.splitext(relative_path)[0])
+    inputs = {'cache': os.path.basename(cache_dir)}
+    copied = False
+    for cache_name, suffix in image_variant_files(meta):
+        output_path = base + suffix
+        if manifest.needs_build(output_path, inputs) or force:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+            shutil.copyfile(os.path.join(cache_dir, cache_name), output_path + '.tmp')
+            replace_if_changed(output_path + '.tmp', output_path)
+            copied = True
+    return copied
+
+@pass_environment
+def responsive_image(env, path, alt='', sizes='100vw', css_class='lazyload'):
+    """Renders a lazy-loaded `<img>` (or `<picture>` when AVIF variants exist) for a content image.
+
+    `path` is relative to `content/images`, e.g. 'banners/banner-1.jpg'. Images unknown to the
+    image stage fall back to a plain `<img>` pointing at the WebP file.
+    """
+    if not path or path.endswith('/'):
+        return Markup('')
+    base = '/content/images/' + os.path.splitext(path)[0]
+    env.record_dependency('image', path)
+    meta = env.image_meta.get(path)
+    if not meta:
+        return Markup('<img data-src="{}" alt="{}" class="{}">').format(base + '.webp', alt, css_class)
+
+    def srcset(fmt):
+        return ', '.join([f"{base}-{w}w.{fmt} {w}w" for w in meta['widths']] + [f"{base}.{fmt} {meta['width']}w"])
+
+    img = Markup('<img data-src="{}" data-srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" class="{}">').format(
+        base + '.webp', srcset('webp'), sizes, meta['width'], meta['height'], alt, css_class)
+    if 'avif' in meta['formats']:
+        return Markup('<picture><source type="image/avif" data-srcset="{}" sizes="{}">{}</picture>').format(srcset('avif'), sizes, img)
+    return img
+
+@pass_environment
+def image_url(env, path):
+    """URL of the full-size WebP of a content image, e.g. for linking a thumbnail to it."""
+    env.record_dependency('image', path)
+    return '/content/images/' + os.path.splitext(path)[0] + '.webp'
+
+def media_path(name, folder=''):
+    """Resolves an image field to a path under CONTENT_IMAGES_DIR.
+
+    Media-store names ('media/<hash>.jpg') are already such a path; older plain file names live in `folder`.
+    """
+    if not name or name.startswith(MEDIA_PREFIX) or not folder:
+        return name
+    return f"{folder}/{name}"
+
+def fingerprint_name(path, content):
+    """'css/style.css' -> 'css/style.<hash of content>.css'."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:10]}{ext}"
+
+def minify_asset(path, content):
+    if path.endswith('.css'):
+        return csscompressor.compress(content.decode('utf-8')).encode('utf-8')
+    if path.endswith('.js'):
+        # Backticks must count as quotes, or the '//' in `https://...` template literals is stripped as a comment.
+        return jsmin.jsmin(content.decode('utf-8'), quote_chars="'\"`").encode('utf-8')
+    return content
+
+HTML_PROTECTED_RE = re.compile(r'(<(pre|textarea|script|style)\b.*?</\2\s*>)', re.S | re.I)
+# Block-level and metadata elements only: whitespace next to them is never rendered. Inline and inline-block
+# elements (<picture>, <iframe>, <br>, table cells, ...) keep their collapsed space, which can be a visible gap.
+HTML_BLOCK_TAGS = r'(?:html|head|body|meta|link|title|base|script|style|noscript|div|section|header|footer|main|nav|article|aside|ul|ol|li|p|h[1-6]|form|fieldset|table|thead|tbody|tr|figure|blockquote|hr|!DOCTYPE)'
+HTML_SPACE_BEFORE_BLOCK_RE = re.compile(r'\s+(</?' + HTML_BLOCK_TAGS + r'\b)', re.I)
+HTML_SPACE_AFTER_BLOCK_RE = re.compile(r'(</?' + HTML_BLOCK_TAGS + r'\b[^>]*>)\s+', re.I)
+
+def minify_html(html):
+    """Strips comments and template whitespace from rendered HTML.
+
+    Runs of whitespace collapse to one space, and whitespace next to the block-level and metadata tags
+    in HTML_BLOCK_TAGS, where browsers do not render it, is removed. <pre>, <textarea>, <script> and
+    <style> are left as they are.
+    """
+    parts = HTML_PROTECTED_RE.split(html)
+    minified = []
+    # split() yields text, protected block, tag name, text, ...
+    for i in range(0, len(parts), 3):
+        text = re.sub(r'<!--(?!\[if).*?-->', '', parts[i], flags=re.S)
+        text = re.sub(r'\s+', ' ', text)
+        text = HTML_SPACE_AFTER_BLOCK_RE.sub(r'\1', HTML_SPACE_BEFORE_BLOCK_RE.sub(r'\1', text))
+        minified.append(text)
+        if i + 1 < len(parts):
+            minified.append(parts[i + 1])
+    return ''.join(minified).strip()
+
+def build_assets(source_dir, output_dir, manifest):
+    """Minifies, bundles and fingerprints everything in `source_dir` into `output_dir`.
+
+    Every output file is named after a hash of its content, so it can be served with a far-future
+    immutable cache header, and the scripts listed in ASSET_BUNDLES are concatenated into one file.
+    Returns the logical -> fingerprinted name map that templates look names up in through `asset_url()`.
+    PURGED_STYLESHEET is left to `optimize_css()`, which can only build it once every page is rendered.
+    """
+    logger.info("-> Bundling, minifying and fingerprinting assets...")
+    asset_manifest_path = os.path.join(output_dir, ASSET_MANIFEST_NAME)
+    previous_map = {}
+    if os.path.exists(asset_manifest_path):
+        try:
+            with open(asset_manifest_path, 'r', encoding='utf-8') as f:
+                previous_map = json.load(f)
+            if not isinstance(previous_map, dict):
+                raise ValueError("not a JSON object")
+        except (OSError, ValueError) as e:  # json.JSONDecodeError is a ValueError.
+            logger.warning(f"  - WARNING: Ignoring unreadable asset manifest: {e}")
+            previous_map = {}
+
+    bundled = {member for members in ASSET_BUNDLES.values() for member in members}
+    relative_paths = (os.path.relpath(path, source_dir).replace(os.sep, '/') for path in list_files(source_dir))
+    sources = {path: [path] for path in relative_paths if path not in bundled and path != PURGED_STYLESHEET}
+    sources.update(ASSET_BUNDLES)
+
+    asset_map = {}
+    for logical, members in sorted(sources.items()):
+        member_paths = [os.path.join(source_dir, member) for member in members if os.path.exists(os.path.join(source_dir, member))]
+        if len(member_paths) != len(members):
+            logger.warning(f"  - WARNING: Missing files in asset bundle '{logical}'")
+        if not member_paths:
+            continue
+        inputs = {'sources': [manifest.hash_file(path) for path in member_paths]}
+        previous_name = previous_map.get(logical)
+        if previous_name and manifest.previous_inputs(os.path.join(output_dir, previous_name)) == inputs and os.path.exists(os.path.join(output_dir, previous_name)):
+            manifest.record(os.path.join(output_dir, previous_name), inputs)
+            asset_map[logical] = previous_name
+            continue
+        parts = []
+        for path in member_paths:
+            with open(path, 'rb') as f:
+                parts.append(minify_asset(path, f.read()))
+        content = b';\n'.join(parts)
+        asset_map[logical] = fingerprint_name(logical, content)
+        output_path = os.path.join(output_dir, asset_map[logical])
+        write_bytes(output_path, content)
+        manifest.record(output_path, inputs)
+        manifest.record_raw_size(output_path, sum(os.path.getsize(path) for path in member_paths))
+    return asset_map
+
+def write_asset_manifest(output_dir, asset_map, manifest):
+    """Writes the logical -> fingerprinted name map to `output_dir`/manifest.json."""
+    asset_manifest_path = os.path.join(output_dir, ASSET_MANIFEST_NAME)
+    map_json = json.dumps(asset_map, indent=2, sort_keys=True)
+    if manifest.needs_build(asset_manifest_path, {'assets': hashlib.sha256(map_json.encode('utf-8')).hexdigest()}):
+        write_text(asset_manifest_path, map_json)
+
+@pass_environment
+def asset_url(env, path):
+    """Jinja global: the URL of the fingerprinted build of `path` (relative to src/assets, e.g. 'css/style.css')."""
+    env.record_dependency('asset', path)
+    return '/assets/' + env.asset_map.get(path, path)
+
+# --- CSS Optimization ---
+STYLESHEET_BLOCK_RE = re.compile(r'<link rel="stylesheet" href="/assets/%s">|<style data-critical-css>.*?</noscript>' % re.escape(PURGED_STYLESHEET), re.S)
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+
+def parse_css(text):
+    """Splits a stylesheet into (prelude, body) rules.
+
+    `body` is the declaration string of a style rule, @font-face or @keyframes, the parsed child rules
+    of an @media/@supports block, or None for statements like @import.
+    """
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    rules, i = [], 0
+    while True:
+        brace = text.find('{', i)
+        semicolon = text.find(';', i)
+        if 0 <= semicolon < brace and text[i:semicolon].strip().startswith('@'):
+            rules.append((text[i:semicolon].strip(), None))
+            i = semicolon + 1
+            continue
+        if brace == -1:
+            return rules
+        depth, j = 1, brace + 1
+        while depth and j < len(text):
+            depth += {'{': 1, '}': -1}.get(text[j], 0)
+            j += 1
+        prelude, body = text[i:brace].strip(), text[brace + 1:j - 1]
+        rules.append((prelude, parse_css(body) if prelude.startswith(('@media', '@supports')) else body.strip()))
+        i = j
+
+def serialize_css(rules):
+    return ''.join(f"{prelude};" if body is None else f"{prelude}{{{serialize_css(body) if isinstance(body, list) else body}}}" for prelude, body in rules)
+
+def split_selectors(prelude):
+    selectors, depth, start = [], 0, 0
+    for i, char in enumerate(prelude):
+        depth += {'(': 1, ')': -1, '[': 1, ']': -1}.get(char, 0)
+        if char == ',' and depth == 0:
+            selectors.append(prelude[start:i].strip())
+            start = i + 1
+    selectors.append(prelude[start:].strip())
+    return selectors
+
+@functools.lru_cache(maxsize=None)
+def selector_tokens(selector):
+    """The tags, classes and ids an element tree must contain for `selector` to possibly match.
+
+    Pseudo-classes (including :not()) and attribute selectors are ignored, so the check errs on the
+    side of keeping a rule.
+    """
+    simple = re.sub(r'::?[\w-]+(\([^)]*\))?|\[[^\]]*\]', '', selector)
+    return (frozenset(re.findall(r'(?:^|[\s>+~])([a-zA-Z][\w-]*)', simple)),
+            frozenset(re.findall(r'\.([\w-]+)', simple)), frozenset(re.findall(r'#([\w-]+)', simple)))
+
+def filter_css(rules, tokens):
+    """Keeps the rules (and selectors) that can match an element described by `tokens` = {'tags', 'classes', 'ids'}."""
+    kept = []
+    for prelude, body in rules:
+        if isinstance(body, list):
+            children = filter_css(body, tokens)
+            if children:
+                kept.append((prelude, children))
+        elif prelude.startswith('@'):
+            kept.append((prelude, body))
+        else:
+            selectors = [selector for selector in split_selectors(prelude) if all(
+                needed <= tokens[kind] for needed, kind in zip(selector_tokens(selector), ('tags', 'classes', 'ids')))]
+            if selectors:
+                kept.append((','.join(selectors), body))
+    return kept
+
+class PageTokenCollector(HTMLParser):
+    """Collects the tags, classes and ids of a page, and separately those above the fold.
+
+    "Above the fold" is approximated as everything up to the end of the first element inside <main>,
+    i.e. the <head>, the site header and the page's first section.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.tokens = {'tags': set(), 'classes': set(), 'ids': set()}
+        self.critical = {'tags': set(), 'classes': set(), 'ids': set()}
+        self.depth = 0
+        self.main_depth = None
+        self.fold_depth = None
+        self.past_fold = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        for target in (self.tokens,) if self.past_fold else (self.tokens, self.critical):
+            target['tags'].add(tag)
+            target['classes'].update((attrs.get('class') or '').split())
+            if attrs.get('id'):
+                target['ids'].add(attrs['id'])
+        if tag in VOID_ELEMENTS:
+            return
+        self.depth += 1
+        if tag == 'main' and self.main_depth is None:
+            self.main_depth = self.depth
+        elif self.main_depth is not None and self.fold_depth is None and self.depth == self.main_depth + 1:
+            self.fold_depth = self.depth
+
+    def handle_endtag(self, tag):
+        if tag in VOID_ELEMENTS:
+            return
+        if self.fold_depth is not None and self.depth == self.fold_depth:
+            self.past_fold = True
+        self.depth -= 1
+
+def collect_page_tokens(html):
+    collector = PageTokenCollector()
+    collector.feed(html)
+    return {kind: sorted(values) for kind, values in collector.tokens.items()}, {kind: sorted(values) for kind, values in collector.critical.items()}
+
+def script_tokens(source_dir):
+    """Every identifier-like word in the site's scripts, so classes added from JS (e.g. 'active-slide') survive purging."""
+    words = set()
+    for path in list_files(source_dir, ('.js',)):
+        with open(path, 'r', encoding='utf-8') as f:
+            words.update(re.findall(r'[A-Za-z_][\w-]*', f.read()))
+    return words
+
+def optimize_css(source_dir, output_dir, asset_map, manifest, pages):
+    """Builds PURGED_STYLESHEET from the rendered pages and inlines each page's critical CSS.
+
+    Runs after every page is rendered. Selectors that cannot match any page (or any class named in
+    the site's scripts) are dropped from the shipped stylesheet. In every page, the stylesheet link is
+    replaced by an inline <style> holding the rules that match above the fold, plus a non-blocking load
+    of the full stylesheet. Each page's tokens are cached by file size and mtime in CSS_CACHE_FILE,
+    so unchanged pages are neither re-parsed nor rewritten unless the stylesheet itself changed.
+    """
+    logger.info("-> Purging unused CSS and inlining critical CSS...")
+    source_path = os.path.join(source_dir, PURGED_STYLESHEET)
+    if not os.path.exists(source_path):
+        return
+    try:
+        with open(CSS_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cache = {}
+    if cache.get('build_signature') != manifest.build_signature:
+        cache = {}
+    cached_pages = cache.get('pages', {})
+
+    page_state = {}
+    for page in pages:
+        path = os.path.join(OUTPUT_DIR, page)
+        stat = os.stat(path)
+        state = cached_pages.get(page)
+        if not state or state['stat'] != [stat.st_size, stat.st_mtime_ns]:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            if not STYLESHEET_BLOCK_RE.search(html):
+                continue
+            tokens, critical = collect_page_tokens(html)
+            state = {'stat': None, 'tokens': tokens, 'critical': critical, 'applied': None}
+        page_state[page] = state
+
+    used = {'tags': set(), 'classes': set(), 'ids': set()}
+    for state in page_state.values():
+        for kind in used:
+            used[kind].update(state['tokens'][kind])
+    words = script_tokens(source_dir)
+    used['classes'] |= words
+    used['ids'] |= words
+
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source_css = f.read()
+    rules = filter_css(parse_css(source_css), used)
+    content = csscompressor.compress(serialize_css(rules)).encode('utf-8')
+    asset_map[PURGED_STYLESHEET] = fingerprint_name(PURGED_STYLESHEET, content)
+    stylesheet_path = os.path.join(output_dir, asset_map[PURGED_STYLESHEET])
+    if manifest.needs_build(stylesheet_path, {'css': hashlib.sha256(content).hexdigest()}):
+        write_bytes(stylesheet_path, content)
+        manifest.record_raw_size(stylesheet_path, len(source_css.encode('utf-8')))
+    url = '/assets/' + asset_map[PURGED_STYLESHEET]
+
+    rewritten = 0
+    for page, state in page_state.items():
+        critical_css = csscompressor.compress(serialize_css(filter_css(rules, {kind: set(values) for kind, values in state['critical'].items()})))
+        block = (f'<style data-critical-css>{critical_css}</style>'
+                 f'<link rel="preload" href="{url}" as="style" onload="this.onload=null;this.rel=\'stylesheet\'">'
+                 f'<noscript><link rel="stylesheet" href="{url}"></noscript>')
+        applied = hashlib.sha256(block.encode('utf-8')).hexdigest()
+        path = os.path.join(OUTPUT_DIR, page)
+        if state['stat'] is None or state['applied'] != applied:
+            with open(path, 'r', encoding='utf-8') as f:
+                html = f.read()
+            inlined = STYLESHEET_BLOCK_RE.sub(lambda match: block, html, count=1)
+            write_text(path, inlined)
+            if page in manifest.raw_sizes:
+                manifest.raw_sizes[page] += len(inlined.encode('utf-8')) - len(html.encode('utf-8'))
+            rewritten += 1
+        stat = os.stat(path)
+        state.update(stat=[stat.st_size, stat.st_mtime_ns], applied=applied)
+
+    os.makedirs(os.path.dirname(CSS_CACHE_FILE), exist_ok=True)
+    tmp_path = CSS_CACHE_FILE + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({'build_signature': manifest.build_signature, 'pages': page_state}, f)
+    os.replace(tmp_path, CSS_CACHE_FILE)
+    logger.info(f"  - Stylesheet: {len(source_css.encode('utf-8')) // 1024} KB source -> {len(content) // 1024} KB purged and minified; {rewritten} pages updated.")
+
+# --- Output Compression ---
+def _compress_file(job):
+    path, encoding = job
+    with open(path, 'rb') as f:
+        data = f.read()
+    write_bytes(f"{path}.{encoding}", gzip.compress(data, compresslevel=9, mtime=0) if encoding == 'gz' else brotli.compress(data, quality=11))
+
+def compress_outputs(output_dir, manifest, workers=COMPRESS_WORKERS):
+    """Writes .gz (and, with the brotli package, .br) siblings of every compressible output, in a thread pool.
+
+    A sibling is only rewritten when its source file's content hash changed since the last build, so
+    unchanged pages are never recompressed, even when they were rewritten with identical content. Outputs under COMPRESS_MIN_SIZE get no siblings; one left by
+    an earlier build is removed with the other stale outputs. Returns the paths compressed in this build.
+    """
+    logger.info("-> Precompressing outputs...")
+    encodings = ('gz', 'br') if brotli else ('gz',)
+    jobs, changed = [], set()
+    for key in sorted(manifest.current):
+        if not key.endswith(COMPRESS_EXTENSIONS):
+            continue
+        path = os.path.join(output_dir, key)
+        stat = os.stat(path)
+        if stat.st_size < COMPRESS_MIN_SIZE:
+            continue
+        for encoding in encodings:
+            if manifest.needs_build(f"{path}.{encoding}", {'source': manifest.output_hash(key, stat)}):
+                jobs.append((path, encoding))
+                changed.add(key)
+    if len(jobs) > 1 and workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            list(pool.map(_compress_file, jobs))
+    else:
+        for job in jobs:
+            _compress_file(job)
+    logger.info(f"  - {len(jobs)} files compressed ({', '.join(encodings)}), {len(changed)} outputs changed.")
+    return changed
+
+def size_report(output_dir, manifest, changed):
+    """Logs raw / minified / compressed sizes for the outputs compressed in this build, and totals for all.
+
+    The full per-file report is written to SIZE_REPORT_FILE.
+    """
+    def size(path):
+        return os.path.getsize(path) if os.path.exists(path) else None
+
+    rows = []
+    for key in sorted(manifest.current):
+        if key.endswith(COMPRESS_EXTENSIONS):
+            path = os.path.join(output_dir, key)
+            minified = size(path)
+            rows.append({'file': key, 'raw': manifest.raw_sizes.get(key, minified), 'minified': minified, 'gzip': size(path + '.gz'), 'brotli': size(path + '.br')})
+    os.makedirs(os.path.dirname(SIZE_REPORT_FILE), exist_ok=True)
+    with open(SIZE_REPORT_FILE, 'w', encoding='utf-8') as f:
+        json.dump(rows, f, indent=2)
+
+    def column(value):
+        return f"{value:>10,}" if value is not None else f"{'-':>10}"
+
+    logger.info("-> Size report (bytes):")
+    logger.info(f"  {'raw':>10} {'minified':>10} {'gzip':>10} {'brotli':>10}  file")
+    for row in rows:
+        if row['file'] in changed:
+            logger.info(f"  {column(row['raw'])} {column(row['minified'])} {column(row['gzip'])} {column(row['brotli'])}  {row['file']}")
+    totals = {field: sum(row[field] or 0 for row in rows) for field in ('raw', 'minified', 'gzip', 'brotli')}
+    logger.info(f"  {column(totals['raw'])} {column(totals['minified'])} {column(totals['gzip'])} {column(totals['brotli'] or None)}  TOTAL ({len(rows)} files; full report in {os.path.relpath(SIZE_REPORT_FILE, ROOT_DIR)})")
+    return totals
+
+# --- Markdown Rendering ---
+def _normalize_newlines(text):
+    # Browsers submit \r\n; files read back in text mode have \n. Both must hit the same cache entry.
+    return text.replace('\r\n', '\n').replace('\r', '\n')
+
+def _markdown_cache_path(text, extras):
+    options = json.dumps({'markdown2': markdown2.__version__, 'extras': sorted(extras)}, sort_keys=True)
+    key = hashlib.sha256(f"{options}\0{text}".encode('utf-8')).hexdigest()
+    return os.path.join(MARKDOWN_CACHE_DIR, f"{key}.html")
+
+def _convert_markdown(text, extras):
+    return markdown2.markdown(text, extras=extras)
+
+def _read_markdown_cache(cache_path):
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            html = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(cache_path)  # Marks the entry as used for prune_markdown_cache().
+    return html
+
+def _write_markdown_cache(cache_path, html):
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(html)
+    os.replace(tmp_path, cache_path)
+
+def render_markdown(text, extras=MARKDOWN_EXTRAS):
+    """Converts markdown to HTML, reusing the persistent render cache in MARKDOWN_CACHE_DIR.
+
+    Entries are keyed by the text, the markdown2 version and `extras`, so they never go stale.
+    The CMS calls this when a post is saved so the following build finds the post already converted.
+    """
+    text = _normalize_newlines(text)
+    cache_path = _markdown_cache_path(text, extras)
+    html = _read_markdown_cache(cache_path)
+    if html is None:
+        html = _convert_markdown(text, extras)
+        _write_markdown_cache(cache_path, html)
+    return html
+
+def warm_markdown_cache(md_paths, extras=MARKDOWN_EXTRAS, workers=IMAGE_WORKERS):
+    """Converts the markdown files missing from the render cache, in a process pool when there are many.
+
+    Returns (cached, converted) counts.
+    """
+    misses = {}
+    for md_path in md_paths:
+        with open(md_path, 'r', encoding='utf-8') as f:
+            text = _normalize_newlines(f.read())
+        cache_path = _markdown_cache_path(text, extras)
+        if not os.path.exists(cache_path):
+            misses[cache_path] = text
+    if len(misses) >= MARKDOWN_POOL_MIN and workers > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(misses)), mp_context=POOL_CONTEXT) as pool:
+            results = list(pool.map(_convert_markdown, misses.values(), itertools.repeat(extras), chunksize=max(1, len(misses) // (workers * 4))))
+    else:
+        results = [_convert_markdown(text, extras) for text in misses.values()]
+    for cache_path, html in zip(misses, results):
+        _write_markdown_cache(cache_path, html)
+    return len(md_paths) - len(misses), len(misses)
+
+def prune_markdown_cache(max_age=MARKDOWN_CACHE_MAX_AGE):
+    if not os.path.isdir(MARKDOWN_CACHE_DIR):
+        return
+    cutoff = time.time() - max_age
+    for entry in os.scandir(MARKDOWN_CACHE_DIR):
+        if entry.stat().st_mtime < cutoff:
+            os.remove(entry.path)
+
+# --- Dependency Tracking ---
+class TrackingContext(Context):
+    """Template context that reports every variable a template looks up to its environment."""
+
+    def resolve_or_missing(self, key):
+        self.environment.record_dependency('data', key)
+        return super().resolve_or_missing(key)
+
+class SiteEnvironment(Environment):
+    """Jinja environment that can record which templates, data keys and images a render reads.
+
+    Recorded dependencies are strings of the form 'template:<name>', 'data:<key>', 'image:<path>',
+    'asset:<path>' and 'file:<path>'; see `dependency_signature()` for how each is hashed.
+    """
+    context_class = TrackingContext
+
+    def __init__(self, image_meta=None, asset_map=None, profiler=None, **options):
+        super().__init__(**options)
+        self.image_meta = image_meta or {}
+        self.asset_map = asset_map or {}
+        self.profiler = profiler
+        self.site_keys = set()
+        self._tracking = threading.local()  # Pages render on several threads; each records its own dependencies.
+
+    @property
+    def recorded(self):
+        return getattr(self._tracking, 'recorded', None)
+
+    @recorded.setter
+    def recorded(self, value):
+        self._tracking.recorded = value
+
+    def set_site_data(self, site_data):
+        """Makes the site data (one key per src/data/*.json file) globals, so pages only pass their own context."""
+        for key in self.site_keys:
+            self.globals.pop(key, None)
+        self.globals.update(site_data)
+        self.site_keys = set(site_data)
+
+    def record_dependency(self, kind, name):
+        if self.recorded is not None:
+            self.recorded.add(f"{kind}:{name}")
+
+    def get_template(self, name, parent=None, globals=None):
+        # Also called for every {% extends %} and {% include %}, cached or not.
+        self.record_dependency('template', getattr(name, 'name', name))
+        return super().get_template(name, parent, globals)
+
+    @contextmanager
+    def track(self):
+        self.recorded = set()
+        try:
+            yield self.recorded
+        finally:
+            self.recorded = None
+
+def dependency_signature(dependency, manifest, env):
+    kind, _, name = dependency.partition(':')
+    if kind == 'asset':
+        return env.asset_map.get(name, 'missing')
+    if kind == 'image':
+        meta = env.image_meta.get(name)
+        return hashlib.sha256(json.dumps(meta, sort_keys=True).encode()).hexdigest() if meta else 'missing'
+    path = {'template': lambda: os.path.join(TEMPLATES_DIR, name), 'data': lambda: os.path.join(DATA_DIR, name + '.json')}.get(kind, lambda: os.path.join(ROOT_DIR, name))()
+    return manifest.hash_file(path) if os.path.exists(path) else 'missing'
+
+def page_context_hash(page_context):
+    return hashlib.sha256(json.dumps(page_context, sort_keys=True, default=str).encode()).hexdigest()
+
+def page_is_current(env, manifest, output_path, context_hash):
+    """Tells whether the last render of `output_path` used this page context and no recorded dependency changed since."""
+    previous = manifest.previous_inputs(output_path)
+    return bool(previous) and previous.get('context') == context_hash and os.path.exists(output_path) and all(
+        dependency_signature(dep, manifest, env) == value for dep, value in previous.items() if dep != 'context')
+
+def render_page(env, manifest, template_name, output_path, page_context, files=(), prepare=None):
+    """Renders `template_name` to `output_path` unless none of the page's recorded dependencies changed.
+
+    The templates, data keys and images read by the previous render are stored as the page's inputs
+    in the manifest, so a page is only re-rendered when one of those, one of `files` or its own
+    `page_context` changed. `prepare` returns extra context that is only worth computing when the
+    page is actually rendered (e.g. converted markdown). Returns True when the page was written.
+    """
+    started = time.perf_counter()
+    context_hash = page_context_hash(page_context)
+    if page_is_current(env, manifest, output_path, context_hash):
+        manifest.record(output_path, manifest.previous_inputs(output_path))
+        return False
+
+    context = dict(page_context, **prepare()) if prepare else page_context
+    with env.track() as recorded:
+        template = env.get_template(template_name)
+        if output_path.endswith('.html'):
+            html = template.render(context)
+            manifest.record_links(output_path, page_links(html))
+            manifest.record_raw_size(output_path, len(html.encode('utf-8')))
+            write_text(output_path, minify_html(html) if MINIFY_HTML else html)
+        else:
+            write_text(output_path, template.generate(context))  # Streamed into the buffered file write.
+    recorded.update(f"file:{os.path.relpath(path, ROOT_DIR)}" for path in files)
+    local_names = set(context) | (set(env.globals) - env.site_keys)
+    inputs = {dep: dependency_signature(dep, manifest, env) for dep in sorted(recorded)
+              if not (dep.startswith('data:') and dep[len('data:'):] in local_names)}
+    inputs['context'] = context_hash
+    manifest.record(output_path, inputs)
+    if env.profiler:
+        env.profiler.record_output(output_path, time.perf_counter() - started)
+    return True
+
+_environment = None
+
+def new_site_environment():
+    """A SiteEnvironment over TEMPLATES_DIR with the site's globals and filters and the shared bytecode cache."""
+    os.makedirs(JINJA_CACHE_DIR, exist_ok=True)
+    env = SiteEnvironment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True, bytecode_cache=FileSystemBytecodeCache(JINJA_CACHE_DIR))
+    env.globals.update(responsive_image=responsive_image, asset_url=asset_url, image_url=image_url)
+    env.filters.update(slugify=slugify, media_path=media_path)
+    return env
+
+def site_environment(image_meta, asset_map, site_data, profiler=None):
+    """Returns the process-wide SiteEnvironment, set up for one build.
+
+    The environment is reused, so a long-running process (the CMS) keeps its parsed templates in memory
+    between builds; compiled templates are also persisted in JINJA_CACHE_DIR, so a fresh process skips
+    compiling any template whose source did not change.
+    """
+    global _environment
+    if _environment is None or _environment.loader.searchpath != [TEMPLATES_DIR]:
+        _environment = new_site_environment()
+    _environment.image_meta, _environment.asset_map, _environment.profiler = image_meta, asset_map, profiler
+    _environment.set_site_data(site_data)
+    return _environment
+
+# --- Blog Listings & Feeds ---
+def slugify(text):
+    return re.sub(r'[^a-z0-9]+', '-', str(text).lower()).strip('-')
+
+def post_date(post):
+    try:
+        return datetime.strptime(post.get('date', ''), BLOG_DATE_FORMAT)
+    except ValueError:
+        return None
+
+def read_site_url():
+    """Returns the site's absolute URL (from the CNAME GitHub Pages serves it under), or '' if there is none."""
+    cname_path = os.path.join(SRC_DIR, 'CNAME')
+    if os.path.exists(cname_path):
+        with open(cname_path, 'r', encoding='utf-8') as f:
+            host = f.read().strip()
+        if host:
+            return f"https://{host}"
+    return ''
+
+def page_path(first_path, page):
+    """Output path of page `page` of a listing whose first page is `first_path` ('blog.html' -> 'blog/page/2.html')."""
+    return first_path if page == 1 else f"{first_path[:-len('.html')]}/page/{page}.html"
+
+def blog_listings(posts):
+    """Returns the blog index, tag and month archive listings as (first_path, title, heading, posts) tuples,
+    plus the tag and archive link lists shown on every listing page. `posts` must be newest first."""
+    tags, months = {}, {}
+    for post in posts:
+        for tag in post.get('tags', []):
+            if slugify(tag):
+                tags.setdefault(slugify(tag), (tag, []))[1].append(post)
+        date = post_date(post)
+        if date:
+            months.setdefault(date.strftime('%Y-%m'), (date.strftime('%B %Y'), []))[1].append(post)
+
+    listings = [('blog.html', 'Blog', 'Our Blog', posts)]
+    listings += [(f"blog/tag/{slug}.html", f"Tag: {name}", f'Posts tagged "{name}"', tagged) for slug, (name, tagged) in sorted(tags.items())]
+    listings += [(f"blog/archive/{key}.html", label, f"Posts from {label}", archived) for key, (label, archived) in sorted(months.items(), reverse=True)]
+    blog_tags = [{'name': name, 'url': f"/blog/tag/{slug}.html", 'count': len(tagged)} for slug, (name, tagged) in sorted(tags.items())]
+    blog_archives = [{'label': label, 'url': f"/blog/archive/{key}.html", 'count': len(archived)} for key, (label, archived) in sorted(months.items(), reverse=True)]
+    return listings, blog_tags, blog_archives
+
+def blog_listing_pages(posts, page_size):
+    """Yields (output path, page context) for every page of the blog index and of every tag and month archive."""
+    listings, blog_tags, blog_archives = blog_listings(posts)
+    for first_path, title, heading, listed in listings:
+        pages = max(1, -(-len(listed) // page_size))
+        for page in range(1, pages + 1):
+            pagination = {'page': page, 'pages': pages,
+                          'prev_url': '/' + page_path(first_path, page - 1) if page > 1 else None,
+                          'next_url': '/' + page_path(first_path, page + 1) if page < pages else None}
+            yield page_path(first_path, page), {'active_page': 'blog', 'listing_title': title, 'listing_heading': heading, 'posts': listed[(page - 1) * page_size:page * page_size],
+                                                'pagination': pagination, 'blog_tags': blog_tags, 'blog_archives': blog_archives}
+
+def render_blog_listings(env, manifest, posts, page_size):
+    """Renders blog.html once per page of the blog index and of every tag and month archive.
+
+    Only `page_size` posts go into each page, so the HTML and image requests of /blog stay the same
+    size however long the archive gets. Yields True/False per page like `render_page()`.
+    """
+    for path, page_context in blog_listing_pages(posts, page_size):
+        yield render_page(env, manifest, 'blog.html', os.path.join(OUTPUT_DIR, path), page_context)
+
+def render_feed(env, manifest, posts):
+    """Renders the Atom feed of the newest FEED_ENTRIES posts to feed.xml."""
+    entries = []
+    for post in posts[:FEED_ENTRIES]:
+        date = post_date(post)
+        entries.append({'post': post, 'updated': (date or datetime(1970, 1, 1)).strftime('%Y-%m-%dT%H:%M:%SZ')})
+    page_context = {'site_url': read_site_url(), 'entries': entries, 'updated': entries[0]['updated'] if entries else '1970-01-01T00:00:00Z'}
+    return render_page(env, manifest, 'atom.xml', os.path.join(OUTPUT_DIR, 'feed.xml'), page_context)
+
+# --- Portfolio Galleries ---
+def gallery_manifest(folder_path, manifest):
+    """Returns {filename: {'width', 'height', 'hash', 'mtime', 'bytes'}} for the images in a portfolio category folder.
+
+    The metadata is kept in GALLERY_CACHE_DIR and only re-read for files whose size or mtime changed,
+    so a category of hundreds of images costs one directory scan per build.
+    """
+    cache_path = os.path.join(GALLERY_CACHE_DIR, hashlib.sha256(os.path.relpath(folder_path, ROOT_DIR).encode()).hexdigest()[:16] + '.json')
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cached = {}
+    entries = {}
+    if os.path.isdir(folder_path):
+        for entry in os.scandir(folder_path):
+            if not entry.is_file() or not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            stat = entry.stat()
+            previous = cached.get(entry.name)
+            if previous and previous['mtime'] == stat.st_mtime_ns and previous['bytes'] == stat.st_size:
+                entries[entry.name] = previous
+                continue
+            try:
+                with Image.open(entry.path) as img:  # Only reads the header.
+                    width, height = img.size
+                    if img.getexif().get(0x0112, 1) in (5, 6, 7, 8):  # Rotated a quarter turn by its EXIF orientation.
+                        width, height = height, width
+            except OSError as e:
+                logger.warning(f"  - WARNING: Skipping unreadable image '{entry.path}': {e}")
+                continue
+            entries[entry.name] = {'width': width, 'height': height, 'hash': manifest.hash_file(entry.path), 'mtime': stat.st_mtime_ns, 'bytes': stat.st_size}
+    if entries != cached:
+        os.makedirs(GALLERY_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+    return entries
+
+def gallery_order(filenames, order=None):
+    """Orders a category's images: those listed in the category's `order` first (as set in the CMS), then the rest by name."""
+    present = set(filenames)
+    ordered = [name for name in dict.fromkeys(order or []) if name in present]
+    return ordered + sorted(present - set(ordered))
+
+def gallery_pages(manifest, category, page_size):
+    """Yields (output path, page context) for each page of `page_size` images of one portfolio category."""
+    folder = category['folder']
+    entries = gallery_manifest(os.path.join(PORTFOLIO_IMAGES_DIR, folder), manifest)
+    images = [dict(entries[name], file=name) for name in gallery_order(entries, category.get('order'))]
+    first_path = f"portfolio-{folder}.html"
+    pages = max(1, -(-len(images) // page_size))
+    for page in range(1, pages + 1):
+        pagination = {'page': page, 'pages': pages, 'prev_label': '← Previous', 'next_label': 'Next →',
+                      'prev_url': '/' + page_path(first_path, page - 1) if page > 1 else None,
+                      'next_url': '/' + page_path(first_path, page + 1) if page < pages else None}
+        page_context = {'active_page': 'portfolio', 'category_name': category['label'], 'category_folder': folder,
+                        'images': images[(page - 1) * page_size:page * page_size], 'pagination': pagination}
+        yield page_path(first_path, page), page_context
+
+def render_gallery_pages(env, manifest, category, page_size):
+    """Renders one portfolio category as pages of `page_size` images: portfolio-<folder>.html, then portfolio-<folder>/page/N.html.
+
+    Yields True/False per page like `render_page()`.
+    """
+    for path, page_context in gallery_pages(manifest, category, page_size):
+        yield render_page(env, manifest, 'partials/portfolio_category.html', os.path.join(OUTPUT_DIR, path), page_context)
+
+# --- Live Preview ---
+PREVIEW_URL_RE = re.compile(r'(\s[\w-]+=")/(?!/)')  # Root-relative attribute values, e.g. href="/blog.html".
+_preview_environment = None
+_preview_manifest = None
+
+def preview_environment():
+    """Returns the long-lived SiteEnvironment that previews render with.
+
+    It is separate from the build's environment, which every build reconfigures, but shares the
+    compiled templates in JINJA_CACHE_DIR. Site data is passed with each render rather than set as
+    globals, so previews can render on any thread while a build runs.
+    """
+    global _preview_environment
+    if _preview_environment is None or _preview_environment.loader.searchpath != [TEMPLATES_DIR]:
+        _preview_environment = new_site_environment()
+    return _preview_environment
+
+def preview_manifest():
+    """Returns the long-lived BuildManifest that previews hash gallery images with; it is never saved.
+
+    hash_file() re-checks every file's size and mtime, so the hashes it keeps between requests stay correct
+    and only new or edited images are read.
+    """
+    global _preview_manifest
+    if _preview_manifest is None:
+        _preview_manifest = BuildManifest()
+    return _preview_manifest
+
+def preview_page(path, site_data, blog_page_size=BLOG_PAGE_SIZE, gallery_page_size=GALLERY_PAGE_SIZE):
+    """Resolves an output path ('about.html', 'blog/<slug>.html', 'portfolio-<folder>/page/2.html', ...)
+    to the (template name, page context) the build renders it from, or None if the build has no such page."""
+    if path.endswith('.html') and '/' not in path and path != 'blog.html' and os.path.isfile(os.path.join(TEMPLATES_DIR, path)):
+        return path, {'active_page': os.path.splitext(path)[0]}
+    if path == 'blog.html' or path.startswith('blog/'):
+        posts = sorted(site_data.get('blog', []), key=lambda post: post_date(post) or datetime.min, reverse=True)
+        for post in posts:
+            md_path = os.path.join(CONTENT_DIR, 'blog', f"{post['slug']}.md")
+            if path == f"blog/{post['slug']}.html" and os.path.exists(md_path):
+                with open(md_path, 'r', encoding='utf-8') as f:
+                    return 'partials/post_detail.html', {'active_page': 'blog', 'post': post, 'content': render_markdown(f.read())}
+        return next((('blog.html', page_context) for listing_path, page_context in blog_listing_pages(posts, blog_page_size) if listing_path == path), None)
+    for category in site_data.get('portfolio', []):
+        if path == f"portfolio-{category['folder']}.html" or path.startswith(f"portfolio-{category['folder']}/page/"):
+            return next((('partials/portfolio_category.html', page_context) for gallery_path, page_context in gallery_pages(preview_manifest(), category, gallery_page_size) if gallery_path == path), None)
+    return None
+
+def render_preview(path, site_data=None, url_prefix='/preview'):
+    """Renders the page the build would write to `path` from the current sources, without touching OUTPUT_DIR.
+
+    Root-relative URLs in the page get `url_prefix`, so its links, images and assets are served by the
+    preview too. Returns None if the build has no such page. Callers that keep the site data cached (the CMS)
+    should pass it: load_site_data() re-reads every file and logs to the build logger.
+    """
+    site_data = load_site_data() if site_data is None else site_data
+    resolved = preview_page(path, site_data)
+    if resolved is None:
+        return None
+    template_name, page_context = resolved
+    html = preview_environment().get_template(template_name).render(dict(site_data, **page_context))
+    return PREVIEW_URL_RE.sub(lambda match: match.group(1) + url_prefix + '/', html)
+
+def _inside(root, path):
+    return os.path.abspath(path).startswith(os.path.abspath(root) + os.sep)
+
+def preview_asset(path):
+    """The unminified content of asset `path` (bundles are assembled from ASSET_BUNDLES), or None if there is no such asset."""
+    member_paths = [os.path.join(ASSETS_DIR, member) for member in ASSET_BUNDLES.get(path, [path])]
+    if not all(_inside(ASSETS_DIR, member_path) and os.path.isfile(member_path) for member_path in member_paths):
+        return None
+    parts = []
+    for member_path in member_paths:
+        with open(member_path, 'rb') as f:
+            parts.append(f.read())
+    return b';\n'.join(parts)
+
+def preview_image_source(path):
+    """The source image the build publishes as `path` (relative to content/images, e.g. 'banners/a.webp'), or None."""
+    directory, stem = os.path.split(os.path.splitext(path)[0])
+    directory = os.path.join(CONTENT_IMAGES_DIR, directory)
+    if not (_inside(CONTENT_IMAGES_DIR, os.path.join(directory, stem)) and os.path.isdir(directory)):
+        return None
+    return next((os.path.join(directory, name) for name in sorted(os.listdir(directory))
+                 if os.path.splitext(name)[0] == stem and name.lower().endswith(IMAGE_EXTENSIONS)), None)
+
+def preview_image(source_path, max_dimension=PREVIEW_IMAGE_MAX_DIMENSION, quality=WEBP_QUALITY):
+    """Encodes one downscaled WebP of `source_path` in memory; previews skip the width variants."""
+    with Image.open(source_path) as img:
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_dimension, max_dimension))
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA')
+        buffer = io.BytesIO()
+        img.save(buffer, 'WEBP', quality=quality)
+    return buffer.getvalue()
+
+# --- Search Index ---
+SEARCH_TOKEN_RE = re.compile(r"[^\W_]+")
+
+def search_terms(text):
+    """Splits text into index terms: lowercased, accents stripped, stopwords and one-letter words dropped.
+
+    assets/js/search.js tokenizes queries the same way. Lowercasing uses the default Unicode mapping, which is what
+    toLowerCase() does; casefold() would index 'straße' as 'strasse', which no query could then match.
+    """
+    text = ''.join(c for c in unicodedata.normalize('NFKD', text.lower()) if not unicodedata.category(c).startswith('M'))  # \p{M} in search.js
+    return [term for term in SEARCH_TOKEN_RE.findall(text) if len(term) > 1 and term not in SEARCH_STOPWORDS]
+
+def search_shard(term):
+    prefix = term[:SEARCH_PREFIX_LENGTH]
+    return prefix if re.fullmatch(r'[a-z0-9]+', prefix) else '_'
+
+def html_text(markup):
+    return html.unescape(re.sub(r'<[^>]+>', ' ', markup))
+
+def weigh_terms(fields):
+    """{field: text} -> {term: score}, using SEARCH_FIELD_WEIGHTS."""
+    scores = {}
+    for field, text in fields.items():
+        counts = {}
+        for term in search_terms(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            scores[term] = scores.get(term, 0) + SEARCH_FIELD_WEIGHTS[field] * min(count, SEARCH_MAX_TERM_COUNT)
+    return scores
+
+def search_documents(site_data, manifest):
+    """Yields (doc id, inputs, read) for every blog post and portfolio category; `read()` returns the document's fields."""
+    for post in site_data.get('blog', []):
+        md_path = os.path.join(CONTENT_DIR, 'blog', f"{post['slug']}.md")
+        if not os.path.exists(md_path):
+            continue  # No page is rendered for it either.
+        inputs = {'post': page_context_hash(post), 'body': manifest.hash_file(md_path), 'markdown': MARKDOWN_EXTRAS}
+
+        def read(post=post, md_path=md_path):
+            with open(md_path, 'r', encoding='utf-8') as f:
+                body = html_text(render_markdown(f.read()))
+            return {'title': post.get('title', ''), 'url': f"/blog/{post['slug']}.html", 'kind': 'Blog', 'snippet': post.get('excerpt', '')[:SEARCH_SNIPPET_LENGTH],
+                    'fields': {'title': post.get('title', ''), 'tags': ' '.join(post.get('tags', [])), 'excerpt': post.get('excerpt', ''), 'body': body}}
+        yield f"b/{post['slug']}", inputs, read
+    for category in site_data.get('portfolio', []):
+        def read(category=category):
+            return {'title': category['label'], 'url': f"/portfolio-{category['folder']}.html", 'kind': 'Portfolio', 'snippet': '',
+                    'fields': {'title': f"{category['label']} {category['folder'].replace('-', ' ')}"}}
+        yield f"p/{category['folder']}", {'category': page_context_hash(category)}, read
+
+def build_search_index(output_dir, site_data, manifest):
+    """Writes a sharded inverted index of blog posts and portfolio categories to `output_dir`.
+
+    index.json names the fingerprinted documents file and one shard per term prefix, so the browser
+    fetches only the shards its query terms fall in. Documents whose inputs are unchanged reuse their
+    cached terms, and shards whose content is unchanged keep their file. Returns (re-indexed, total documents).
+    """
+    logger.info("-> Building search index...")
+    try:
+        with open(SEARCH_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        cached = {}
+    # Cached terms depend on the tokenizer too, so a changed build.py re-indexes every document.
+    cached = cached.get('documents', {}) if cached.get('build_signature') == manifest.build_signature else {}
+    documents, indexed = {}, 0
+    for doc_id, inputs, read in search_documents(site_data, manifest):
+        entry = cached.get(doc_id)
+        if not entry or entry['inputs'] != inputs:
+            fields = read()
+            entry = {'inputs': inputs, 'doc': [fields['title'], fields['url'], fields['kind'], fields['snippet']], 'terms': weigh_terms(fields.pop('fields'))}
+            indexed += 1
+        documents[doc_id] = entry
+    if documents != cached:
+        os.makedirs(os.path.dirname(SEARCH_CACHE_FILE), exist_ok=True)
+        tmp_path = SEARCH_CACHE_FILE + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'build_signature': manifest.build_signature, 'documents': documents}, f, sort_keys=True)
+        os.replace(tmp_path, SEARCH_CACHE_FILE)
+
+    shards = {}
+    for doc_id, entry in documents.items():
+        for term, score in entry['terms'].items():
+            shards.setdefault(search_shard(term), {}).setdefault(term, []).append([doc_id, score])
+
+    def write(name, data):
+        content = json.dumps(data, separators=(',', ':'), sort_keys=True, ensure_ascii=False)
+        filename = fingerprint_name(name, content.encode('utf-8'))
+        if manifest.needs_build(os.path.join(output_dir, filename), {'content': filename}):
+            write_text(os.path.join(output_dir, filename), content)
+        return filename
+
+    index = {'prefix': SEARCH_PREFIX_LENGTH, 'docs': write('docs.json', {doc_id: entry['doc'] for doc_id, entry in documents.items()}),
+             'shards': {prefix: write(f"{prefix}.json", {term: sorted(postings, key=lambda p: (-p[1], p[0])) for term, postings in terms.items()})
+                        for prefix, terms in sorted(shards.items())}}
+    index_content = json.dumps(index, separators=(',', ':'), sort_keys=True)
+    index_path = os.path.join(output_dir, 'index.json')
+    if manifest.needs_build(index_path, {'content': hashlib.sha256(index_content.encode()).hexdigest()}):
+        write_text(index_path, index_content)
+    logger.info(f"  - {len(documents)} documents ({indexed} re-indexed), {len(index['shards'])} shards.")
+    return indexed, len(documents)
+
+# --- Validation ---
+# Shapes of the src/data/*.json files. A dict lists an object's fields (a '?' suffix marks one optional), a one-item
+# list is a list of that shape, 'date' is a string in BLOG_DATE_FORMAT and ('image', folder) is an image field
+# resolved with media_path(); an empty image field means "no image". Fields not listed are allowed.
+DATA_SCHEMAS = {
+    'about': {'banner_image': ('image', ''), 'about_us_heading': str, 'about_us_text': str, 'about_us_image': ('image', ''), 'who_we_are_heading': str, 'who_we_are_text': str},
+    'banners': [{'image': ('image', 'banners'), 'headline?': str, 'subtext?': str, 'button_text?': str, 'button_link?': str}],
+    'blog': [{'title': str, 'date': 'date', 'author': str, 'image': ('image', 'blog'), 'excerpt': str, 'slug': str, 'tags?': [str]}],
+    'clients': [{'logo': ('image', 'clients'), 'url': str}],
+    'contact': {'page_heading': str, 'page_subheading': str, 'email': {'label': str, 'address': str}, 'phone': {'label': str, 'number': str},
+                'address': {'label': str, 'line1': str, 'line2': str}, 'business_hours': {'label': str, 'days': str, 'hours': str}},
+    'footer': {'contact_heading': str, 'email': str, 'copyright_text': str, 'social_links': [{'name': str, 'url': str}]},
+    'homepage': {'offer_section_heading': str, 'project_section_heading': str, 'video_section_heading': str, 'testimonial_section_heading': str, 'clients_section_heading': str},
+    'navigation': [{'label': str, 'url': str, 'id': str}],
+    'offers': [{'title': str, 'image': ('image', 'offers'), 'url': str}],
+    'portfolio': [{'label': str, 'folder': str, 'image': ('image', 'portfolio'), 'order?': [str]}],
+    'projects': [{'title': str, 'image': ('image', 'projects'), 'url': str}],
+    'services': {'heading': str, 'services_list': [str]},
+    'styles': {'google_font_url': str, 'body_font_family': str, 'heading_font_family': str, 'heading_font_size_px': int},
+    'team': [{'name': str, 'title': str, 'image': ('image', 'team'), 'is_ceo': bool, 'bio?': str}],
+    'testimonials': [{'feedback': str, 'stars': int, 'image': ('image', 'team'), 'client_name': str, 'client_company': str}],
+    'videos': [{'title': str, 'youtube_id': str}],
+}
+SCHEMA_TYPE_NAMES = {str: 'a string', int: 'an integer', bool: 'true or false', dict: 'an object', list: 'a list'}
+LINK_ATTR_RE = re.compile(r'''\s(href|src|data-src|action|poster|srcset|data-srcset)\s*=\s*(?:"([^"]*)"|'([^']*)')''', re.I)
+EXTERNAL_URL_RE = re.compile(r'^(?:[a-z][a-z0-9+.-]*:|//|#)', re.I)  # Other sites, mailto:/tel:/data: URLs and in-page anchors.
+DEPENDENCY_CHECKS = {'image': ('image', 'src/content/images/'), 'asset': ('asset', 'src/assets/'), 'file': ('markdown', '')}  # Dependency kind -> check, source prefix.
+
+class ValidationReport:
+    """Broken references and malformed data found while building, as structured issues.
+
+    Every issue is a dict naming its severity ('error' or 'warning'), the check that found it ('json', 'schema',
+    'image', 'markdown', 'asset', 'portfolio' or 'link'), its source (a src/ file or docs/ output), where in that
+    source it is (e.g. 'team[2].image') and a message. Errors fail --strict builds, and the CMS saves and deploys
+    that introduce them; warnings are only reported.
+    """
+
+    def __init__(self):
+        self.issues = []
+
+    def add(self, severity, check, source, location, message):
+        self.issues.append({'severity': severity, 'check': check, 'source': source, 'location': location, 'message': message})
+
+    def error(self, check, source, location, message):
+        self.add('error', check, source, location, message)
+
+    def warning(self, check, source, location, message):
+        self.add('warning', check, source, location, message)
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue['severity'] == 'error']
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if issue['severity'] == 'warning']
+
+    def new_errors(self, baseline):
+        """The errors beyond those already in `baseline`. Issues are compared without their location, so one that
+        only moved (e.g. to the next list item when a record is inserted above it) is not new."""
+        known, new = {}, []
+        for issue in baseline.errors:
+            known[issue_key(issue)] = known.get(issue_key(issue), 0) + 1
+        for issue in self.errors:
+            if known.get(issue_key(issue)):
+                known[issue_key(issue)] -= 1
+            else:
+                new.append(issue)
+        return new
+
+    def to_dict(self):
+        return {'errors': self.errors, 'warnings': self.warnings}
+
+    @classmethod
+    def from_dict(cls, saved):
+        report = cls()
+        report.issues = saved.get('errors', []) + saved.get('warnings', [])
+        return report
+
+    def save(self, path=VALIDATION_FILE):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+
+    def log(self, limit=VALIDATION_LOG_LIMIT):
+        errors, warnings = self.errors, self.warnings
+        logger.info(f"  - Validation: {len(errors)} errors, {len(warnings)} warnings.")
+        for issue in (errors + warnings)[:limit]:
+            (logger.error if issue['severity'] == 'error' else logger.warning)(f"  - {issue['severity'].upper()}: {describe_issue(issue)}")
+        if len(self.issues) > limit:
+            logger.info(f"  - ... and {len(self.issues) - limit} more in {os.path.relpath(VALIDATION_FILE, ROOT_DIR)}")
+
+def issue_key(issue):
+    return issue['check'], issue['source'], issue['message']
+
+def describe_issue(issue):
+    return f"{issue['source']} {issue['location']}: {issue['message']}" if issue['location'] else f"{issue['source']}: {issue['message']}"
+
+def _type_name(value):
+    return SCHEMA_TYPE_NAMES.get(type(value), 'null' if value is None else type(value).__name__)
+
+def validate_data(key, data, report, pending=()):
+    """Checks src/data/<key>.json against DATA_SCHEMAS, and that the images, markdown files and portfolio folders it names exist.
+
+    Only stats files, so it is cheap enough to run on every CMS save. `pending` are files the caller writes once the
+    data is saved, which count as existing. Returns the missing image paths (relative to CONTENT_IMAGES_DIR), which
+    validate_outputs() then does not report a second time.
+    """
+    source = f"src/data/{key}.json"
+    pending = {os.path.abspath(path) for path in pending}
+    missing_images = set()
+
+    def check(value, schema, location):
+        if isinstance(schema, dict):
+            if not isinstance(value, dict):
+                return report.error('schema', source, location, f"expected an object, got {_type_name(value)}")
+            for field, field_schema in schema.items():
+                name = field.rstrip('?')
+                field_location = f"{location}.{name}" if location else name
+                if name in value:
+                    check(value[name], field_schema, field_location)
+                elif not field.endswith('?'):
+                    report.error('schema', source, field_location, "required field is missing")
+        elif isinstance(schema, list):
+            if not isinstance(value, list):
+                return report.error('schema', source, location, f"expected a list, got {_type_name(value)}")
+            for i, item in enumerate(value):
+                check(item, schema[0], f"{location}[{i}]")
+        elif isinstance(schema, tuple) or schema == 'date':
+            if not isinstance(value, str):
+                return report.error('schema', source, location, f"expected a string, got {_type_name(value)}")
+            if schema == 'date':
+                if post_date({'date': value}) is None:
+                    report.warning('schema', source, location, f"'{value}' is not a date like '{datetime(2025, 7, 30).strftime(BLOG_DATE_FORMAT)}'; the post sorts last")
+            elif value and not os.path.isfile(os.path.join(CONTENT_IMAGES_DIR, media_path(value, schema[1]))):
+                missing_images.add(media_path(value, schema[1]))
+                report.error('image', source, location, f"image '{media_path(value, schema[1])}' does not exist")
+        elif not isinstance(value, schema) or (schema is int and isinstance(value, bool)):
+            report.error('schema', source, location, f"expected {SCHEMA_TYPE_NAMES[schema]}, got {_type_name(value)}")
+
+    if key in DATA_SCHEMAS:
+        check(data, DATA_SCHEMAS[key], key)
+    if key == 'blog' and isinstance(data, list):
+        for i, post in enumerate(data):
+            if not isinstance(post, dict) or not isinstance(post.get('slug'), str): continue
+            md_path = os.path.join(CONTENT_DIR, 'blog', f"{post['slug']}.md")
+            if os.path.abspath(md_path) not in pending and not os.path.isfile(md_path):
+                report.error('markdown', source, f"blog[{i}].slug", f"markdown file 'src/content/blog/{post['slug']}.md' does not exist; the post has no page")
+    elif key == 'portfolio' and isinstance(data, list):
+        for i, category in enumerate(data):
+            if isinstance(category, dict) and isinstance(category.get('folder'), str) and not os.path.isdir(os.path.join(PORTFOLIO_IMAGES_DIR, category['folder'])):
+                report.warning('portfolio', source, f"portfolio[{i}].folder", f"folder 'portfolio/{category['folder']}' does not exist; the category is empty")
+    return missing_images
+
+def page_links(html):
+    """The internal URLs a rendered page links to or loads, from its href/src/srcset/action attributes."""
+    links = set()
+    for match in LINK_ATTR_RE.finditer(html):
+        value = match.group(2) if match.group(2) is not None else match.group(3)
+        urls = [candidate.split()[0] for candidate in value.split(',') if candidate.strip()] if match.group(1).lower().endswith('srcset') else [value.strip()]
+        links.update(url for url in urls if url and not EXTERNAL_URL_RE.match(url) and '{' not in url)
+    return sorted(links)
+
+def link_target(page, url):
+    """Resolves an internal URL found on output `page` to the output key it requests, e.g. '/blog/' -> 'blog/index.html'."""
+    path = urllib.parse.unquote(url.split('#', 1)[0].split('?', 1)[0])
+    if not path:
+        return page.replace(os.sep, '/')
+    target = posixpath.normpath(posixpath.join('/', posixpath.dirname(page.replace(os.sep, '/')), path)).lstrip('/')
+    return posixpath.join(target, 'index.html') if path.endswith('/') or not target else target
+
+def validate_outputs(manifest, report, reported_images=()):
+    """Checks what this build's pages reference against what it produced, without reading OUTPUT_DIR.
+
+    The manifest already records every dependency of every output, with the signature 'missing' for an
+    image, asset or file that did not exist, and render_page() records each page's internal links; a link
+    is broken when no output has its path. Issues are grouped per missing target, listing the pages that
+    reference it. Runs alongside compression, so it works on snapshots of the manifest.
+    """
+    outputs, links = dict(manifest.current), dict(manifest.links)
+    # Pages are rendered before optimize_css() builds PURGED_STYLESHEET; it then points their links at the purged copy.
+    produced = {key.replace(os.sep, '/') for key in outputs} | {f"assets/{PURGED_STYLESHEET}"}
+    missing, missing_images = {}, set(reported_images)
+    for page in sorted(outputs):
+        for dependency, signature in outputs[page].items():
+            kind, _, name = dependency.partition(':')
+            if signature == 'missing' and kind in DEPENDENCY_CHECKS and dependency != f"asset:{PURGED_STYLESHEET}":
+                if kind == 'image':
+                    if name in reported_images:
+                        continue
+                    missing_images.add(name)
+                missing.setdefault((kind, name), []).append(page)
+    # responsive_image() still points a missing image's <img> at its WebP; that is the image's issue, not a broken link.
+    image_urls = {f"content/images/{os.path.splitext(name)[0]}.webp" for name in missing_images}
+    for page in sorted(outputs):
+        for url in links.get(page, ()):
+            target = link_target(page, url)
+            if target not in produced and target not in image_urls and f"{target}.html" not in produced and f"{target}/index.html" not in produced:
+                missing.setdefault(('link', target), []).append(page)
+    for (kind, name), pages in sorted(missing.items()):
+        pages = sorted(set(pages))
+        referrers = ', '.join(pages[:3]) + (f" and {len(pages) - 3} more" if len(pages) > 3 else '')
+        if kind == 'link':
+            report.error('link', f"docs/{name}", f"linked from {referrers}", "the build does not produce this page or file")
         else:
-            shutil.copy2(source_item, output_item)
+            check, prefix = DEPENDENCY_CHECKS[kind]
+            report.error(check, prefix + name, f"used by {referrers}", "file does not exist")
+
+def validate_site_data(site_data, report):
+    """Runs validate_data() on every loaded data file; returns the missing images of all of them."""
+    missing_images = set()
+    for key in sorted(site_data):
+        missing_images |= validate_data(key, site_data[key], report)
+    return missing_images
+
+# --- Build Instrumentation ---
+def _io_counters():
+    """Bytes read and written by this process's read()/write() calls so far, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/io', 'r', encoding='ascii') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+def _cpu_seconds():
+    # Children are only counted once they have been waited for, i.e. when a stage's process pool shuts down.
+    times = os.times()
+    return times.user + times.system, times.children_user + times.children_system
+
+class BuildProfiler:
+    """Collects per-stage wall/CPU time and I/O, per-output render times and cache hit rates for one build.
+
+    A disabled profiler only runs the stages, so build() can use one unconditionally. With `cprofile`
+    every stage also runs under its own cProfile.Profile and the slowest stage's stats are dumped to
+    PROFILE_DUMP_DIR. I/O counts only the build process, not image or markdown worker processes.
+    CPU and I/O counters are process-wide, so stages that ran concurrently share theirs.
+    """
+
+    def __init__(self, enabled=False, cprofile=False):
+        self.enabled = enabled or cprofile
+        self.cprofile = cprofile
+        self.stages = []
+        self.outputs = {}
+        self.caches = {}
+        self.profiles = {}
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        profile = cProfile.Profile() if self.cprofile else None
+        io_before, cpu_before, wall_before = _io_counters(), _cpu_seconds(), time.perf_counter()
+        if profile:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                self.profiles[name] = profile
+            wall, cpu, io = time.perf_counter() - wall_before, _cpu_seconds(), _io_counters()
+            self.stages.append({
+                'stage': name, 'wall': round(wall, 4),
+                'cpu': round(cpu[0] - cpu_before[0], 4), 'cpu_workers': round(cpu[1] - cpu_before[1], 4),
+                'bytes_read': io[0] - io_before[0] if io and io_before else None,
+                'bytes_written': io[1] - io_before[1] if io and io_before else None,
+            })
+
+    def record_output(self, output_path, seconds):
+        if self.enabled:
+            self.outputs[os.path.relpath(output_path, OUTPUT_DIR)] = round(seconds, 4)
+
+    def cache(self, name, hits, misses):
+        if self.enabled:
+            entry = self.caches.setdefault(name, {'hits': 0, 'misses': 0})
+            entry['hits'] += hits
+            entry['misses'] += misses
+            total = entry['hits'] + entry['misses']
+            entry['hit_rate'] = round(entry['hits'] / total, 3) if total else None
+
+    def report(self, total_seconds):
+        """Writes the report to PROFILE_FILE, logs a summary of it and returns it."""
+        slowest = max(self.stages, key=lambda stage: stage['wall'], default=None)
+        report = {'generated': datetime.now().isoformat(timespec='seconds'), 'seconds': round(total_seconds, 4),
+                  'stages': self.stages, 'outputs': dict(sorted(self.outputs.items(), key=lambda item: -item[1])), 'caches': self.caches}
+        if slowest and slowest['stage'] in self.profiles:
+            os.makedirs(PROFILE_DUMP_DIR, exist_ok=True)
+            dump_path = os.path.join(PROFILE_DUMP_DIR, f"{slowest['stage'].replace(' ', '_')}.prof")
+            self.profiles[slowest['stage']].dump_stats(dump_path)
+            report['cprofile'] = os.path.relpath(dump_path, ROOT_DIR)
+        os.makedirs(os.path.dirname(PROFILE_FILE), exist_ok=True)
+        with open(PROFILE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+        def kilobytes(value):
+            return f"{value / 1024:>9.1f}" if value is not None else f"{'-':>9}"
+
+        logger.info("-> Build profile:")
+        logger.info(f"  {'stage':<16} {'wall s':>8} {'cpu s':>8} {'workers s':>9} {'read KB':>9} {'write KB':>9}")
+        for stage in self.stages:
+            logger.info(f"  {stage['stage']:<16} {stage['wall']:>8.3f} {stage['cpu']:>8.3f} {stage['cpu_workers']:>9.3f} {kilobytes(stage['bytes_read'])} {kilobytes(stage['bytes_written'])}")
+        logger.info(f"  - Stages ran concurrently: {sum(stage['wall'] for stage in self.stages):.3f}s of stage time in {total_seconds:.3f}s.")
+        for name, entry in self.caches.items():
+            rate = f"{entry['hit_rate']:.0%}" if entry['hit_rate'] is not None else 'n/a'
+            logger.info(f"  - {name} cache: {entry['hits']} hits, {entry['misses']} misses ({rate}).")
+        for output, seconds in list(report['outputs'].items())[:PROFILE_SLOWEST_OUTPUTS]:
+            logger.info(f"  - {seconds * 1000:8.1f} ms  {output}")
+        if 'cprofile' in report:
+            logger.info(f"  - cProfile of the slowest stage ('{slowest['stage']}') written to {report['cprofile']}")
+        logger.info(f"  - Full report in {os.path.relpath(PROFILE_FILE, ROOT_DIR)}")
+        return report
+
+# --- Stage Scheduling ---
+class BuildError(Exception):
+    """Raised when a build stage fails or the stage graph is invalid."""
+
+class Stage:
+    """One step of the build.
+
+    `run` is called with the values named in `inputs` as keyword arguments and returns a dict of the
+    values named in `outputs` (or None when they are only markers for other stages to wait on).
+    `after` names values the stage must wait for without receiving them.
+    """
+    def __init__(self, name, run, inputs=(), outputs=(), after=()):
+        self.name, self.run, self.inputs, self.outputs, self.after = name, run, list(inputs), list(outputs), list(after)
+
+class StageScheduler:
+    """Runs stages as a DAG: each starts on a thread as soon as the stages producing its inputs are done.
+
+    Stages parallelize CPU-heavy work internally with process pools (images, markdown), so running
+    them on threads overlaps those pools with the stages that mostly do file I/O. After the first
+    failure no new stage starts; running ones finish and BuildError names the stage that failed.
+    """
+    def __init__(self, stages, workers=STAGE_WORKERS, profiler=None):
+        self.stages = stages
+        self.workers = max(1, workers)
+        self.profiler = profiler or BuildProfiler()
+        producers = {}
+        for stage in stages:
+            for output in stage.outputs:
+                if output in producers:
+                    raise BuildError(f"'{output}' is an output of both stage '{producers[output]}' and stage '{stage.name}'")
+                producers[output] = stage.name
+        self.order = self._sort(producers)
+
+    def _sort(self, producers):
+        """Returns the stages in a valid sequential order, rejecting unknown inputs and cycles."""
+        for stage in self.stages:
+            unknown = [name for name in stage.inputs + stage.after if name not in producers]
+            if unknown:
+                raise BuildError(f"Stage '{stage.name}' waits for {', '.join(unknown)}, which no stage produces")
+        order, done, remaining = [], set(), list(self.stages)
+        while remaining:
+            ready = [stage for stage in remaining if all(name in done for name in stage.inputs + stage.after)]
+            if not ready:
+                raise BuildError(f"Stages form a cycle: {', '.join(stage.name for stage in remaining)}")
+            for stage in ready:
+                order.append(stage)
+                done.update(stage.outputs)
+                remaining.remove(stage)
+        return order
+
+    def _run_stage(self, stage, arguments):
+        with self.profiler.stage(stage.name):
+            result = stage.run(**arguments)
+        if result is not None and set(result) != set(stage.outputs):
+            raise BuildError(f"Stage '{stage.name}' returned {sorted(result)}, expected {stage.outputs}")
+        return {name: (result or {}).get(name) for name in stage.outputs}
+
+    def run(self):
+        """Runs every stage and returns all of their output values by name."""
+        values, pending, running, failure = {}, list(self.order), {}, None
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stage') as pool:
+            while pending or running:
+                if failure is None:
+                    for stage in [stage for stage in pending if all(name in values for name in stage.inputs + stage.after)]:
+                        pending.remove(stage)
+                        running[pool.submit(self._run_stage, stage, {name: values[name] for name in stage.inputs})] = stage
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        values.update(future.result())
+                    except Exception as e:
+                        logger.error(f"  - ERROR: Stage '{stage.name}' failed: {e}")
+                        failure = failure or (stage, e)
+        if failure:
+            stage, error = failure
+            if isinstance(error, BuildError):
+                raise error
+            raise BuildError(f"Build stage '{stage.name}' failed: {error.__class__.__name__}: {error}") from error
+        return values
+
+# --- Publishing ---
+def unpublished_outputs():
+    """Returns {output key: 'changed' | 'removed'} for every output touched since the last publish."""
+    try:
+        with open(UNPUBLISHED_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, OSError) as e:
+        logger.warning(f"  - WARNING: Ignoring unreadable unpublished list: {e}")
+        return {}
+
+def _write_unpublished(pending):
+    if not pending:
+        if os.path.exists(UNPUBLISHED_FILE):
+            os.remove(UNPUBLISHED_FILE)
+        return
+    os.makedirs(os.path.dirname(UNPUBLISHED_FILE), exist_ok=True)
+    tmp_path = f"{UNPUBLISHED_FILE}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(pending, f, indent=0, sort_keys=True)
+    os.replace(tmp_path, UNPUBLISHED_FILE)
+
+def record_unpublished(changed, removed):
+    """Adds this build's changed and removed outputs to UNPUBLISHED_FILE; the latest state of a path wins.
+
+    Builds between two publishes (e.g. the CMS's background rebuilds) accumulate here, so a publish
+    can stage exactly the outputs that differ from what was last committed.
+    """
+    pending = unpublished_outputs()
+    pending.update({key: 'changed' for key in changed})
+    pending.update({key: 'removed' for key in removed})
+    _write_unpublished(pending)
+    return pending
+
+def clear_unpublished(published):
+    """Forgets the outputs in `published` once they have been committed."""
+    _write_unpublished({key: state for key, state in unpublished_outputs().items() if key not in published})
+
+def published_validation():
+    """The ValidationReport of the last published build, or None if no publish has recorded one yet."""
+    try:
+        with open(PUBLISHED_VALIDATION_FILE, 'r', encoding='utf-8') as f:
+            return ValidationReport.from_dict(json.load(f))
+    except FileNotFoundError:
+        return None
+    except (json.JSONDecodeError, OSError) as e:
+        logger.warning(f"  - WARNING: Ignoring unreadable published validation report: {e}")
+        return None
+
+def record_published_validation(report):
+    """Keeps `report` as the baseline the next publish's errors are compared against."""
+    report.save(PUBLISHED_VALIDATION_FILE)
 
 # --- Main Build Logic ---
-def load_site_data():
-    print("-> Loading all .json data from:", DATA_DIR)
+def load_site_data(report=None):
+    """Returns {key: data} for every src/data/<key>.json file; files that cannot be read are left out and added to `report`."""
+    logger.info(f"-> Loading all .json data from: {DATA_DIR}")
     data = {}
     for filename in os.listdir(DATA_DIR):
-        if filename.endswith('.json'):
+        if filename.endswith('.json') and not filename.startswith('_'):  # '_' files are CMS bookkeeping, e.g. _media.json.
             key = os.path.splitext(filename)[0]
             filepath = os.path.join(DATA_DIR, filename)
             try:
                 with open(filepath, 'r', encoding='utf-8') as f:
                     data[key] = json.load(f)
-                    print(f"  - Loaded '{filename}' successfully.")
-            except json.JSONDecodeError:
-                print(f"  - ERROR: Could not decode JSON from '{filename}'. File might be empty or malformed.")
+                    logger.info(f"  - Loaded '{filename}' successfully.")
+            except json.JSONDecodeError as e:
+                logger.error(f"  - ERROR: Could not decode JSON from '{filename}'. File might be empty or malformed.")
+                if report is not None:
+                    report.error('json', f"src/data/{filename}", f"line {e.lineno}, column {e.colno}", f"invalid JSON: {e.msg}")
             except Exception as e:
-                print(f"  - ERROR: Could not read '{filename}': {e}")
+                logger.error(f"  - ERROR: Could not read '{filename}': {e}")
+                if report is not None:
+                    report.error('json', f"src/data/{filename}", '', f"could not be read: {e}")
     return data
 
-def build():
-    print("\n>>> Starting SUPERCHARGED website build...")
-    
-    if os.path.exists(OUTPUT_DIR):
-        shutil.rmtree(OUTPUT_DIR)
-    
-    minify_and_copy_assets(ASSETS_DIR, os.path.join(OUTPUT_DIR, 'assets'))
-    optimize_images_to_webp(CONTENT_IMAGES_DIR, os.path.join(OUTPUT_DIR, 'content', 'images'))
-    
-    if os.path.exists(os.path.join(SRC_DIR, 'CNAME')):
-        shutil.copy(os.path.join(SRC_DIR, 'CNAME'), OUTPUT_DIR)
-    if os.path.exists(os.path.join(CONTENT_DIR, 'blog')):
-        shutil.copytree(os.path.join(CONTENT_DIR, 'blog'), os.path.join(OUTPUT_DIR, 'content', 'blog'))
-
-    site_data = load_site_data()
-    env = Environment(loader=FileSystemLoader(TEMPLATES_DIR), autoescape=True)
-
-    print("-> Rendering main pages...")
-    for filename in [f for f in os.listdir(TEMPLATES_DIR) if f.endswith('.html')]:
-        template = env.get_template(filename)
-        context = site_data.copy()
-        context['active_page'] = os.path.splitext(filename)[0]
-        with open(os.path.join(OUTPUT_DIR, filename), 'w', encoding='utf-8') as f:
-            f.write(template.render(context))
-
-    print("-> Rendering portfolio pages...")
-    if 'portfolio' in site_data:
-        category_template = env.get_template('partials/portfolio_category.html')
-        for category in site_data.get('portfolio', []):
-            image_path = os.path.join(PORTFOLIO_IMAGES_DIR, category['folder'])
-            images = [img for img in os.listdir(image_path) if img.lower().endswith(('.png', '.jpg', '.jpeg'))] if os.path.exists(image_path) else []
-            context = site_data.copy()
-            context.update({'active_page': 'portfolio', 'category_name': category['label'], 'images': images, 'category_folder': category['folder']})
-            output_filename = f"portfolio-{category['folder']}.html"
-            with open(os.path.join(OUTPUT_DIR, output_filename), 'w', encoding='utf-8') as f:
-                f.write(category_template.render(context))
-    
-    print("-> Rendering blog posts...")
-    if 'blog' in site_data:
-        blog_output_dir = os.path.join(OUTPUT_DIR, 'blog')
-        os.makedirs(blog_output_dir, exist_ok=True)
-        post_template = env.get_template('partials/post_detail.html')
+def list_files(directory, extensions=None):
+    found = []
+    for dirpath, _, filenames in os.walk(directory):
+        found.extend(os.path.join(dirpath, f) for f in filenames if extensions is None or f.endswith(extensions))
+    return found
+
+_build_thread_lock = threading.Lock()
+
+@contextmanager
+def build_lock():
+    """Serializes builds across threads and processes (the CMS's workers, `python build.py`); callers hold it around build().
+
+    Builds share the manifest, the caches and docs/. Not reentrant, so a caller can keep holding it after build()
+    returns, e.g. the CMS deploy until its git commit.
+    """
+    with _build_thread_lock:
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+        with open(BUILD_LOCK_FILE, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def build(full=False, changed=None, image_quality=WEBP_QUALITY, image_workers=IMAGE_WORKERS, image_avif=IMAGE_AVIF, blog_page_size=BLOG_PAGE_SIZE, markdown_workers=IMAGE_WORKERS, profile=False, cprofile=False, gallery_page_size=GALLERY_PAGE_SIZE, strict=False):
+    """Builds the site into OUTPUT_DIR, only redoing work whose inputs changed since the last build.
+
+    `changed` is an optional list of source files known to have changed (e.g. the JSON file a CMS
+    save just wrote). When given, every other file is assumed unchanged and is not even re-hashed,
+    so only the outputs depending on those files are rebuilt. `profile` times every stage and
+    output and writes the report to PROFILE_FILE; `cprofile` also dumps the slowest stage's cProfile.
+
+    Full builds overwrite outputs in place and delete only files no longer produced, so unchanged
+    outputs keep their mtimes. The outputs that changed or were removed are listed in the summary
+    and accumulated in UNPUBLISHED_FILE for the next publish.
+
+    The work is a graph of Stages run by StageScheduler, so stages whose inputs are ready run
+    concurrently; the first stage to fail stops the build with a BuildError naming it.
+
+    The data files are validated as they load and the pages' references and internal links once they are
+    written, from what the build recorded (see validate_outputs()); the report is in the summary and VALIDATION_FILE. With `strict`,
+    a report with errors raises BuildError after the build is otherwise complete.
+
+    Progress is reported through the 'build' logger. Returns a summary dict of the work done.
+    """
+    logger.info(">>> Starting SUPERCHARGED website build...")
+    started = time.perf_counter()
+    profiler = BuildProfiler(enabled=profile, cprofile=cprofile)
+
+    manifest = BuildManifest(changed_paths=changed)
+    full_build = full or manifest.is_empty
+    if full_build:
+        logger.info("-> Running a full build.")
+        manifest.previous = {}
+    elif changed is not None:
+        logger.info(f"-> Running a targeted build for: {', '.join(changed)}")
+    else:
+        logger.info("-> Running an incremental build.")
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    report = ValidationReport()
+
+    def assets():
+        return {'asset_map': build_assets(ASSETS_DIR, os.path.join(OUTPUT_DIR, 'assets'), manifest)}
+
+    def images():
+        return {'image_meta': optimize_images_to_webp(CONTENT_IMAGES_DIR, os.path.join(OUTPUT_DIR, 'content', 'images'), manifest, quality=image_quality, workers=image_workers, avif=image_avif, profiler=profiler)}
+
+    def static_files():
+        if os.path.exists(os.path.join(SRC_DIR, 'CNAME')):
+            copy_file(os.path.join(SRC_DIR, 'CNAME'), os.path.join(OUTPUT_DIR, 'CNAME'), manifest)
+        for md_path in list_files(os.path.join(CONTENT_DIR, 'blog')):
+            copy_file(md_path, os.path.join(OUTPUT_DIR, 'content', 'blog', os.path.relpath(md_path, os.path.join(CONTENT_DIR, 'blog'))), manifest)
+
+    def data_load():
+        site_data = load_site_data(report)
+        return {'site_data': site_data, 'missing_images': validate_site_data(site_data, report)}
+
+    def markdown(site_data):
+        post_pages = []
         for post in site_data.get('blog', []):
             md_path = os.path.join(CONTENT_DIR, 'blog', f"{post['slug']}.md")
             if os.path.exists(md_path):
-                with open(md_path, 'r', encoding='utf-8') as f:
-                    html_content = markdown2.markdown(f.read())
-                context = site_data.copy()
-                context.update({'active_page': 'blog', 'post': post, 'content': html_content})
-                output_filename = f"{post['slug']}.html"
-                with open(os.path.join(blog_output_dir, output_filename), 'w', encoding='utf-8') as f:
-                    f.write(post_template.render(context))
-            else:
-                print(f"  - WARNING: Markdown file not found for slug '{post['slug']}'")
+                post_pages.append((md_path, os.path.join(OUTPUT_DIR, 'blog', f"{post['slug']}.html"), {'active_page': 'blog', 'post': post}))
+        # Convert every post whose markdown changed since its page was last rendered, so cache misses run in parallel
+        # while the other stages do; pages re-rendered for other reasons find their markdown in the cache.
+        stale_md = [md_path for md_path, output_path, page_context in post_pages
+                    if (manifest.previous_inputs(output_path) or {}).get(f"file:{os.path.relpath(md_path, ROOT_DIR)}") != manifest.hash_file(md_path)]
+        cached, converted = warm_markdown_cache(stale_md, workers=markdown_workers)
+        profiler.cache('markdown', hits=cached, misses=converted)
+        logger.info(f"  - Markdown: {converted} converted, {cached} from cache.")
+        return {'post_pages': post_pages}
+
+    def environment(asset_map, image_meta, site_data):
+        return {'env': site_environment(image_meta, asset_map, site_data, profiler)}
+
+    def tally(results):
+        written = list(results)
+        return [sum(written), len(written) - sum(written)]
+
+    def main_pages(env):
+        logger.info("-> Rendering main pages...")
+        # blog.html is a paginated listing and is rendered with the blog below.
+        return {'main_pages': tally(render_page(env, manifest, filename, os.path.join(OUTPUT_DIR, filename), {'active_page': os.path.splitext(filename)[0]})
+                                    for filename in os.listdir(TEMPLATES_DIR) if filename.endswith('.html') and filename != 'blog.html')}
+
+    def portfolio_pages(env, site_data):
+        logger.info("-> Rendering portfolio pages...")
+        return {'portfolio_pages': tally(written for category in site_data.get('portfolio', []) for written in render_gallery_pages(env, manifest, category, gallery_page_size))}
+
+    def blog_posts(env, post_pages):
+        logger.info("-> Rendering blog posts...")
+
+        def convert_markdown(md_path):
+            with open(md_path, 'r', encoding='utf-8') as f:
+                return {'content': render_markdown(f.read())}
+
+        return {'blog_posts': tally(render_page(env, manifest, 'partials/post_detail.html', output_path, page_context, files=[md_path], prepare=functools.partial(convert_markdown, md_path))
+                                    for md_path, output_path, page_context in post_pages)}
+
+    def blog_listings(env, site_data):
+        logger.info("-> Rendering blog listings and feed...")
+        posts = sorted(site_data.get('blog', []), key=lambda post: post_date(post) or datetime.min, reverse=True)
+        return {'blog_listings': tally(itertools.chain(render_blog_listings(env, manifest, posts, blog_page_size), [render_feed(env, manifest, posts)]))}
+
+    def search_index(site_data, post_pages):
+        indexed, documents = build_search_index(os.path.join(OUTPUT_DIR, SEARCH_DIR_NAME), site_data, manifest)
+        profiler.cache('search', hits=documents - indexed, misses=indexed)
+
+    def css(asset_map, main_pages, portfolio_pages, blog_posts, blog_listings):
+        optimize_css(ASSETS_DIR, os.path.join(OUTPUT_DIR, 'assets'), asset_map, manifest, sorted(page for page in manifest.current if page.endswith('.html')))
+        write_asset_manifest(os.path.join(OUTPUT_DIR, 'assets'), asset_map, manifest)
+
+    def validation(missing_images):
+        logger.info("-> Validating references and links...")
+        validate_outputs(manifest, report, missing_images)
+        report.save()
+        report.log()
+
+    def compression():
+        compressed = compress_outputs(OUTPUT_DIR, manifest)
+        profiler.cache('compression', hits=sum(1 for key in manifest.current if key.endswith(COMPRESS_EXTENSIONS)) - len(compressed), misses=len(compressed))
+        return {'size_totals': size_report(OUTPUT_DIR, manifest, compressed)}
+
+    page_stages = ('main_pages', 'portfolio_pages', 'blog_posts', 'blog_listings')
+    # Every stage that records outputs must finish before css lists the pages and compression walks the manifest.
+    writers = ('asset_map', 'image_meta', 'static_files', 'search_index', 'css')
+    stages = [
+        Stage('assets', assets, outputs=['asset_map']),
+        Stage('images', images, outputs=['image_meta']),
+        Stage('static files', static_files, outputs=['static_files']),
+        Stage('data load', data_load, outputs=['site_data', 'missing_images']),
+        Stage('markdown', markdown, inputs=['site_data'], outputs=['post_pages']),
+        Stage('environment', environment, inputs=['asset_map', 'image_meta', 'site_data'], outputs=['env']),
+        Stage('main pages', main_pages, inputs=['env'], outputs=['main_pages']),
+        Stage('portfolio pages', portfolio_pages, inputs=['env', 'site_data'], outputs=['portfolio_pages']),
+        Stage('blog posts', blog_posts, inputs=['env', 'post_pages'], outputs=['blog_posts']),
+        Stage('blog listings', blog_listings, inputs=['env', 'site_data'], outputs=['blog_listings']),
+        Stage('search index', search_index, inputs=['site_data', 'post_pages'], outputs=['search_index']),
+        Stage('css', css, inputs=['asset_map', *page_stages], after=['static_files', 'search_index'], outputs=['css']),
+        Stage('validation', validation, inputs=['missing_images'], after=[*writers, *page_stages], outputs=['validation']),
+        Stage('compression', compression, after=writers, outputs=['size_totals']),
+    ]
+    try:
+        values = StageScheduler(stages, workers=1 if cprofile else STAGE_WORKERS, profiler=profiler).run()
+    except BuildError:
+        report.save()  # The data files are checked as soon as they load, so e.g. a malformed one is explained even when pages fail.
+        raise
+    rendered = sum(values[name][0] for name in page_stages)
+    skipped = sum(values[name][1] for name in page_stages)
+    profiler.cache('pages', hits=skipped, misses=rendered)
+    size_totals = values['size_totals']
+    logger.info(f"  - {rendered} pages rendered, {skipped} unchanged.")
+
+    with profiler.stage('cleanup'):
+        logger.info("-> Cleaning up stale outputs...")
+        removed = manifest.remove_unrecorded_outputs() if full_build else manifest.remove_stale_outputs()
+        changed_outputs = manifest.changed_outputs()
+        record_unpublished(changed_outputs, removed)
+        manifest.save()
+        prune_markdown_cache()
+        prune_image_cache()
 
+    seconds = time.perf_counter() - started
+    if profiler.enabled:
+        profiler.report(seconds)
+    if strict and report.errors:
+        raise BuildError(f"Validation found {len(report.errors)} errors; see {os.path.relpath(VALIDATION_FILE, ROOT_DIR)}")
     # --- THIS IS THE CORRECTED LINE ---
-    print("\nBuild finished. Your website is now faster!")
+    logger.info("Build finished. Your website is now faster!")
+    return {'pages_rendered': rendered, 'pages_unchanged': skipped, 'stale_removed': len(removed), 'bytes': size_totals, 'seconds': round(seconds, 3),
+            'changed_outputs': changed_outputs, 'removed_outputs': removed, 'validation': report.to_dict()}
 
 if __name__ == "__main__":
-    build()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the static website from src/ into docs/.")
+    parser.add_argument('--full', action='store_true', help="Ignore the build manifest and rebuild every output from scratch.")
+    parser.add_argument('--changed', nargs='+', metavar='PATH', help="Only re-check these source files and rebuild the outputs that depend on them.")
+    parser.add_argument('--quality', type=int, default=WEBP_QUALITY, help=f"WebP encoder quality, 0-100 (default: {WEBP_QUALITY}).")
+    parser.add_argument('--avif', action='store_true', help="Also emit AVIF variants of every image.")
+    parser.add_argument('--page-size', type=int, default=BLOG_PAGE_SIZE, help=f"Posts per blog listing page (default: {BLOG_PAGE_SIZE}).")
+    parser.add_argument('--gallery-page-size', type=int, default=GALLERY_PAGE_SIZE, help=f"Images per portfolio category page (default: {GALLERY_PAGE_SIZE}).")
+    parser.add_argument('--workers', type=int, default=IMAGE_WORKERS, help=f"Processes used to encode images and convert markdown (default: {IMAGE_WORKERS}).")
+    parser.add_argument('--profile', action='store_true', help="Time every stage and output and write a JSON report to .build_cache/build_profile.json.")
+    parser.add_argument('--cprofile', action='store_true', help="Like --profile, and also dump a cProfile of the slowest stage to .build_cache/profile/.")
+    parser.add_argument('--strict', action='store_true', help="Exit with an error when validation finds broken data, references or links.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    with build_lock():
+        build(full=args.full, changed=args.changed, image_quality=args.quality, image_workers=args.workers, image_avif=args.avif, blog_page_size=args.page_size, markdown_workers=args.workers, profile=args.profile, cprofile=args.cprofile, gallery_page_size=args.gallery_page_size, strict=args.strict)
@@ -1,10 +1,32 @@
 import os
+import sys
 import json
 import subprocess
 import shutil
-from flask import Flask, render_template, request, redirect, url_for, send_from_directory, flash
+import threading
+import logging
+import traceback
+import hashlib
+import time
+import copy
+import sqlite3
+import argparse
+import multiprocessing
+import functools
+import mimetypes
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from flask import Flask, Response, render_template, request, redirect, url_for, send_from_directory, flash, jsonify, abort
+from markupsafe import Markup
+from PIL import Image
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
 from datetime import datetime
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within this process.
+    fcntl = None
 
 # --- Configuration ---
 WEBSITE_ROOT_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -28,6 +50,15 @@ BLOG_FILE = os.path.join(DATA_PATH, 'blog.json')
 CLIENTS_FILE = os.path.join(DATA_PATH, 'clients.json')
 NAVIGATION_FILE = os.path.join(DATA_PATH, 'navigation.json')
 STYLES_FILE = os.path.join(DATA_PATH, 'styles.json')
+LIST_FILES = [BANNERS_FILE, TESTIMONIALS_FILE, TEAM_FILE, OFFERS_FILE, PROJECTS_FILE, VIDEOS_FILE, BLOG_FILE, PORTFOLIO_FILE, CLIENTS_FILE, NAVIGATION_FILE]
+DOCUMENT_FILES = [ABOUT_FILE, SERVICES_FILE, CONTACT_FILE, FOOTER_FILE, STYLES_FILE]
+LOCK_DIR = os.path.join(WEBSITE_ROOT_PATH, '.cms_locks')
+
+# --- Storage Backend ---
+# 'json' edits src/data/*.json in place. 'sqlite' keeps the content in DATABASE_FILE (stable record ids,
+# indexed slug/folder lookups, transactional updates) and exports the JSON files build.py reads after every save.
+CMS_STORAGE = os.environ.get('CMS_STORAGE', 'json')
+DATABASE_FILE = os.path.join(WEBSITE_ROOT_PATH, '.cms_data', 'content.sqlite3')
 
 # --- Image Upload Subfolders ---
 TEAM_UPLOAD_FOLDER, BANNERS_UPLOAD_FOLDER, OFFERS_UPLOAD_FOLDER, PROJECTS_UPLOAD_FOLDER, BLOG_UPLOAD_FOLDER, PORTFOLIO_UPLOAD_FOLDER, CLIENTS_UPLOAD_FOLDER = [
@@ -36,64 +67,813 @@ TEAM_UPLOAD_FOLDER, BANNERS_UPLOAD_FOLDER, OFFERS_UPLOAD_FOLDER, PROJECTS_UPLOAD
 ]
 BLOG_CONTENT_DIR = os.path.join(CONTENT_DIR, 'blog')
 
+# --- Upload Settings ---
+UPLOAD_MAX_BYTES = 20 * 1024 * 1024  # Per file; larger uploads are rejected while streaming.
+UPLOAD_MAX_DIMENSION = 2560  # Longest side kept after processing; camera originals are downscaled to this.
+UPLOAD_WORKERS = 2  # Processes that post-process uploaded images.
+UPLOAD_FORMATS = {'JPEG': '.jpg', 'PNG': '.png'}  # Detected image format -> blob extension; the formats build.IMAGE_EXTENSIONS covers.
+UPLOAD_STATUS_FILE = os.path.join(DATA_PATH, '_uploads.json')  # Processing state of uploads not yet ready, shared by all workers.
+UPLOAD_PROCESSING_TIMEOUT = 600  # Seconds after which an upload still 'processing' counts as failed (its worker was stopped).
+MEDIA_FOLDER = os.path.join(UPLOAD_FOLDER, 'media')  # Content-addressed uploads; see MediaStore.
+MEDIA_REFS_FILE = os.path.join(DATA_PATH, '_media.json')  # Reference counts; '_' files are skipped by build.load_site_data().
+MEDIA_GC_GRACE = 3600  # Seconds an unreferenced blob is kept, so an upload is not collected before its record is saved.
+MEDIA_GC_INTERVAL = 6 * 3600  # Seconds between the background full recounts and sweeps; saves only adjust the counts of the saved file.
+
+# --- Build Settings ---
+AUTO_REBUILD = True  # Re-render the pages affected by every save in the background.
+
+# --- Publish Settings ---
+DEPLOY_REMOTE = os.environ.get('CMS_DEPLOY_REMOTE')  # Remote name, URL or local bare repository path; unset pushes to the branch's upstream.
+DEPLOY_SUMMARY_FILES = 50  # Changed files listed individually in the deploy log.
+DEPLOY_REQUIRE_VALID = True  # Refuse to publish a build with validation errors (broken data, images or links) the last published build did not have.
+
+# --- Preview Settings ---
+PREVIEW_IMAGE_CACHE_SIZE = 256  # WebP previews kept in memory, least recently used evicted first.
+sys.path.insert(0, WEBSITE_ROOT_PATH)
+import build  # The static site engine; imported once so builds skip the interpreter and library cold start.
+
 # --- Flask App Initialization ---
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+app.config['MAX_CONTENT_LENGTH'] = 4 * UPLOAD_MAX_BYTES  # Whole request, so forms with several images still fit; larger ones get a 413 before the body is read.
+app.add_template_filter(build.media_path)  # Same image-path resolution as the site templates.
 app.secret_key = 'your_final_working_secret_key'
 
+# --- Data Access Layer ---
+class ConflictError(Exception):
+    """Raised when a document was changed by someone else since the editor loaded it."""
+
+class UploadError(Exception):
+    """Raised when an uploaded file is rejected; the message is shown to the editor."""
+
+class ValidationError(Exception):
+    """Raised when a save would add validation errors (see build.validate_data) to a data file; nothing is written."""
+    def __init__(self, filepath, issues):
+        super().__init__(f"{os.path.basename(filepath)}: {len(issues)} new validation errors"); self.filepath = filepath; self.issues = issues
+
+JsonDocument = namedtuple('JsonDocument', 'stat_key version data')
+
+class JsonStore:
+    """Keeps parsed JSON documents in memory and serializes writes to them.
+
+    A cached document is reused until the file's inode, mtime or size changes. Writes go to a temp
+    file that is renamed over the original, so readers (including build.py) never see a torn file.
+    Writers of the same file are serialized by a thread lock plus an flock() on a file in LOCK_DIR,
+    which also covers multiple gunicorn workers. Every document has a version (its content hash);
+    writers can pass the version they started from to detect conflicting edits.
+    """
+    def __init__(self, lock_dir):
+        self.lock_dir = lock_dir
+        self.documents = {}
+        self.thread_locks = {}
+        self.guard = threading.Lock()
+
+    def empty(self, filepath): return [] if filepath in LIST_FILES else {}
+
+    def load(self, filepath):
+        try: stat = os.stat(filepath)
+        except FileNotFoundError: return JsonDocument(None, '0', self.empty(filepath))
+        stat_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        cached = self.documents.get(filepath)
+        if cached and cached.stat_key == stat_key: return cached
+        with open(filepath, 'rb') as f: raw = f.read()
+        try: data = json.loads(raw) if raw.strip() else self.empty(filepath)
+        except json.JSONDecodeError: data = self.empty(filepath)
+        document = JsonDocument(stat_key, hashlib.sha1(raw).hexdigest(), data)
+        with self.guard: self.documents[filepath] = document
+        return document
+
+    @contextmanager
+    def lock(self, filepath):
+        with self.guard: thread_lock = self.thread_locks.setdefault(filepath, threading.Lock())
+        with thread_lock:
+            if fcntl is None: yield; return
+            os.makedirs(self.lock_dir, exist_ok=True)
+            with open(os.path.join(self.lock_dir, os.path.basename(filepath) + '.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try: yield
+                finally: fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def write(self, filepath, data, before=None):
+        # Callers must hold self.lock(filepath).
+        write_file_atomic(filepath, json.dumps(data, indent=2, ensure_ascii=False))
+        self.load(filepath)
+        content_saved(filepath, before, data)
+
+    @contextmanager
+    def edit(self, filepath, expected_version=None):
+        """Yields a private copy of the document and writes it back (if it changed) when the block exits."""
+        with self.lock(filepath):
+            document = self.load(filepath)
+            if expected_version and expected_version != document.version: raise ConflictError(filepath)
+            data = copy.deepcopy(document.data)
+            yield data
+            if data != document.data: validate_save(filepath, data, document.data); self.write(filepath, data, document.data)
+
+    # Record API for list files. A JSON file has no ids of its own, so a record's id is its list position
+    # and its version is the version of the whole file.
+    def records(self, filepath):
+        document = self.load(filepath); return list(enumerate(document.data)), document.version
+
+    def get_record(self, filepath, record_id):
+        document = self.load(filepath)
+        return (document.data[record_id] if 0 <= record_id < len(document.data) else None), document.version
+
+    @contextmanager
+    def edit_record(self, filepath, record_id, expected_version=None):
+        with self.edit(filepath, expected_version) as data: yield data[record_id] if 0 <= record_id < len(data) else None
+
+    @contextmanager
+    def new_record(self, filepath, record, unique=None):
+        """Yields the record (with its `unique` field made unique) and appends it when the block exits."""
+        with self.edit(filepath) as data:
+            if unique: record[unique] = self.unique_value(filepath, unique, record[unique])
+            yield record
+            data.append(record)
+
+    def delete_record(self, filepath, record_id, expected_version=None):
+        with self.edit(filepath, expected_version) as data: return data.pop(record_id) if 0 <= record_id < len(data) else None
+
+    def move_record(self, filepath, record_id, offset, expected_version=None):
+        with self.edit(filepath, expected_version) as data:
+            target = record_id + offset
+            if 0 <= record_id < len(data) and 0 <= target < len(data): data[record_id], data[target] = data[target], data[record_id]
+
+    def unique_value(self, filepath, field, value, exclude_id=None):
+        # Only called while the file is locked, so the returned value stays free until the caller writes.
+        taken = {record.get(field) for i, record in enumerate(self.load(filepath).data) if i != exclude_id}
+        candidate, counter = value, 1
+        while candidate in taken: candidate = f"{value}-{counter}"; counter += 1
+        return candidate
+
+class SqliteStore:
+    """Keeps CMS content in SQLite and re-exports a collection to its src/data/*.json file after every write.
+
+    List files become rows in `records`, with stable ids, a position for ordering and indexed slug/folder
+    columns; the other files become rows in `documents`. The exported JSON has exactly the shape
+    load_site_data() reads, so build.py and the committed data are unaffected by the backend. A collection
+    is seeded from its JSON file the first time the database sees it. Every write is one IMMEDIATE
+    transaction. The collection version guards whole-collection edits; each record also has its own
+    version, so two people editing different blog posts no longer conflict.
+    """
+    INDEXED_FIELDS = ('slug', 'folder')
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS collections (name TEXT PRIMARY KEY, version INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS records (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, collection TEXT NOT NULL, position INTEGER NOT NULL,
+            version INTEGER NOT NULL DEFAULT 1, slug TEXT, folder TEXT, data TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS records_position ON records (collection, position);
+        CREATE INDEX IF NOT EXISTS records_slug ON records (collection, slug);
+        CREATE INDEX IF NOT EXISTS records_folder ON records (collection, folder);
+    """
+
+    def __init__(self, db_path, data_files, source):
+        self.db_path = db_path
+        self.data_files = data_files
+        self.source = source  # JsonStore used to read the JSON files when seeding.
+        self.local = threading.local()
+        self.guard = threading.Lock()
+        self.seeded = False
+
+    def name(self, filepath): return os.path.splitext(os.path.basename(filepath))[0]
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL'); conn.executescript(self.SCHEMA)
+            self.local.conn = conn
+            with self.guard:
+                if not self.seeded: self.import_json(replace=False, conn=conn); self.seeded = True
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=True, conn=None):
+        conn = conn or self.connection()
+        conn.execute('BEGIN IMMEDIATE' if immediate else 'BEGIN')
+        try: yield conn
+        except BaseException: conn.execute('ROLLBACK'); raise
+        else: conn.execute('COMMIT')
+
+    def collection_version(self, conn, name):
+        row = conn.execute('SELECT version FROM collections WHERE name = ?', (name,)).fetchone()
+        return str(row[0]) if row else '0'
+
+    @contextmanager
+    def write(self, filepath, expected_version=None):
+        """Write transaction on one collection; if the block changed anything, bumps its version and re-exports the JSON file."""
+        name = self.name(filepath)
+        with self.transaction() as conn:
+            if expected_version and expected_version != self.collection_version(conn, name): raise ConflictError(filepath)
+            changes = conn.total_changes
+            yield conn
+            changed = conn.total_changes != changes
+            if changed:
+                before, after = self.source.load(filepath).data, self.read_data(conn, filepath)  # The JSON file still holds the last export.
+                validate_save(filepath, after, before)  # Raising rolls the transaction back.
+                conn.execute('INSERT INTO collections (name, version) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+                self.export(conn, filepath)  # Inside the transaction, so concurrent saves export in commit order.
+        if changed: content_saved(filepath, before, after)
+
+    def read_data(self, conn, filepath):
+        name = self.name(filepath)
+        if filepath in LIST_FILES: return [json.loads(row[0]) for row in conn.execute('SELECT data FROM records WHERE collection = ? ORDER BY position, id', (name,))]
+        row = conn.execute('SELECT data FROM documents WHERE name = ?', (name,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def store_data(self, conn, filepath, data):
+        name = self.name(filepath)
+        if filepath in LIST_FILES:
+            # Diffed against the existing rows so ids stay stable: an unchanged record keeps its row (wherever it moved), an edited
+            # one keeps the unclaimed row at its position (its version is bumped), other records are inserted and leftover rows deleted.
+            # (id, index in list order, stored position, record); stored positions can have gaps left by deletes.
+            rows = [(row_id, index, position, json.loads(row_data)) for index, (row_id, position, row_data) in enumerate(conn.execute('SELECT id, position, data FROM records WHERE collection = ? ORDER BY position, id', (name,)))]
+            claimed = [None] * len(data); free = list(rows)
+            for i, record in enumerate(data):
+                match = next((row for row in free if row[3] == record), None)
+                if match: claimed[i] = match; free.remove(match)
+            for position, record in enumerate(data):
+                row = claimed[position] or next((row for row in free if row[1] == position), None)
+                if row in free: free.remove(row)
+                if row is None: self.insert_row(conn, name, position, record)
+                elif row[3] != record: conn.execute('UPDATE records SET position = ?, data = ?, slug = ?, folder = ?, version = version + 1 WHERE id = ?', (position, json.dumps(record, ensure_ascii=False), *(record.get(f) for f in self.INDEXED_FIELDS), row[0]))
+                elif row[2] != position: conn.execute('UPDATE records SET position = ? WHERE id = ?', (position, row[0]))
+            for row in free: conn.execute('DELETE FROM records WHERE id = ?', (row[0],))
+        else: conn.execute('INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)', (name, json.dumps(data, ensure_ascii=False)))
+
+    def insert_row(self, conn, name, position, record):
+        return conn.execute('INSERT INTO records (collection, position, slug, folder, data) VALUES (?, ?, ?, ?, ?)', (name, position, *(record.get(f) for f in self.INDEXED_FIELDS), json.dumps(record, ensure_ascii=False))).lastrowid
+
+    def export(self, conn, filepath): write_file_atomic(filepath, json.dumps(self.read_data(conn, filepath), indent=2, ensure_ascii=False))
+
+    def import_json(self, replace=True, conn=None):
+        """Loads src/data/*.json into the database. With replace=False only collections it has never seen are imported."""
+        with self.transaction(conn=conn) as conn:
+            for filepath in self.data_files:
+                name = self.name(filepath)
+                if not replace and conn.execute('SELECT 1 FROM collections WHERE name = ?', (name,)).fetchone(): continue
+                self.store_data(conn, filepath, self.source.load(filepath).data)
+                conn.execute('INSERT INTO collections (name, version) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET version = version + 1', (name,))
+
+    def export_json(self):
+        with self.transaction(immediate=False) as conn:
+            for filepath in self.data_files: self.export(conn, filepath)
+
+    # Same interface as JsonStore.
+    def load(self, filepath):
+        with self.transaction(immediate=False) as conn: return JsonDocument(None, self.collection_version(conn, self.name(filepath)), self.read_data(conn, filepath))
+
+    @contextmanager
+    def edit(self, filepath, expected_version=None):
+        with self.write(filepath, expected_version) as conn:
+            current = self.read_data(conn, filepath); data = copy.deepcopy(current)
+            yield data
+            if data != current: self.store_data(conn, filepath, data)
+
+    def records(self, filepath):
+        name = self.name(filepath)
+        with self.transaction(immediate=False) as conn:
+            rows = conn.execute('SELECT id, data FROM records WHERE collection = ? ORDER BY position, id', (name,)).fetchall()
+            return [(record_id, json.loads(data)) for record_id, data in rows], self.collection_version(conn, name)
+
+    def get_record(self, filepath, record_id):
+        row = self.connection().execute('SELECT data, version FROM records WHERE id = ? AND collection = ?', (record_id, self.name(filepath))).fetchone()
+        return (json.loads(row[0]), str(row[1])) if row else (None, None)
+
+    @contextmanager
+    def edit_record(self, filepath, record_id, expected_version=None):
+        with self.write(filepath) as conn:
+            row = conn.execute('SELECT data, version FROM records WHERE id = ? AND collection = ?', (record_id, self.name(filepath))).fetchone()
+            if row is None: yield None; return
+            if expected_version and expected_version != str(row[1]): raise ConflictError(filepath)
+            record = json.loads(row[0])
+            yield record
+            if record != json.loads(row[0]):
+                conn.execute('UPDATE records SET data = ?, slug = ?, folder = ?, version = version + 1 WHERE id = ?', (json.dumps(record, ensure_ascii=False), *(record.get(f) for f in self.INDEXED_FIELDS), record_id))
+
+    @contextmanager
+    def new_record(self, filepath, record, unique=None):
+        name = self.name(filepath)
+        with self.write(filepath) as conn:
+            if unique: record[unique] = self.unique_value(filepath, unique, record[unique])
+            yield record
+            position = conn.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM records WHERE collection = ?', (name,)).fetchone()[0]
+            self.insert_row(conn, name, position, record)
+
+    def delete_record(self, filepath, record_id, expected_version=None):
+        # Ids are stable, so a delete from an outdated list page still removes the intended record.
+        with self.write(filepath) as conn:
+            row = conn.execute('SELECT data FROM records WHERE id = ? AND collection = ?', (record_id, self.name(filepath))).fetchone()
+            if row is None: return None
+            conn.execute('DELETE FROM records WHERE id = ?', (record_id,)); return json.loads(row[0])
+
+    def move_record(self, filepath, record_id, offset, expected_version=None):
+        name = self.name(filepath)
+        with self.write(filepath) as conn:
+            row = conn.execute('SELECT position FROM records WHERE id = ? AND collection = ?', (record_id, name)).fetchone()
+            if row is None: return
+            query = 'SELECT id, position FROM records WHERE collection = ? AND position < ? ORDER BY position DESC LIMIT 1' if offset < 0 else 'SELECT id, position FROM records WHERE collection = ? AND position > ? ORDER BY position LIMIT 1'
+            neighbour = conn.execute(query, (name, row[0])).fetchone()
+            if neighbour:
+                conn.execute('UPDATE records SET position = ? WHERE id = ?', (neighbour[1], record_id)); conn.execute('UPDATE records SET position = ? WHERE id = ?', (row[0], neighbour[0]))
+
+    def unique_value(self, filepath, field, value, exclude_id=None):
+        # Called inside a write transaction, which holds SQLite's write lock until the caller commits.
+        if field not in self.INDEXED_FIELDS: raise ValueError(f"{field} is not an indexed field")
+        conn = self.connection(); name = self.name(filepath); candidate, counter = value, 1
+        while conn.execute(f'SELECT 1 FROM records WHERE collection = ? AND {field} = ? AND id IS NOT ? LIMIT 1', (name, candidate, exclude_id)).fetchone(): candidate = f"{value}-{counter}"; counter += 1
+        return candidate
+
+def write_file_atomic(filepath, content):
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    tmp_path = os.path.join(os.path.dirname(filepath), f".{os.path.basename(filepath)}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f: f.write(content); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+
+json_store = JsonStore(LOCK_DIR)
+content_store = SqliteStore(DATABASE_FILE, LIST_FILES + DOCUMENT_FILES, json_store) if CMS_STORAGE == 'sqlite' else json_store
+
 # --- Helper Functions ---
 def get_json_data(filepath):
-    list_files = [BANNERS_FILE, TESTIMONIALS_FILE, TEAM_FILE, OFFERS_FILE, PROJECTS_FILE, VIDEOS_FILE, BLOG_FILE, PORTFOLIO_FILE, CLIENTS_FILE, NAVIGATION_FILE]
-    if not os.path.exists(filepath): return [] if filepath in list_files else {}
-    try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            content = f.read()
-            if not content: return [] if filepath in list_files else {}
-            return json.loads(content)
-    except json.JSONDecodeError: return [] if filepath in list_files else {}
+    """Returns the document's data. With the JSON backend it is shared between requests: treat it as read-only and use edit_json_data() to change it."""
+    return content_store.load(filepath).data
 
-def save_json_data(filepath, data):
-    os.makedirs(os.path.dirname(filepath), exist_ok=True)
-    with open(filepath, 'w', encoding='utf-8') as f: json.dump(data, f, indent=2, ensure_ascii=False)
+def get_json_document(filepath):
+    """Returns (data, version); pass the version back to edit_json_data()/save_json_data() to detect conflicting edits."""
+    document = content_store.load(filepath); return document.data, document.version
+
+SaveEffects = namedtuple('SaveEffects', 'actions files')
+save_effects = threading.local()
+
+@contextmanager
+def deferred_effects():
+    """Collects the file side effects registered with after_commit() while the save it wraps runs, and runs them once it committed.
+
+    A save that raises (ValidationError, ConflictError) leaves the files as they were. The effects' `files` are the
+    paths they will write, which validate_save() counts as existing.
+    """
+    outer = getattr(save_effects, 'current', None); effects = save_effects.current = SaveEffects([], [])
+    try: yield effects
+    finally: save_effects.current = outer
+    for action in effects.actions: action()
+
+def after_commit(action, writes=None):
+    """Runs `action` once the current save has committed (right away outside of one); `writes` is a file path it creates."""
+    effects = getattr(save_effects, 'current', None)
+    if effects is None: return action()
+    effects.actions.append(action)
+    if writes: effects.files.append(writes)
+
+@contextmanager
+def edit_json_data(filepath, expected_version=None):
+    with deferred_effects(), content_store.edit(filepath, expected_version) as data: yield data
+
+def save_json_data(filepath, data, expected_version=None):
+    with content_store.edit(filepath, expected_version) as current:
+        if isinstance(current, list): current[:] = data
+        else: current.clear(); current.update(data)
+
+# Records of list files are addressed by id: the list position with the JSON backend, a stable primary key with SQLite.
+def list_records(filepath):
+    """Returns ([(id, record), ...], version) in display order."""
+    return content_store.records(filepath)
+def get_record(filepath, record_id):
+    """Returns (record, version), or (None, ...) if there is no such record; pass the version back to edit_record()."""
+    return content_store.get_record(filepath, record_id)
+@contextmanager
+def edit_record(filepath, record_id, expected_version=None):
+    with deferred_effects(), content_store.edit_record(filepath, record_id, expected_version) as record: yield record
+@contextmanager
+def new_record(filepath, record, unique=None):
+    with deferred_effects(), content_store.new_record(filepath, record, unique): yield record
+def insert_record(filepath, record, unique=None):
+    with new_record(filepath, record, unique): pass
+def delete_record(filepath, record_id, expected_version=None): return content_store.delete_record(filepath, record_id, expected_version)
+def move_record(filepath, record_id, offset, expected_version=None): return content_store.move_record(filepath, record_id, offset, expected_version)
+def unique_value(filepath, field, value, exclude_id=None):
+    """Returns value, or value-1, value-2, ... if another record already uses it. Call inside edit_record()/new_record()."""
+    return content_store.unique_value(filepath, field, value, exclude_id)
+
+# --- Background Builds & Deploys ---
+# Builds share the build manifest and docs/, so every build runs under build.build_lock() (a file lock, also taken by other workers and `python build.py`).
+pending_rebuild_paths = set()
+pending_rebuild_lock = threading.Lock()
+rebuild_running = False  # A worker is draining pending_rebuild_paths; guarded by pending_rebuild_lock.
+
+def run_pending_rebuilds():
+    global rebuild_running
+    while True:
+        with pending_rebuild_lock:
+            if not pending_rebuild_paths:
+                rebuild_running = False; return
+            paths = sorted(pending_rebuild_paths); pending_rebuild_paths.clear()
+        try:
+            with build.build_lock(): build.build(changed=paths)
+        except Exception: print(f"Targeted rebuild failed for {paths}:\n{traceback.format_exc()}")
+
+def request_rebuild(*paths):
+    """Queues a targeted `build(changed=...)` run; saves made while a rebuild is running are batched into the next one."""
+    global rebuild_running
+    if not AUTO_REBUILD: return
+    with pending_rebuild_lock:
+        start_worker = not rebuild_running; rebuild_running = True
+        pending_rebuild_paths.update(paths)
+    if start_worker: threading.Thread(target=run_pending_rebuilds, daemon=True).start()
+
+class DeployLogHandler(logging.Handler):
+    def __init__(self, worker):
+        super().__init__(); self.worker = worker; self.setFormatter(logging.Formatter('%(message)s'))
+    def emit(self, record): self.worker.log(self.format(record))
+
+class DeployWorker:
+    """Runs build + git publish on a background thread so /deploy returns immediately.
+
+    Only one deploy runs at a time. Requests that arrive while one is running are coalesced into a
+    single follow-up run with the latest commit message, so double-clicks never queue duplicate builds.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = False
+        self.queued_message = None
+        self.run_id = 0
+        self.state = 'idle'  # idle | running | succeeded | warning | failed
+        self.lines = []
+
+    def request(self, commit_message):
+        """Returns 'started', 'queued' (runs after the current deploy) or 'merged' (joined an already queued deploy)."""
+        with self.lock:
+            if not self.running:
+                self.running = True; self.queued_message = commit_message
+                threading.Thread(target=self.run_queue, daemon=True).start()
+                return 'started'
+            merged = self.queued_message is not None
+            self.queued_message = commit_message
+            return 'merged' if merged else 'queued'
+
+    def log(self, line):
+        with self.lock: self.lines.extend(str(line).rstrip('\n').split('\n'))
+
+    def status(self, since=0, run_id=None):
+        with self.lock:
+            if run_id != self.run_id: since = 0
+            return {'run_id': self.run_id, 'state': self.state, 'running': self.running, 'queued': self.queued_message is not None, 'lines': self.lines[since:], 'next': len(self.lines)}
+
+    def run_queue(self):
+        while True:
+            with self.lock:
+                message, self.queued_message = self.queued_message, None
+                if message is None: self.running = False; return
+                self.run_id += 1; self.state = 'running'; self.lines = []
+            state = self.deploy(message)
+            with self.lock: self.state = state
+
+    def git(self, *args, check=True, paths=None):
+        """Runs git in the site repository; `paths` are fed to --pathspec-from-file on stdin."""
+        self.log(f">>> Running git {' '.join(args)}{f' ({len(paths)} paths)' if paths is not None else ''}...")
+        if paths is not None: args = ('--literal-pathspecs', *args, '--pathspec-from-file=-', '--pathspec-file-nul')
+        result = subprocess.run(['git', *args], cwd=WEBSITE_ROOT_PATH, capture_output=True, text=True, check=check, encoding='utf-8',
+                                input='\0'.join(paths) if paths is not None else None)
+        self.log(result.stdout + result.stderr)
+        return result
+
+    def stage(self, published):
+        """Stages src/ and only the build outputs in `published` ({output key: 'changed' | 'removed'})."""
+        def repo_path(key): return os.path.relpath(os.path.join(build.OUTPUT_DIR, key), WEBSITE_ROOT_PATH).replace(os.sep, '/')
+        changed = [repo_path(key) for key, state in sorted(published.items()) if state == 'changed']
+        removed = [repo_path(key) for key, state in sorted(published.items()) if state == 'removed']
+        self.git('add', '-A', '--', os.path.relpath(build.SRC_DIR, WEBSITE_ROOT_PATH))
+        if changed: self.git('add', '-A', paths=changed)
+        if removed: self.git('rm', '-q', '--cached', '--ignore-unmatch', paths=removed)
+
+    def publish_summary(self, published):
+        changed = sorted(key for key, state in published.items() if state == 'changed')
+        sizes = {key: os.path.getsize(os.path.join(build.OUTPUT_DIR, key)) for key in changed if os.path.exists(os.path.join(build.OUTPUT_DIR, key))}
+        self.log(f"Published {len(changed)} changed outputs ({sum(sizes.values()):,} bytes), {len(published) - len(changed)} removed:")
+        for key in changed[:DEPLOY_SUMMARY_FILES]: self.log(f"  {sizes.get(key, 0):>10,}  {key}")
+        if len(changed) > DEPLOY_SUMMARY_FILES: self.log(f"  ... and {len(changed) - DEPLOY_SUMMARY_FILES} more")
+        for key in sorted(key for key, state in published.items() if state == 'removed'): self.log(f"  {'removed':>10}  {key}")
+
+    def deploy(self, commit_message):
+        handler = DeployLogHandler(self)
+        try:
+            self.log(">>> Running build...")
+            # The build lock is held until the commit, so no background rebuild changes outputs between staging and committing.
+            with build.build_lock():
+                build.logger.addHandler(handler); build.logger.setLevel(logging.INFO)
+                try: summary = build.build(profile=True)  # Stage timings and cache hit rates end up in the deploy log.
+                finally: build.logger.removeHandler(handler)
+                self.log(f"Build summary: {dict((key, value) for key, value in summary.items() if key not in ('changed_outputs', 'removed_outputs', 'validation'))}")
+                report, baseline = build.ValidationReport.from_dict(summary['validation']), build.published_validation()
+                # Before the first recorded publish every error counts as known: the site is already live with them.
+                new_errors = report.new_errors(baseline) if baseline is not None else []
+                if report.errors: self.log(f"Validation: {len(report.errors)} errors, {len(new_errors)} new since the last publish (full report in {os.path.relpath(build.VALIDATION_FILE, WEBSITE_ROOT_PATH)}).")
+                if new_errors and DEPLOY_REQUIRE_VALID:
+                    self.log(f"\n\n❌ VALIDATION FAILED! ❌\n{len(new_errors)} new errors must be fixed before publishing:")
+                    for issue in new_errors: self.log(f"  {build.describe_issue(issue)}")
+                    return 'failed'
+                published = build.unpublished_outputs()
+                self.stage(published)
+                commit_process = self.git('commit', '-m', commit_message, check=False)
+                if "nothing to commit" in commit_process.stdout.lower(): build.clear_unpublished(published); build.record_published_validation(report)  # Already matches the last commit.
+                if "nothing to commit" in commit_process.stdout.lower() or commit_process.returncode != 0:
+                    self.log("No changes to commit or commit failed. Skipping push."); return 'warning'
+                build.clear_unpublished(published); build.record_published_validation(report)
+            self.publish_summary(published)
+            if DEPLOY_REMOTE: self.git('push', DEPLOY_REMOTE, 'HEAD')
+            else: self.git('push')
+            self.log("\n✅ DEPLOYMENT SUCCESSFUL! ✅"); return 'succeeded'
+        except subprocess.CalledProcessError as e:
+            self.log(f"\n\n❌ DEPLOYMENT FAILED! ❌\nCommand '{' '.join(e.cmd)}' failed.\n--- STDOUT ---\n{e.stdout}\n--- STDERR ---\n{e.stderr}"); return 'failed'
+        except Exception:
+            self.log(f"\n\n❌ UNEXPECTED ERROR! ❌\n{traceback.format_exc()}"); return 'failed'
+
+deploy_worker = DeployWorker()
+
+def portfolio_images(folder):
+    path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, folder)
+    return [name for name in os.listdir(path) if name.lower().endswith(build.IMAGE_EXTENSIONS)] if os.path.isdir(path) else []
 
 def delete_image_file(image_filename, subfolder=""):
-    if not image_filename: return
+    if not image_filename or image_filename.startswith(build.MEDIA_PREFIX): return  # Media blobs are garbage-collected once unreferenced.
     try:
         path = os.path.join(UPLOAD_FOLDER, subfolder, image_filename) if subfolder else os.path.join(UPLOAD_FOLDER, image_filename)
         if os.path.exists(path): os.remove(path)
     except OSError as e: print(f"Error deleting file '{path}': {e}")
 
+class UploadProcessor:
+    """Post-processes uploaded images on a process pool so upload requests return as soon as the file is on disk.
+
+    Each image gets its EXIF orientation applied, is downscaled to UPLOAD_MAX_DIMENSION and has its
+    WebP/responsive variants encoded into the build's image cache (see build.prepare_image), so the next
+    build only copies them. Uploads still processing or that failed are listed in UPLOAD_STATUS_FILE, next to
+    MEDIA_REFS_FILE, so every worker's manage pages show them; an upload is dropped from it once ready.
+    """
+    def __init__(self, status_file, locks, workers=UPLOAD_WORKERS):
+        self.status_file = status_file  # Path relative to UPLOAD_FOLDER -> {'state': 'processing' | 'failed', 'since' | 'error'}
+        self.locks = locks  # JsonStore that caches UPLOAD_STATUS_FILE and serializes its updates across workers.
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.pool = None
+
+    def submit(self, path):
+        key = os.path.relpath(path, UPLOAD_FOLDER).replace(os.sep, '/')
+        self.set_status(key, {'state': 'processing', 'since': time.time()})
+        with self.lock:
+            # 'spawn': forking a multi-threaded server can deadlock the children.
+            if self.pool is None: self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            future = self.pool.submit(build.prepare_image, path, UPLOAD_MAX_DIMENSION)
+        future.add_done_callback(lambda f: self.finished(key, path, f))
+
+    def finished(self, key, path, future):
+        try: future.result(); entry = None
+        except Exception as e: entry = {'state': 'failed', 'error': str(e)}; print(f"Could not process upload '{key}': {e}")
+        self.set_status(key, entry)
+        if os.path.exists(path): request_rebuild(path)
+
+    def set_status(self, key, entry):
+        """Records an upload's state, or drops it (entry None); entries whose file is gone are pruned at the same time."""
+        with self.locks.lock(self.status_file):
+            uploads = {name: state for name, state in self.locks.load(self.status_file).data.items() if name != key and os.path.exists(os.path.join(UPLOAD_FOLDER, name))}
+            if entry is not None: uploads[key] = entry
+            write_file_atomic(self.status_file, json.dumps(uploads, indent=2, sort_keys=True)); self.locks.load(self.status_file)
+
+    def status(self, key):
+        """The upload's state if it is still processing or failed; None once it is ready."""
+        entry = self.locks.load(self.status_file).data.get(key)
+        if entry and entry['state'] == 'processing' and time.time() - entry['since'] > UPLOAD_PROCESSING_TIMEOUT: return {'state': 'failed', 'error': 'Processing was interrupted.'}
+        return entry
+
+upload_processor = UploadProcessor(UPLOAD_STATUS_FILE, json_store)
+
+def media_references(value, counts=None):
+    """Counts the media names used in a JSON value, e.g. {'media/ab12….jpg': 2}."""
+    counts = {} if counts is None else counts
+    if isinstance(value, str) and value.startswith(build.MEDIA_PREFIX): counts[value] = counts.get(value, 0) + 1
+    elif isinstance(value, dict): [media_references(v, counts) for v in value.values()]
+    elif isinstance(value, list): [media_references(v, counts) for v in value]
+    return counts
+
+class MediaStore:
+    """Content-addressed storage for uploaded images in MEDIA_FOLDER, with reference counts and garbage collection.
+
+    An upload is named after the SHA-256 of its bytes ('media/<hash>.jpg'), so the same file uploaded for
+    several records is stored, processed and converted by the build once, and two different files can no
+    longer overwrite each other because they share a name. Reference counts are kept in MEDIA_REFS_FILE
+    next to the JSON data; each save only applies the difference between the saved file's old and new
+    media names. A full recount from all content, which also deletes blobs no record references any more
+    once they are older than MEDIA_GC_GRACE (so an upload whose record is still being saved is never
+    collected), runs in the background every MEDIA_GC_INTERVAL and on --gc-media.
+    """
+    def __init__(self, folder, refs_file, locks):
+        self.folder = folder
+        self.refs_file = refs_file
+        self.locks = locks  # JsonStore whose lock() serializes MEDIA_REFS_FILE updates across threads and workers.
+        self.guard = threading.Lock()
+        self.last_sweep = None
+
+    def store(self, file_storage):
+        """Streams an upload into the store in chunks, enforcing UPLOAD_MAX_BYTES; returns its media name.
+
+        The file is written under a temporary name and renamed into place, so the build never reads a partial upload.
+        Its extension comes from the image format detected in its content, never from the client's file name.
+        """
+        filename = secure_filename(file_storage.filename) or 'upload'
+        os.makedirs(self.folder, exist_ok=True); tmp_path = os.path.join(self.folder, f".{os.getpid()}.{threading.get_ident()}.upload"); digest = hashlib.sha256(); written = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in iter(lambda: file_storage.stream.read(1 << 16), b''):
+                    written += len(chunk)
+                    if written > UPLOAD_MAX_BYTES: raise UploadError(f"'{filename}' is larger than the {UPLOAD_MAX_BYTES // (1024 * 1024)} MB upload limit.")
+                    digest.update(chunk); f.write(chunk)
+            try:
+                with Image.open(tmp_path) as img: extension = UPLOAD_FORMATS.get(img.format)  # Only reads the header.
+            except OSError: extension = None  # Not an image at all.
+            if extension is None: raise UploadError(f"'{filename}' is not a {' or '.join(UPLOAD_FORMATS)} image.")
+            name = build.MEDIA_PREFIX + digest.hexdigest()[:32] + extension; path = os.path.join(UPLOAD_FOLDER, name)
+            if os.path.exists(path): os.utime(path); return name  # Already stored (and processed); touching it restarts the GC grace period.
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+        upload_processor.submit(path)
+        return name
+
+    def references(self):
+        """Counts the media names used by every collection and document, e.g. {'media/ab12….jpg': 2}."""
+        counts = {}
+        for filepath in LIST_FILES + DOCUMENT_FILES: media_references(get_json_data(filepath), counts)
+        return dict(sorted(counts.items()))
+
+    def write_counts(self, counts):
+        payload = json.dumps(dict(sorted(counts.items())), indent=2)
+        try:
+            with open(self.refs_file, 'r', encoding='utf-8') as f: current = f.read()
+        except FileNotFoundError: current = None
+        if payload != current: write_file_atomic(self.refs_file, payload)
+
+    def update(self, before, after):
+        """Applies one save to MEDIA_REFS_FILE: only the media names of the saved document's old and new content are counted."""
+        old, new = media_references(before), media_references(after)
+        if old == new: return
+        with self.locks.lock(self.refs_file):
+            try:
+                with open(self.refs_file, 'r', encoding='utf-8') as f: counts = json.load(f)
+            except (OSError, json.JSONDecodeError): counts = self.references(); old = new = {}  # No usable counts yet: recount once (the save is already on disk).
+            for name in set(old) | set(new):
+                count = counts.get(name, 0) - old.get(name, 0) + new.get(name, 0)
+                if count > 0: counts[name] = count
+                else: counts.pop(name, None)
+            self.write_counts(counts)
+
+    def sweep_due(self):
+        """Starts a background refresh() if none has run in this process for MEDIA_GC_INTERVAL; it also corrects any drift in the counts."""
+        with self.guard:
+            if self.last_sweep is not None and time.monotonic() - self.last_sweep < MEDIA_GC_INTERVAL: return
+            self.last_sweep = time.monotonic()
+        threading.Thread(target=self.sweep, daemon=True).start()
+
+    def sweep(self):
+        try: removed = self.refresh()
+        except Exception: print(f"Media sweep failed:\n{traceback.format_exc()}"); return
+        if removed: request_rebuild(*removed)
+
+    def refresh(self, grace=None):
+        """Recounts every reference into MEDIA_REFS_FILE and garbage-collects unreferenced blobs; returns the deleted paths."""
+        grace = MEDIA_GC_GRACE if grace is None else grace
+        with self.locks.lock(self.refs_file):
+            counts = self.references(); self.write_counts(counts)
+            removed = []
+            if os.path.isdir(self.folder):
+                cutoff = time.time() - grace
+                for entry in os.scandir(self.folder):
+                    name = build.MEDIA_PREFIX + entry.name
+                    if entry.is_file() and not entry.name.startswith('.') and name not in counts and entry.stat().st_mtime < cutoff:
+                        os.remove(entry.path); removed.append(entry.path)
+            return removed
+
+media_store = MediaStore(MEDIA_FOLDER, MEDIA_REFS_FILE, json_store)
+
+def save_upload(file_storage):
+    """Stores an uploaded image in the media store and queues it for processing; returns the name to save in the record."""
+    return media_store.store(file_storage)
+
+def replace_upload(file_storage, old_filename, subfolder=""):
+    """save_upload() for edit forms. A replaced media blob is left to garbage collection; an older plain upload is deleted once the save commits."""
+    name = save_upload(file_storage)
+    if old_filename and old_filename != name: after_commit(functools.partial(delete_image_file, old_filename, subfolder))
+    return name
+
+def validate_save(filepath, data, before):
+    """Raises ValidationError if `data` has validation errors that the file's current content (`before`) does not.
+
+    Only the data checks run (schema, images, markdown files), which take a few stats; errors already in the
+    file do not block saves, so content with old problems stays editable. Links are checked by the rebuild.
+    """
+    key = os.path.splitext(os.path.basename(filepath))[0]
+    if key.startswith('_') or not filepath.endswith('.json'): return
+    effects = getattr(save_effects, 'current', None)
+    report = build.ValidationReport(); build.validate_data(key, data, report, effects.files if effects else ())
+    if not report.errors: return
+    baseline = build.ValidationReport(); build.validate_data(key, before, baseline)
+    issues = report.new_errors(baseline)
+    if issues: raise ValidationError(filepath, issues)
+
+def content_saved(filepath, before, after):
+    """Runs after every committed save: updates the media reference counts for the saved file, then queues the rebuild."""
+    media_store.update(before, after); media_store.sweep_due()
+    request_rebuild(filepath)
+
+@app.template_global()
+def upload_badge(path):
+    """Status badge for an image still being processed (or that failed to process) after upload; empty otherwise."""
+    status = upload_processor.status(path) if path else None
+    if not status or status['state'] == 'ready': return ''
+    label = 'Processing…' if status['state'] == 'processing' else 'Processing failed'
+    return Markup('<span class="upload-status {}" title="{}">{}</span>').format(status['state'], status.get('error', ''), label)
+
+def warm_markdown(text):
+    """Converts a post into the build's markdown render cache now, so the rebuild and the next deploy skip it."""
+    try: build.render_markdown(text)
+    except Exception: print(f"Could not pre-render markdown:\n{traceback.format_exc()}")
+
+def parse_tags(text):
+    """'Design, branding,design' -> ['Design', 'branding'] (case-insensitive duplicates dropped, first spelling kept)."""
+    tags = []
+    for tag in (t.strip() for t in text.split(',')):
+        if tag and tag.lower() not in (t.lower() for t in tags): tags.append(tag)
+    return tags
+
 # --- App Routes ---
+@app.errorhandler(ConflictError)
+def handle_conflict(error):
+    flash('Someone else changed this content while you were editing it. The latest version is shown below; please re-apply your changes.', 'error')
+    return redirect(request.referrer or url_for('index'))
+@app.errorhandler(UploadError)
+def handle_upload_error(error):
+    flash(f"Upload rejected: {error}", 'error'); return redirect(request.referrer or url_for('index'))
+@app.errorhandler(ValidationError)
+def handle_validation_error(error):
+    flash(f"Not saved: {'; '.join(build.describe_issue(issue) for issue in error.issues)}", 'error'); return redirect(request.referrer or url_for('index'))
+@app.errorhandler(RequestEntityTooLarge)
+def handle_request_too_large(error):
+    flash(f"Upload rejected: the form exceeds the {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB request limit.", 'error')
+    return render_template('request_too_large.html', back_url=request.referrer or url_for('index'), title="Upload Too Large"), 413
+
 @app.route('/content/images/<path:filename>')
 def serve_content_image(filename): return send_from_directory(UPLOAD_FOLDER, filename)
 
 @app.route('/')
 def index(): return redirect(url_for('manage_navigation'))
 
+# --- Live Preview ---
+@functools.lru_cache(maxsize=PREVIEW_IMAGE_CACHE_SIZE)
+def preview_webp(source_path, size, mtime_ns):  # Size and mtime are part of the key, so an edited image is re-encoded.
+    return build.preview_image(source_path)
+
+def preview_site_data():
+    """build.load_site_data() served from json_store's cache (the SQLite backend exports every write there): unchanged files are not re-read, and nothing is logged to a running deploy."""
+    return {name[:-len('.json')]: json_store.load(os.path.join(DATA_PATH, name)).data for name in sorted(os.listdir(DATA_PATH)) if name.endswith('.json') and not name.startswith('_')}
+@app.route('/preview/')
+def preview_home(): return redirect(url_for('preview', page='index.html'))
+@app.route('/preview/<path:page>')
+def preview(page):
+    """Serves the site as the next build would produce it: pages rendered from the current data, source assets, and images converted to WebP on the fly. docs/ is never written."""
+    started = time.perf_counter()
+    if page.startswith('content/images/') and page.endswith('.webp'):
+        source_path = build.preview_image_source(page[len('content/images/'):])
+        if source_path is None: abort(404)
+        stat = os.stat(source_path); body, mimetype = preview_webp(source_path, stat.st_size, stat.st_mtime_ns), 'image/webp'
+    elif page.startswith('assets/'):
+        body = build.preview_asset(page[len('assets/'):]); mimetype = mimetypes.guess_type(page)[0] or 'application/octet-stream'
+    elif page.startswith(build.SEARCH_DIR_NAME + '/'):  # The index of the last build; read-only.
+        return send_from_directory(os.path.join(build.OUTPUT_DIR, build.SEARCH_DIR_NAME), page[len(build.SEARCH_DIR_NAME) + 1:])
+    else:
+        body = build.render_preview(page, preview_site_data(), url_prefix=url_for('preview_home').rstrip('/')); mimetype = 'text/html'
+    if body is None: abort(404)
+    return Response(body, mimetype=mimetype, headers={'Cache-Control': 'no-store', 'Server-Timing': f"preview;dur={(time.perf_counter() - started) * 1000:.1f}"})
+
 # --- Navigation ---
 @app.route('/navigation', methods=['GET'])
 def manage_navigation():
-    return render_template('manage_navigation.html', navigation=get_json_data(NAVIGATION_FILE), active_page='navigation', title="Manage Navigation")
+    navigation, version = list_records(NAVIGATION_FILE)
+    return render_template('manage_navigation.html', navigation=navigation, version=version, active_page='navigation', title="Manage Navigation")
 @app.route('/navigation/add', methods=['POST'])
 def add_nav_item():
-    data = get_json_data(NAVIGATION_FILE); data.append({"label": request.form['label'], "url": request.form['url'], "id": request.form['id']}); save_json_data(NAVIGATION_FILE, data); flash('Item added!', 'success'); return redirect(url_for('manage_navigation'))
+    insert_record(NAVIGATION_FILE, {"label": request.form['label'], "url": request.form['url'], "id": request.form['id']})
+    flash('Item added!', 'success'); return redirect(url_for('manage_navigation'))
 @app.route('/navigation/update_all', methods=['POST'])
 def update_all_nav_items():
     data = []; labels, urls, ids = request.form.getlist('label'), request.form.getlist('url'), request.form.getlist('id')
     for i in range(len(labels)): data.append({"label": labels[i], "url": urls[i], "id": ids[i]})
-    save_json_data(NAVIGATION_FILE, data); flash('Navigation updated!', 'success'); return redirect(url_for('manage_navigation'))
+    save_json_data(NAVIGATION_FILE, data, request.form.get('version')); flash('Navigation updated!', 'success'); return redirect(url_for('manage_navigation'))
 @app.route('/navigation/delete/<int:item_id>', methods=['POST'])
 def delete_nav_item(item_id):
-    data = get_json_data(NAVIGATION_FILE)
-    if 0 <= item_id < len(data): data.pop(item_id); save_json_data(NAVIGATION_FILE, data); flash('Item deleted.', 'success')
+    if delete_record(NAVIGATION_FILE, item_id, request.form.get('version')) is not None: flash('Item deleted.', 'success')
     return redirect(url_for('manage_navigation'))
 @app.route('/navigation/move/<int:item_id>/<direction>', methods=['POST'])
 def move_nav_item(item_id, direction):
-    data = get_json_data(NAVIGATION_FILE)
-    if 0 <= item_id < len(data):
-        if direction == 'up' and item_id > 0: data[item_id], data[item_id - 1] = data[item_id - 1], data[item_id]
-        elif direction == 'down' and item_id < len(data) - 1: data[item_id], data[item_id + 1] = data[item_id + 1], data[item_id]
-        save_json_data(NAVIGATION_FILE, data)
+    if direction in ('up', 'down'): move_record(NAVIGATION_FILE, item_id, -1 if direction == 'up' else 1, request.form.get('version'))
     return redirect(url_for('manage_navigation'))
 
 # --- Theme Settings ---
@@ -101,355 +881,388 @@ def move_nav_item(item_id, direction):
 def edit_theme_settings():
     if request.method == 'POST':
         data = {"google_font_url": request.form['google_font_url'], "body_font_family": request.form['body_font_family'], "heading_font_family": request.form['heading_font_family'], "heading_font_size_px": int(request.form['heading_font_size_px'])}
-        save_json_data(STYLES_FILE, data); flash('Theme settings updated!', 'success'); return redirect(url_for('edit_theme_settings'))
-    return render_template('edit_theme_settings.html', data=get_json_data(STYLES_FILE), active_page='theme_settings', title="Theme Settings")
+        save_json_data(STYLES_FILE, data, request.form.get('version')); flash('Theme settings updated!', 'success'); return redirect(url_for('edit_theme_settings'))
+    data, version = get_json_document(STYLES_FILE)
+    return render_template('edit_theme_settings.html', data=data, version=version, active_page='theme_settings', title="Theme Settings")
 
 # --- All Other Routes ---
 @app.route('/footer', methods=['GET', 'POST'])
 def edit_footer():
     if request.method == 'POST':
-        data = {'email': request.form['email'], 'copyright_text': request.form['copyright_text'], 'social_links': []}
-        names, urls = request.form.getlist('social_name'), request.form.getlist('social_url')
-        for i in range(len(names)):
-            if names[i] and urls[i]: data['social_links'].append({'name': names[i], 'url': urls[i]})
-        save_json_data(FOOTER_FILE, data); flash('Footer updated!', 'success'); return redirect(url_for('edit_footer'))
-    return render_template('edit_footer.html', data=get_json_data(FOOTER_FILE), active_page='footer', title="Edit Footer")
+        with edit_json_data(FOOTER_FILE, request.form.get('version')) as data:  # Fields the form does not show (e.g. contact_heading) are kept.
+            data['email'] = request.form['email']; data['copyright_text'] = request.form['copyright_text']
+            names, urls = request.form.getlist('social_name'), request.form.getlist('social_url')
+            data['social_links'] = [{'name': name, 'url': url} for name, url in zip(names, urls) if name and url]
+        flash('Footer updated!', 'success'); return redirect(url_for('edit_footer'))
+    data, version = get_json_document(FOOTER_FILE)
+    return render_template('edit_footer.html', data=data, version=version, active_page='footer', title="Edit Footer")
 
 @app.route('/testimonials')
-def manage_testimonials(): return render_template('manage_testimonials.html', testimonials=get_json_data(TESTIMONIALS_FILE), active_page='testimonials', title="Manage Testimonials")
+def manage_testimonials():
+    testimonials, version = list_records(TESTIMONIALS_FILE)
+    return render_template('manage_testimonials.html', testimonials=testimonials, version=version, active_page='testimonials', title="Manage Testimonials")
 # ... All Testimonial add/edit/delete routes are here ...
 @app.route('/testimonials/add', methods=['GET', 'POST'])
 def add_testimonial():
     if request.method == 'POST':
-        data = get_json_data(TESTIMONIALS_FILE); filename = ""
+        filename = ""
         if 'image' in request.files and request.files['image'].filename != '':
-            image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(TEAM_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(TEAM_UPLOAD_FOLDER, filename))
-        data.append({"feedback": request.form['feedback'], "stars": int(request.form['stars']), "image": filename, "client_name": request.form['client_name'], "client_company": request.form['client_company']})
-        save_json_data(TESTIMONIALS_FILE, data); flash('Testimonial added!', 'success'); return redirect(url_for('manage_testimonials'))
+            filename = save_upload(request.files['image'])
+        insert_record(TESTIMONIALS_FILE, {"feedback": request.form['feedback'], "stars": int(request.form['stars']), "image": filename, "client_name": request.form['client_name'], "client_company": request.form['client_company']})
+        flash('Testimonial added!', 'success'); return redirect(url_for('manage_testimonials'))
     return render_template('add_edit_testimonial.html', active_page='testimonials', title="Add New Testimonial")
 @app.route('/testimonials/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_testimonial(item_id):
-    data = get_json_data(TESTIMONIALS_FILE)
-    if not 0 <= item_id < len(data): abort(404)
-    item = data[item_id]
     if request.method == 'POST':
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(item.get('image'), 'team'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(TEAM_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(TEAM_UPLOAD_FOLDER, filename)); item['image'] = filename
-        item['feedback'] = request.form['feedback']; item['stars'] = int(request.form['stars']); item['client_name'] = request.form['client_name']; item['client_company'] = request.form['client_company']
-        save_json_data(TESTIMONIALS_FILE, data); flash('Testimonial updated!', 'success'); return redirect(url_for('manage_testimonials'))
-    return render_template('add_edit_testimonial.html', testimonial=item, testimonial_id=item_id, active_page='testimonials', title="Edit Testimonial")
+        with edit_record(TESTIMONIALS_FILE, item_id, request.form.get('version')) as item:
+            if item is None: abort(404)
+            if 'image' in request.files and request.files['image'].filename != '':
+                item['image'] = replace_upload(request.files['image'], item.get('image'), 'team')
+            item['feedback'] = request.form['feedback']; item['stars'] = int(request.form['stars']); item['client_name'] = request.form['client_name']; item['client_company'] = request.form['client_company']
+        flash('Testimonial updated!', 'success'); return redirect(url_for('manage_testimonials'))
+    item, version = get_record(TESTIMONIALS_FILE, item_id)
+    if item is None: abort(404)
+    return render_template('add_edit_testimonial.html', testimonial=item, testimonial_id=item_id, version=version, active_page='testimonials', title="Edit Testimonial")
 @app.route('/testimonials/delete/<int:item_id>', methods=['POST'])
 def delete_testimonial(item_id):
-    data = get_json_data(TESTIMONIALS_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('image'), 'team'); data.pop(item_id); save_json_data(TESTIMONIALS_FILE, data); flash('Testimonial deleted.', 'success')
+    item = delete_record(TESTIMONIALS_FILE, item_id, request.form.get('version'))
+    if item is not None: delete_image_file(item.get('image'), 'team'); flash('Testimonial deleted.', 'success')
     return redirect(url_for('manage_testimonials'))
 
 # ... All other routes from your original app.py are here and complete ...
 @app.route('/clients')
-def manage_clients(): return render_template('manage_clients.html', clients=get_json_data(CLIENTS_FILE), active_page='clients', title="Manage Clients")
+def manage_clients():
+    clients, version = list_records(CLIENTS_FILE)
+    return render_template('manage_clients.html', clients=clients, version=version, active_page='clients', title="Manage Clients")
 @app.route('/clients/add', methods=['GET', 'POST'])
 def add_client():
     if request.method == 'POST':
-        data = get_json_data(CLIENTS_FILE); filename = ""
+        filename = ""
         if 'logo' in request.files and request.files['logo'].filename != '':
-            image_file = request.files['logo']; filename = secure_filename(image_file.filename); os.makedirs(CLIENTS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(CLIENTS_UPLOAD_FOLDER, filename))
-        data.append({"logo": filename, "url": request.form['url']}); save_json_data(CLIENTS_FILE, data); flash('Client logo added.', 'success'); return redirect(url_for('manage_clients'))
+            filename = save_upload(request.files['logo'])
+        insert_record(CLIENTS_FILE, {"logo": filename, "url": request.form['url']}); flash('Client logo added.', 'success'); return redirect(url_for('manage_clients'))
     return render_template('add_edit_client.html', active_page='clients', title="Add New Client Logo")
 @app.route('/clients/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_client(item_id):
-    data = get_json_data(CLIENTS_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_clients'))
-    item = data[item_id]
     if request.method == 'POST':
-        if 'logo' in request.files and request.files['logo'].filename != '':
-            delete_image_file(item.get('logo'), 'clients'); image_file = request.files['logo']; filename = secure_filename(image_file.filename); os.makedirs(CLIENTS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(CLIENTS_UPLOAD_FOLDER, filename)); item['logo'] = filename
-        item['url'] = request.form['url']; save_json_data(CLIENTS_FILE, data); flash('Client logo updated.', 'success'); return redirect(url_for('manage_clients'))
-    return render_template('add_edit_client.html', client=item, client_id=item_id, active_page='clients', title="Edit Client Logo")
+        with edit_record(CLIENTS_FILE, item_id, request.form.get('version')) as item:
+            if item is None: return redirect(url_for('manage_clients'))
+            if 'logo' in request.files and request.files['logo'].filename != '':
+                item['logo'] = replace_upload(request.files['logo'], item.get('logo'), 'clients')
+            item['url'] = request.form['url']
+        flash('Client logo updated.', 'success'); return redirect(url_for('manage_clients'))
+    item, version = get_record(CLIENTS_FILE, item_id)
+    if item is None: return redirect(url_for('manage_clients'))
+    return render_template('add_edit_client.html', client=item, client_id=item_id, version=version, active_page='clients', title="Edit Client Logo")
 @app.route('/clients/delete/<int:item_id>', methods=['POST'])
 def delete_client(item_id):
-    data = get_json_data(CLIENTS_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('logo'), 'clients'); data.pop(item_id); save_json_data(CLIENTS_FILE, data); flash('Client logo deleted.', 'success')
+    item = delete_record(CLIENTS_FILE, item_id, request.form.get('version'))
+    if item is not None: delete_image_file(item.get('logo'), 'clients'); flash('Client logo deleted.', 'success')
     return redirect(url_for('manage_clients'))
 
 @app.route('/team')
-def manage_team(): return render_template('manage_team.html', team=get_json_data(TEAM_FILE), active_page='team', title="Manage Team")
+def manage_team():
+    team, version = list_records(TEAM_FILE)
+    return render_template('manage_team.html', team=team, version=version, active_page='team', title="Manage Team")
 @app.route('/team/add', methods=['POST'])
 def add_team_member():
-    data = get_json_data(TEAM_FILE); filename = ""
+    filename = ""
     if 'image' in request.files and request.files['image'].filename != '':
-        image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(TEAM_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(TEAM_UPLOAD_FOLDER, filename))
-    data.append({"name": request.form['name'], "title": request.form['title'], "bio": request.form.get('bio', ''), "image": filename, "is_ceo": 'is_ceo' in request.form})
-    save_json_data(TEAM_FILE, data); flash('Team member added!', 'success'); return redirect(url_for('manage_team'))
+        filename = save_upload(request.files['image'])
+    insert_record(TEAM_FILE, {"name": request.form['name'], "title": request.form['title'], "bio": request.form.get('bio', ''), "image": filename, "is_ceo": 'is_ceo' in request.form})
+    flash('Team member added!', 'success'); return redirect(url_for('manage_team'))
 @app.route('/team/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_team_member(item_id):
-    data = get_json_data(TEAM_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_team'))
-    member = data[item_id]
     if request.method == 'POST':
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(member.get('image'), 'team'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(TEAM_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(TEAM_UPLOAD_FOLDER, filename)); member['image'] = filename
-        member['name'] = request.form['name']; member['title'] = request.form['title']; member['bio'] = request.form.get('bio', ''); member['is_ceo'] = 'is_ceo' in request.form
-        save_json_data(TEAM_FILE, data); flash('Team member updated!', 'success'); return redirect(url_for('manage_team'))
-    return render_template('edit_team_member.html', member=member, item_id=item_id, active_page='team', title="Edit Team Member")
+        with edit_record(TEAM_FILE, item_id, request.form.get('version')) as member:
+            if member is None: return redirect(url_for('manage_team'))
+            if 'image' in request.files and request.files['image'].filename != '':
+                member['image'] = replace_upload(request.files['image'], member.get('image'), 'team')
+            member['name'] = request.form['name']; member['title'] = request.form['title']; member['bio'] = request.form.get('bio', ''); member['is_ceo'] = 'is_ceo' in request.form
+        flash('Team member updated!', 'success'); return redirect(url_for('manage_team'))
+    member, version = get_record(TEAM_FILE, item_id)
+    if member is None: return redirect(url_for('manage_team'))
+    return render_template('edit_team_member.html', member=member, item_id=item_id, version=version, active_page='team', title="Edit Team Member")
 @app.route('/team/delete/<int:item_id>', methods=['POST'])
 def delete_team_member(item_id):
-    data = get_json_data(TEAM_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('image'), 'team'); data.pop(item_id); save_json_data(TEAM_FILE, data); flash('Team member deleted.', 'success')
+    member = delete_record(TEAM_FILE, item_id, request.form.get('version'))
+    if member is not None: delete_image_file(member.get('image'), 'team'); flash('Team member deleted.', 'success')
     return redirect(url_for('manage_team'))
 
 @app.route('/banners')
-def manage_banners(): return render_template('manage_banners.html', banners=get_json_data(BANNERS_FILE), active_page='banners', title="Manage Banners")
+def manage_banners():
+    banners, version = list_records(BANNERS_FILE)
+    return render_template('manage_banners.html', banners=banners, version=version, active_page='banners', title="Manage Banners")
 @app.route('/banners/add', methods=['GET', 'POST'])
 def add_banner():
     if request.method == 'POST':
-        data = get_json_data(BANNERS_FILE); filename = ""
+        filename = ""
         if 'image' in request.files and request.files['image'].filename != '':
-            image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(BANNERS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(BANNERS_UPLOAD_FOLDER, filename))
-        data.append({"image": filename}); save_json_data(BANNERS_FILE, data); flash('Banner added!', 'success'); return redirect(url_for('manage_banners'))
+            filename = save_upload(request.files['image'])
+        insert_record(BANNERS_FILE, {"image": filename}); flash('Banner added!', 'success'); return redirect(url_for('manage_banners'))
     return render_template('add_edit_banner.html', active_page='banners', title="Add New Banner")
 @app.route('/banners/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_banner(item_id):
-    data = get_json_data(BANNERS_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_banners'))
-    banner = data[item_id]
     if request.method == 'POST':
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(banner.get('image'), 'banners'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(BANNERS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(BANNERS_UPLOAD_FOLDER, filename)); banner['image'] = filename
-        save_json_data(BANNERS_FILE, data); flash('Banner updated!', 'success'); return redirect(url_for('manage_banners'))
-    return render_template('add_edit_banner.html', banner=banner, banner_id=item_id, active_page='banners', title="Edit Banner")
+        with edit_record(BANNERS_FILE, item_id, request.form.get('version')) as banner:
+            if banner is None: return redirect(url_for('manage_banners'))
+            if 'image' in request.files and request.files['image'].filename != '':
+                banner['image'] = replace_upload(request.files['image'], banner.get('image'), 'banners')
+        flash('Banner updated!', 'success'); return redirect(url_for('manage_banners'))
+    banner, version = get_record(BANNERS_FILE, item_id)
+    if banner is None: return redirect(url_for('manage_banners'))
+    return render_template('add_edit_banner.html', banner=banner, banner_id=item_id, version=version, active_page='banners', title="Edit Banner")
 @app.route('/banners/delete/<int:item_id>', methods=['POST'])
 def delete_banner(item_id):
-    data = get_json_data(BANNERS_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('image'), 'banners'); data.pop(item_id); save_json_data(BANNERS_FILE, data); flash('Banner deleted.', 'success')
+    banner = delete_record(BANNERS_FILE, item_id, request.form.get('version'))
+    if banner is not None: delete_image_file(banner.get('image'), 'banners'); flash('Banner deleted.', 'success')
     return redirect(url_for('manage_banners'))
 
 @app.route('/offers')
-def manage_offers(): return render_template('manage_offers.html', offers=get_json_data(OFFERS_FILE), active_page='offers', title="Manage Offers")
+def manage_offers():
+    offers, version = list_records(OFFERS_FILE)
+    return render_template('manage_offers.html', offers=offers, version=version, active_page='offers', title="Manage Offers")
 @app.route('/offers/add', methods=['GET', 'POST'])
 def add_offer():
     if request.method == 'POST':
-        data = get_json_data(OFFERS_FILE); filename = ""
+        filename = ""
         if 'image' in request.files and request.files['image'].filename != '':
-            image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(OFFERS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(OFFERS_UPLOAD_FOLDER, filename))
-        data.append({"title": request.form['title'], "image": filename, "url": request.form['url']}); save_json_data(OFFERS_FILE, data); flash('Offer added!', 'success'); return redirect(url_for('manage_offers'))
+            filename = save_upload(request.files['image'])
+        insert_record(OFFERS_FILE, {"title": request.form['title'], "image": filename, "url": request.form['url']}); flash('Offer added!', 'success'); return redirect(url_for('manage_offers'))
     return render_template('add_edit_offer.html', active_page='offers', title="Add New Offer")
 @app.route('/offers/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_offer(item_id):
-    data = get_json_data(OFFERS_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_offers'))
-    offer = data[item_id]
     if request.method == 'POST':
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(offer.get('image'), 'offers'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(OFFERS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(OFFERS_UPLOAD_FOLDER, filename)); offer['image'] = filename
-        offer['title'] = request.form['title']; offer['url'] = request.form['url']
-        save_json_data(OFFERS_FILE, data); flash('Offer updated!', 'success'); return redirect(url_for('manage_offers'))
-    return render_template('add_edit_offer.html', offer=offer, offer_id=item_id, active_page='offers', title="Edit Offer")
+        with edit_record(OFFERS_FILE, item_id, request.form.get('version')) as offer:
+            if offer is None: return redirect(url_for('manage_offers'))
+            if 'image' in request.files and request.files['image'].filename != '':
+                offer['image'] = replace_upload(request.files['image'], offer.get('image'), 'offers')
+            offer['title'] = request.form['title']; offer['url'] = request.form['url']
+        flash('Offer updated!', 'success'); return redirect(url_for('manage_offers'))
+    offer, version = get_record(OFFERS_FILE, item_id)
+    if offer is None: return redirect(url_for('manage_offers'))
+    return render_template('add_edit_offer.html', offer=offer, offer_id=item_id, version=version, active_page='offers', title="Edit Offer")
 @app.route('/offers/delete/<int:item_id>', methods=['POST'])
 def delete_offer(item_id):
-    data = get_json_data(OFFERS_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('image'), 'offers'); data.pop(item_id); save_json_data(OFFERS_FILE, data); flash('Offer deleted.', 'success')
+    offer = delete_record(OFFERS_FILE, item_id, request.form.get('version'))
+    if offer is not None: delete_image_file(offer.get('image'), 'offers'); flash('Offer deleted.', 'success')
     return redirect(url_for('manage_offers'))
 
 @app.route('/projects')
-def manage_projects(): return render_template('manage_projects.html', projects=get_json_data(PROJECTS_FILE), active_page='projects', title="Manage Projects")
+def manage_projects():
+    projects, version = list_records(PROJECTS_FILE)
+    return render_template('manage_projects.html', projects=projects, version=version, active_page='projects', title="Manage Projects")
 @app.route('/projects/add', methods=['GET', 'POST'])
 def add_project():
     if request.method == 'POST':
-        data = get_json_data(PROJECTS_FILE); filename = ""
+        filename = ""
         if 'image' in request.files and request.files['image'].filename != '':
-            image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(PROJECTS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(PROJECTS_UPLOAD_FOLDER, filename))
-        data.append({"title": request.form['title'], "image": filename, "url": request.form['url']}); save_json_data(PROJECTS_FILE, data); flash('Project added!', 'success'); return redirect(url_for('manage_projects'))
+            filename = save_upload(request.files['image'])
+        insert_record(PROJECTS_FILE, {"title": request.form['title'], "image": filename, "url": request.form['url']}); flash('Project added!', 'success'); return redirect(url_for('manage_projects'))
     return render_template('add_edit_project.html', active_page='projects', title="Add New Project")
 @app.route('/projects/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_project(item_id):
-    data = get_json_data(PROJECTS_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_projects'))
-    project = data[item_id]
     if request.method == 'POST':
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(project.get('image'), 'projects'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(PROJECTS_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(PROJECTS_UPLOAD_FOLDER, filename)); project['image'] = filename
-        project['title'] = request.form['title']; project['url'] = request.form['url']
-        save_json_data(PROJECTS_FILE, data); flash('Project updated!', 'success'); return redirect(url_for('manage_projects'))
-    return render_template('add_edit_project.html', project=project, project_id=item_id, active_page='projects', title="Edit Project")
+        with edit_record(PROJECTS_FILE, item_id, request.form.get('version')) as project:
+            if project is None: return redirect(url_for('manage_projects'))
+            if 'image' in request.files and request.files['image'].filename != '':
+                project['image'] = replace_upload(request.files['image'], project.get('image'), 'projects')
+            project['title'] = request.form['title']; project['url'] = request.form['url']
+        flash('Project updated!', 'success'); return redirect(url_for('manage_projects'))
+    project, version = get_record(PROJECTS_FILE, item_id)
+    if project is None: return redirect(url_for('manage_projects'))
+    return render_template('add_edit_project.html', project=project, project_id=item_id, version=version, active_page='projects', title="Edit Project")
 @app.route('/projects/delete/<int:item_id>', methods=['POST'])
 def delete_project(item_id):
-    data = get_json_data(PROJECTS_FILE)
-    if 0 <= item_id < len(data): delete_image_file(data[item_id].get('image'), 'projects'); data.pop(item_id); save_json_data(PROJECTS_FILE, data); flash('Project deleted.', 'success')
+    project = delete_record(PROJECTS_FILE, item_id, request.form.get('version'))
+    if project is not None: delete_image_file(project.get('image'), 'projects'); flash('Project deleted.', 'success')
     return redirect(url_for('manage_projects'))
 
 @app.route('/videos')
-def manage_videos(): return render_template('manage_videos.html', videos=get_json_data(VIDEOS_FILE), active_page='videos', title="Manage Videos")
+def manage_videos():
+    videos, version = list_records(VIDEOS_FILE)
+    return render_template('manage_videos.html', videos=videos, version=version, active_page='videos', title="Manage Videos")
 @app.route('/videos/add', methods=['GET', 'POST'])
 def add_video():
     if request.method == 'POST':
-        data = get_json_data(VIDEOS_FILE); data.append({"title": request.form['title'], "youtube_id": request.form['youtube_id']}); save_json_data(VIDEOS_FILE, data); flash('Video added!', 'success'); return redirect(url_for('manage_videos'))
+        insert_record(VIDEOS_FILE, {"title": request.form['title'], "youtube_id": request.form['youtube_id']}); flash('Video added!', 'success'); return redirect(url_for('manage_videos'))
     return render_template('add_edit_video.html', active_page='videos', title="Add New Video")
 @app.route('/videos/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_video(item_id):
-    data = get_json_data(VIDEOS_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_videos'))
-    video = data[item_id]
-    if request.method == 'POST': video['title'] = request.form['title']; video['youtube_id'] = request.form['youtube_id']; save_json_data(VIDEOS_FILE, data); flash('Video updated!', 'success'); return redirect(url_for('manage_videos'))
-    return render_template('add_edit_video.html', video=video, video_id=item_id, active_page='videos', title="Edit Video")
+    if request.method == 'POST':
+        with edit_record(VIDEOS_FILE, item_id, request.form.get('version')) as video:
+            if video is None: return redirect(url_for('manage_videos'))
+            video['title'] = request.form['title']; video['youtube_id'] = request.form['youtube_id']
+        flash('Video updated!', 'success'); return redirect(url_for('manage_videos'))
+    video, version = get_record(VIDEOS_FILE, item_id)
+    if video is None: return redirect(url_for('manage_videos'))
+    return render_template('add_edit_video.html', video=video, video_id=item_id, version=version, active_page='videos', title="Edit Video")
 @app.route('/videos/delete/<int:item_id>', methods=['POST'])
 def delete_video(item_id):
-    data = get_json_data(VIDEOS_FILE)
-    if 0 <= item_id < len(data): data.pop(item_id); save_json_data(VIDEOS_FILE, data); flash('Video deleted.', 'success')
+    if delete_record(VIDEOS_FILE, item_id, request.form.get('version')) is not None: flash('Video deleted.', 'success')
     return redirect(url_for('manage_videos'))
 
 @app.route('/about_page', methods=['GET', 'POST'])
 def edit_about_page():
-    data = get_json_data(ABOUT_FILE)
     if request.method == 'POST':
-        if 'banner_image' in request.files and request.files['banner_image'].filename != '':
-            delete_image_file(data.get('banner_image')); image_file = request.files['banner_image']; data['banner_image'] = secure_filename(image_file.filename); image_file.save(os.path.join(UPLOAD_FOLDER, data['banner_image']))
-        if 'about_us_image' in request.files and request.files['about_us_image'].filename != '':
-            delete_image_file(data.get('about_us_image')); image_file = request.files['about_us_image']; data['about_us_image'] = secure_filename(image_file.filename); image_file.save(os.path.join(UPLOAD_FOLDER, data['about_us_image']))
-        data['about_us_heading'] = request.form['about_us_heading']; data['about_us_text'] = request.form['about_us_text']; data['who_we_are_heading'] = request.form['who_we_are_heading']; data['who_we_are_text'] = request.form['who_we_are_text']
-        save_json_data(ABOUT_FILE, data); flash('About page updated!', 'success'); return redirect(url_for('edit_about_page'))
-    return render_template('edit_about_page.html', data=data, active_page='about_page', title="Edit About Page")
+        with edit_json_data(ABOUT_FILE, request.form.get('version')) as data:
+            if 'banner_image' in request.files and request.files['banner_image'].filename != '':
+                data['banner_image'] = replace_upload(request.files['banner_image'], data.get('banner_image'))
+            if 'about_us_image' in request.files and request.files['about_us_image'].filename != '':
+                data['about_us_image'] = replace_upload(request.files['about_us_image'], data.get('about_us_image'))
+            data['about_us_heading'] = request.form['about_us_heading']; data['about_us_text'] = request.form['about_us_text']; data['who_we_are_heading'] = request.form['who_we_are_heading']; data['who_we_are_text'] = request.form['who_we_are_text']
+        flash('About page updated!', 'success'); return redirect(url_for('edit_about_page'))
+    data, version = get_json_document(ABOUT_FILE)
+    return render_template('edit_about_page.html', data=data, version=version, active_page='about_page', title="Edit About Page")
 
 @app.route('/services_page', methods=['GET', 'POST'])
 def edit_services_page():
-    data = get_json_data(SERVICES_FILE)
     if request.method == 'POST':
-        data['heading'] = request.form['heading']; data['services_list'] = [s.strip() for s in request.form['services_list'].split('\n') if s.strip()]
-        save_json_data(SERVICES_FILE, data); flash('Services page updated!', 'success'); return redirect(url_for('edit_services_page'))
-    services_list_str = "\n".join(data.get('services_list', [])); return render_template('edit_services_page.html', data=data, services_list_str=services_list_str, active_page='services_page', title="Edit Services Page")
+        with edit_json_data(SERVICES_FILE, request.form.get('version')) as data:
+            data['heading'] = request.form['heading']; data['services_list'] = [s.strip() for s in request.form['services_list'].split('\n') if s.strip()]
+        flash('Services page updated!', 'success'); return redirect(url_for('edit_services_page'))
+    data, version = get_json_document(SERVICES_FILE)
+    services_list_str = "\n".join(data.get('services_list', [])); return render_template('edit_services_page.html', data=data, version=version, services_list_str=services_list_str, active_page='services_page', title="Edit Services Page")
 
 @app.route('/contact_page', methods=['GET', 'POST'])
 def edit_contact_page():
-    data = get_json_data(CONTACT_FILE)
     if request.method == 'POST':
-        data['page_heading'] = request.form['page_heading']; data['page_subheading'] = request.form['page_subheading']
-        data['email']['label'] = request.form['email_label']; data['email']['address'] = request.form['email_address']
-        data['phone']['label'] = request.form['phone_label']; data['phone']['number'] = request.form['phone_number']
-        data['address']['label'] = request.form['address_label']; data['address']['line1'] = request.form['address_line1']; data['address']['line2'] = request.form['address_line2']
-        data['business_hours']['label'] = request.form['business_hours_label']; data['business_hours']['days'] = request.form['business_hours_days']; data['business_hours']['hours'] = request.form['business_hours_hours']
-        save_json_data(CONTACT_FILE, data); flash('Contact page updated!', 'success'); return redirect(url_for('edit_contact_page'))
-    return render_template('edit_contact_page.html', data=data, active_page='contact_page', title="Edit Contact Page")
+        with edit_json_data(CONTACT_FILE, request.form.get('version')) as data:
+            data['page_heading'] = request.form['page_heading']; data['page_subheading'] = request.form['page_subheading']
+            data['email']['label'] = request.form['email_label']; data['email']['address'] = request.form['email_address']
+            data['phone']['label'] = request.form['phone_label']; data['phone']['number'] = request.form['phone_number']
+            data['address']['label'] = request.form['address_label']; data['address']['line1'] = request.form['address_line1']; data['address']['line2'] = request.form['address_line2']
+            data['business_hours']['label'] = request.form['business_hours_label']; data['business_hours']['days'] = request.form['business_hours_days']; data['business_hours']['hours'] = request.form['business_hours_hours']
+        flash('Contact page updated!', 'success'); return redirect(url_for('edit_contact_page'))
+    data, version = get_json_document(CONTACT_FILE)
+    return render_template('edit_contact_page.html', data=data, version=version, active_page='contact_page', title="Edit Contact Page")
 
 @app.route('/blog_posts')
-def manage_blog_posts(): return render_template('manage_blog_posts.html', blog_posts=get_json_data(BLOG_FILE), active_page='blog_posts', title="Manage Blog Posts")
+def manage_blog_posts():
+    blog_posts, version = list_records(BLOG_FILE)
+    return render_template('manage_blog_posts.html', blog_posts=blog_posts, version=version, active_page='blog_posts', title="Manage Blog Posts")
+def write_post_markdown(md_path, content, old_md_path=None):
+    """Writes a blog post's markdown, removes the file of its previous slug and queues the rebuild; registered with after_commit()."""
+    write_file_atomic(md_path, content); warm_markdown(content)
+    if old_md_path and old_md_path != md_path and os.path.exists(old_md_path): os.remove(old_md_path)
+    request_rebuild(md_path)
 @app.route('/blog_posts/add', methods=['GET', 'POST'])
 def add_blog_post():
     if request.method == 'POST':
-        data = get_json_data(BLOG_FILE); title = request.form['title']; slug = secure_filename(title.lower().replace(' ', '-')); original_slug = slug; counter = 1
-        while any(p['slug'] == slug for p in data): slug = f"{original_slug}-{counter}"; counter += 1
-        image_filename = ""; image_file = request.files.get('image')
+        title = request.form['title']; image_filename = ""; image_file = request.files.get('image')
         if image_file and image_file.filename != '':
-            image_filename = secure_filename(image_file.filename); os.makedirs(BLOG_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(BLOG_UPLOAD_FOLDER, image_filename))
-        data.append({"title": title, "date": request.form.get('date', datetime.now().strftime("%B %d, %Y")), "author": request.form['author'], "image": image_filename, "excerpt": request.form['excerpt'], "slug": slug})
-        save_json_data(BLOG_FILE, data)
-        with open(os.path.join(BLOG_CONTENT_DIR, f"{slug}.md"), 'w', encoding='utf-8') as f: f.write(request.form['content'])
+            image_filename = save_upload(image_file)
+        post = {"title": title, "date": request.form.get('date', datetime.now().strftime("%B %d, %Y")), "author": request.form['author'], "image": image_filename, "excerpt": request.form['excerpt'], "tags": parse_tags(request.form.get('tags', '')), "slug": secure_filename(title.lower().replace(' ', '-'))}
+        with new_record(BLOG_FILE, post, unique='slug'):
+            md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"); after_commit(functools.partial(write_post_markdown, md_path, request.form['content']), writes=md_path)
         flash('Blog post added!', 'success'); return redirect(url_for('manage_blog_posts'))
     return render_template('add_edit_blog_post.html', active_page='blog_posts', title="Add New Blog Post", current_date=datetime.now().strftime("%B %d, %Y"))
 @app.route('/blog_posts/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_blog_post(item_id):
-    data = get_json_data(BLOG_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_blog_posts'))
-    post = data[item_id]; md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"); current_md = ""
-    if os.path.exists(md_path):
-        with open(md_path, 'r', encoding='utf-8') as f: current_md = f.read()
     if request.method == 'POST':
-        new_title = request.form['title']; new_slug = secure_filename(new_title.lower().replace(' ', '-'))
-        if new_slug != post['slug']:
-            old_md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"); original_slug = new_slug; counter = 1
-            while any(p['slug'] == new_slug for p in data if p != post): new_slug = f"{original_slug}-{counter}"; counter += 1
-            if os.path.exists(old_md_path): os.rename(old_md_path, os.path.join(BLOG_CONTENT_DIR, f"{new_slug}.md"))
-            post['slug'] = new_slug
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(post.get('image'), 'blog'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(BLOG_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(BLOG_UPLOAD_FOLDER, filename)); post['image'] = filename
-        post['title'] = new_title; post['author'] = request.form['author']; post['date'] = request.form['date']; post['excerpt'] = request.form['excerpt']
-        save_json_data(BLOG_FILE, data)
-        with open(os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"), 'w', encoding='utf-8') as f: f.write(request.form['content'])
+        with edit_record(BLOG_FILE, item_id, request.form.get('version')) as post:
+            if post is None: return redirect(url_for('manage_blog_posts'))
+            new_title = request.form['title']; new_slug = secure_filename(new_title.lower().replace(' ', '-')); old_md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md")
+            if new_slug != post['slug']: post['slug'] = unique_value(BLOG_FILE, 'slug', new_slug, exclude_id=item_id)
+            if 'image' in request.files and request.files['image'].filename != '':
+                post['image'] = replace_upload(request.files['image'], post.get('image'), 'blog')
+            post['title'] = new_title; post['author'] = request.form['author']; post['date'] = request.form['date']; post['excerpt'] = request.form['excerpt']; post['tags'] = parse_tags(request.form.get('tags', ''))
+            md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"); after_commit(functools.partial(write_post_markdown, md_path, request.form['content'], old_md_path), writes=md_path)
         flash('Blog post updated!', 'success'); return redirect(url_for('manage_blog_posts'))
-    return render_template('add_edit_blog_post.html', post=post, post_id=item_id, current_markdown_content=current_md, active_page='blog_posts', title="Edit Blog Post")
+    post, version = get_record(BLOG_FILE, item_id)
+    if post is None: return redirect(url_for('manage_blog_posts'))
+    md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md"); current_md = ""
+    if os.path.exists(md_path):
+        with open(md_path, 'r', encoding='utf-8') as f: current_md = f.read()
+    return render_template('add_edit_blog_post.html', post=post, post_id=item_id, version=version, current_markdown_content=current_md, active_page='blog_posts', title="Edit Blog Post")
 @app.route('/blog_posts/delete/<int:item_id>', methods=['POST'])
 def delete_blog_post(item_id):
-    data = get_json_data(BLOG_FILE)
-    if 0 <= item_id < len(data):
-        post = data[item_id]; delete_image_file(post.get('image'), 'blog')
+    post = delete_record(BLOG_FILE, item_id, request.form.get('version'))
+    if post is not None:
+        delete_image_file(post.get('image'), 'blog')
         md_path = os.path.join(BLOG_CONTENT_DIR, f"{post['slug']}.md")
         if os.path.exists(md_path): os.remove(md_path)
-        data.pop(item_id); save_json_data(BLOG_FILE, data); flash('Blog post deleted.', 'success')
+        flash('Blog post deleted.', 'success')
     return redirect(url_for('manage_blog_posts'))
 
 @app.route('/portfolio_categories')
-def manage_portfolio_categories(): return render_template('manage_portfolio_categories.html', categories=get_json_data(PORTFOLIO_FILE), active_page='portfolio_categories', title="Manage Portfolio")
+def manage_portfolio_categories():
+    categories, version = list_records(PORTFOLIO_FILE)
+    return render_template('manage_portfolio_categories.html', categories=categories, version=version, active_page='portfolio_categories', title="Manage Portfolio")
 @app.route('/portfolio_categories/add', methods=['GET', 'POST'])
 def add_portfolio_category():
     if request.method == 'POST':
-        data = get_json_data(PORTFOLIO_FILE); folder = secure_filename(request.form['folder_name'].lower().replace(' ', '-')); original_folder = folder; counter = 1
-        while any(c['folder'] == folder for c in data): folder = f"{original_folder}-{counter}"; counter += 1
         filename = ""
         if 'image' in request.files and request.files['image'].filename != '':
-            image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(PORTFOLIO_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(PORTFOLIO_UPLOAD_FOLDER, filename))
-        data.append({"label": request.form['label'], "folder": folder, "image": filename}); save_json_data(PORTFOLIO_FILE, data)
-        os.makedirs(os.path.join(PORTFOLIO_UPLOAD_FOLDER, folder), exist_ok=True)
+            filename = save_upload(request.files['image'])
+        category = {"label": request.form['label'], "folder": secure_filename(request.form['folder_name'].lower().replace(' ', '-')), "image": filename}
+        with new_record(PORTFOLIO_FILE, category, unique='folder'): after_commit(functools.partial(os.makedirs, os.path.join(PORTFOLIO_UPLOAD_FOLDER, category['folder']), exist_ok=True))
         flash('Portfolio category added!', 'success'); return redirect(url_for('manage_portfolio_categories'))
     return render_template('add_edit_portfolio_category.html', active_page='portfolio_categories', title="Add New Portfolio Category")
+def move_portfolio_folder(old_folder, new_folder):
+    old_path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, old_folder); new_path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, new_folder)
+    if os.path.exists(old_path): os.rename(old_path, new_path)
+    else: os.makedirs(new_path, exist_ok=True)
 @app.route('/portfolio_categories/edit/<int:item_id>', methods=['GET', 'POST'])
 def edit_portfolio_category(item_id):
-    data = get_json_data(PORTFOLIO_FILE)
-    if not 0 <= item_id < len(data): return redirect(url_for('manage_portfolio_categories'))
-    category = data[item_id]
     if request.method == 'POST':
-        old_folder = category['folder']; new_folder = secure_filename(request.form['folder_name'].lower().replace(' ', '-'))
-        if new_folder != old_folder:
-            original_folder = new_folder; counter = 1
-            while any(c['folder'] == new_folder for c in data if c != category): new_folder = f"{original_folder}-{counter}"; counter += 1
-            old_path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, old_folder); new_path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, new_folder)
-            if os.path.exists(old_path): os.rename(old_path, new_path)
-            else: os.makedirs(new_path, exist_ok=True)
-            category['folder'] = new_folder
-        if 'image' in request.files and request.files['image'].filename != '':
-            delete_image_file(category.get('image'), 'portfolio'); image_file = request.files['image']; filename = secure_filename(image_file.filename); os.makedirs(PORTFOLIO_UPLOAD_FOLDER, exist_ok=True); image_file.save(os.path.join(PORTFOLIO_UPLOAD_FOLDER, filename)); category['image'] = filename
-        category['label'] = request.form['label']; save_json_data(PORTFOLIO_FILE, data); flash('Category updated!', 'success'); return redirect(url_for('manage_portfolio_categories'))
-    return render_template('add_edit_portfolio_category.html', category=category, category_id=item_id, active_page='portfolio_categories', title="Edit Portfolio Category")
+        with edit_record(PORTFOLIO_FILE, item_id, request.form.get('version')) as category:
+            if category is None: return redirect(url_for('manage_portfolio_categories'))
+            old_folder = category['folder']; new_folder = secure_filename(request.form['folder_name'].lower().replace(' ', '-'))
+            if new_folder != old_folder:
+                new_folder = unique_value(PORTFOLIO_FILE, 'folder', new_folder, exclude_id=item_id)
+                after_commit(functools.partial(move_portfolio_folder, old_folder, new_folder)); category['folder'] = new_folder
+            if 'image' in request.files and request.files['image'].filename != '':
+                category['image'] = replace_upload(request.files['image'], category.get('image'), 'portfolio')
+            category['label'] = request.form['label']
+        flash('Category updated!', 'success'); return redirect(url_for('manage_portfolio_categories'))
+    category, version = get_record(PORTFOLIO_FILE, item_id)
+    if category is None: return redirect(url_for('manage_portfolio_categories'))
+    images = build.gallery_order(portfolio_images(category['folder']), category.get('order'))
+    return render_template('add_edit_portfolio_category.html', category=category, category_id=item_id, version=version, images=images, active_page='portfolio_categories', title="Edit Portfolio Category")
+@app.route('/portfolio_categories/<int:item_id>/images/order', methods=['POST'])
+def reorder_portfolio_images(item_id):
+    with edit_record(PORTFOLIO_FILE, item_id, request.form.get('version')) as category:
+        if category is None: return redirect(url_for('manage_portfolio_categories'))
+        category['order'] = build.gallery_order(portfolio_images(category['folder']), request.form.getlist('order'))
+    flash('Image order saved!', 'success'); return redirect(url_for('edit_portfolio_category', item_id=item_id))
 @app.route('/portfolio_categories/delete/<int:item_id>', methods=['POST'])
 def delete_portfolio_category(item_id):
-    data = get_json_data(PORTFOLIO_FILE)
-    if 0 <= item_id < len(data):
-        category = data[item_id]; delete_image_file(category.get('image'), 'portfolio')
+    category = delete_record(PORTFOLIO_FILE, item_id, request.form.get('version'))
+    if category is not None:
+        delete_image_file(category.get('image'), 'portfolio')
         folder_path = os.path.join(PORTFOLIO_UPLOAD_FOLDER, category['folder'])
         if os.path.exists(folder_path):
             try: shutil.rmtree(folder_path)
             except OSError as e: flash(f"Error deleting folder: {e}", 'error')
-        data.pop(item_id); save_json_data(PORTFOLIO_FILE, data); flash('Category deleted.', 'success')
+        flash('Category deleted.', 'success')
     return redirect(url_for('manage_portfolio_categories'))
 
 # --- Deploy ---
 @app.route('/deploy', methods=['GET', 'POST'])
 def deploy():
-    output = ""
     if request.method == 'POST':
-        commit_message = request.form.get('commit_message', 'Updated website content via CMS')
-        try:
-            output += ">>> Running build.py...\n"
-            build_process = subprocess.run(['python', os.path.join(WEBSITE_ROOT_PATH, 'build.py')], cwd=WEBSITE_ROOT_PATH, capture_output=True, text=True, check=True, encoding='utf-8')
-            output += build_process.stdout + "\n" + build_process.stderr + "\n"
-            output += ">>> Running git add . ...\n"
-            add_process = subprocess.run(['git', 'add', '.'], cwd=WEBSITE_ROOT_PATH, capture_output=True, text=True, check=True, encoding='utf-8')
-            output += add_process.stdout + "\n"
-            output += f">>> Running git commit -m \"{commit_message}\"...\n"
-            commit_process = subprocess.run(['git', 'commit', '-m', commit_message], cwd=WEBSITE_ROOT_PATH, capture_output=True, text=True, encoding='utf-8')
-            output += commit_process.stdout + "\n"
-            if "nothing to commit" in commit_process.stdout.lower() or commit_process.returncode != 0:
-                output += "No changes to commit or commit failed. Skipping push.\n"; flash('Deployment finished. Check log.', 'warning')
-                return render_template('deploy.html', output=output, active_page='deploy')
-            output += ">>> Running git push...\n"
-            push_process = subprocess.run(['git', 'push'], cwd=WEBSITE_ROOT_PATH, capture_output=True, text=True, check=True, encoding='utf-8')
-            output += push_process.stdout + "\n" + push_process.stderr + "\n"
-            output += "\n✅ DEPLOYMENT SUCCESSFUL! ✅\n"; flash('Website deployed successfully!', 'success')
-        except subprocess.CalledProcessError as e:
-            output += f"\n\n❌ DEPLOYMENT FAILED! ❌\nCommand '{' '.join(e.cmd)}' failed.\n--- STDOUT ---\n{e.stdout}\n--- STDERR ---\n{e.stderr}"; flash('Deployment failed.', 'error')
-        except Exception as e:
-            output += f"\n\n❌ UNEXPECTED ERROR! ❌\n{e}"; flash('An unexpected error occurred.', 'error')
-    return render_template('deploy.html', output=output, active_page='deploy', title="Deploy Website")
+        outcome = deploy_worker.request(request.form.get('commit_message', 'Updated website content via CMS'))
+        flash({'started': 'Deployment started.', 'queued': 'A deployment is running; yours will start as soon as it finishes.', 'merged': 'A deployment is already queued; your changes will be included in it.'}[outcome], 'success')
+        return redirect(url_for('deploy'))
+    return render_template('deploy.html', status=deploy_worker.status(), active_page='deploy', title="Deploy Website")
+@app.route('/deploy/status')
+def deploy_status(): return jsonify(deploy_worker.status(since=request.args.get('since', 0, type=int), run_id=request.args.get('run_id', type=int)))
 
 # --- Run App ---
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="IdentityWind CMS.")
+    parser.add_argument('--import-data', action='store_true', help="With CMS_STORAGE=sqlite: replace the database contents with src/data/*.json (e.g. after a git pull) and exit.")
+    parser.add_argument('--export-data', action='store_true', help="With CMS_STORAGE=sqlite: rewrite src/data/*.json from the database and exit.")
+    parser.add_argument('--gc-media', action='store_true', help="Recount media references, delete every unreferenced blob in the media store and exit.")
+    args = parser.parse_args()
+    if args.import_data or args.export_data:
+        if not isinstance(content_store, SqliteStore): parser.error("--import-data/--export-data need CMS_STORAGE=sqlite")
+        if args.import_data: content_store.import_json()
+        if args.export_data: content_store.export_json()
+        sys.exit(0)
+    if args.gc_media:
+        removed = media_store.refresh(grace=0); print(f"Removed {len(removed)} unreferenced media files."); sys.exit(0)
     print("===================================================")
     print("Starting IdentityWind CMS: http://127.0.0.1:5000")
     print("===================================================")
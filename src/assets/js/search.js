@@ -0,0 +1,119 @@
+document.addEventListener('DOMContentLoaded', () => {
+    const results = document.querySelector('.search-results');
+    // If this page has no search results list, don't run the script
+    if (!results) {
+        return;
+    }
+
+    const input = document.querySelector('.search-form input[name="q"]');
+    const status = document.querySelector('.search-status');
+    const indexUrl = results.dataset.searchIndex;
+    const baseUrl = indexUrl.slice(0, indexUrl.lastIndexOf('/') + 1);
+    const stopwords = new Set('a an and are as at be but by for from has have in is it its of on or that the this to was were will with'.split(' '));
+    const cache = {}; // URL -> promise of parsed JSON, so each shard is fetched once per page view
+    let index = null;
+    let latestQuery = 0;
+
+    function fetchJson(url) {
+        if (!cache[url]) {
+            cache[url] = fetch(url).then((response) => {
+                if (!response.ok) throw new Error(`${url}: ${response.status}`);
+                return response.json();
+            });
+        }
+        return cache[url];
+    }
+
+    // Must match search_terms() in build.py
+    function terms(text) {
+        const words = text.toLowerCase().normalize('NFKD').replace(/\p{M}/gu, '').match(/[\p{L}\p{N}]+/gu) || [];
+        return words.filter((word) => word.length > 1 && !stopwords.has(word));
+    }
+
+    function shardName(term) {
+        const prefix = term.slice(0, index.prefix);
+        return /^[a-z0-9]+$/.test(prefix) ? prefix : '_';
+    }
+
+    // Scores of every document matching `term`; the last query term also matches as a prefix, for search-as-you-type
+    function matches(shard, term, prefix) {
+        const scores = {};
+        Object.keys(shard).forEach((candidate) => {
+            if (candidate === term || (prefix && candidate.startsWith(term))) {
+                shard[candidate].forEach(([doc, score]) => {
+                    scores[doc] = Math.max(scores[doc] || 0, score);
+                });
+            }
+        });
+        return scores;
+    }
+
+    function render(ranked, docs, query) {
+        results.innerHTML = '';
+        status.textContent = ranked.length ? `${ranked.length} result${ranked.length === 1 ? '' : 's'} for "${query}"` : `No results for "${query}"`;
+        ranked.forEach((doc) => {
+            const [title, url, kind, snippet] = docs[doc];
+            const item = document.createElement('li');
+            item.className = 'search-result';
+            const link = document.createElement('a');
+            link.href = url;
+            link.textContent = title;
+            const label = document.createElement('span');
+            label.className = 'search-result-kind';
+            label.textContent = kind;
+            item.append(label, link);
+            if (snippet) {
+                const text = document.createElement('p');
+                text.textContent = snippet;
+                item.append(text);
+            }
+            results.append(item);
+        });
+    }
+
+    async function search(query) {
+        const queryId = ++latestQuery;
+        const queryTerms = terms(query);
+        if (!queryTerms.length) {
+            results.innerHTML = '';
+            status.textContent = '';
+            return;
+        }
+        index = index || await fetchJson(indexUrl);
+        const names = queryTerms.map((term) => index.shards[shardName(term)]);
+        // A term whose shard does not exist matches nothing, so the whole query has no results
+        const shards = names.every(Boolean) ? await Promise.all(names.map((name) => fetchJson(baseUrl + name))) : null;
+        const docs = await fetchJson(baseUrl + index.docs);
+        if (queryId !== latestQuery) return; // A newer query has started; drop this one's results
+
+        let totals = null;
+        (shards || []).forEach((shard, i) => {
+            const scores = matches(shard, queryTerms[i], i === queryTerms.length - 1);
+            const next = {};
+            Object.keys(scores).forEach((doc) => {
+                if (!totals || doc in totals) next[doc] = (totals ? totals[doc] : 0) + scores[doc];
+            });
+            totals = next;
+        });
+        totals = totals || {};
+        const ranked = Object.keys(totals).filter((doc) => docs[doc]).sort((a, b) => totals[b] - totals[a] || a.localeCompare(b));
+        render(ranked, docs, query);
+    }
+
+    let debounce;
+    input.addEventListener('input', () => {
+        clearTimeout(debounce);
+        debounce = setTimeout(() => {
+            const params = new URLSearchParams(window.location.search);
+            params.set('q', input.value);
+            history.replaceState(null, '', `${window.location.pathname}?${params}`);
+            search(input.value).catch((error) => { status.textContent = 'Search is unavailable right now.'; console.error(error); });
+        }, 150);
+    });
+
+    const initial = new URLSearchParams(window.location.search).get('q');
+    if (initial) {
+        input.value = initial;
+        search(initial).catch((error) => { status.textContent = 'Search is unavailable right now.'; console.error(error); });
+    }
+});
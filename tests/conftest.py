@@ -0,0 +1,33 @@
+import os
+import sys
+
+import pytest
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT_DIR, os.path.join(ROOT_DIR, 'cms_app')]
+
+
+@pytest.fixture
+def cms(tmp_path, monkeypatch):
+    """The CMS module with its data files, locks and media store moved into tmp_path; saves queue no rebuilds.
+
+    'notes.json' is a list file and 'settings.json' a document, neither with a schema, so validation never rejects a save.
+    """
+    import app as cms
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    notes, settings = str(data_dir / 'notes.json'), str(data_dir / 'settings.json')
+    json_store = cms.JsonStore(str(tmp_path / 'locks'))
+    media_store = cms.MediaStore(str(tmp_path / 'images' / 'media'), str(data_dir / '_media.json'), json_store)
+    media_store.last_sweep = float('inf')  # No background sweeps.
+    monkeypatch.setattr(cms, 'AUTO_REBUILD', False)
+    monkeypatch.setattr(cms, 'LIST_FILES', [notes])
+    monkeypatch.setattr(cms, 'DOCUMENT_FILES', [settings])
+    monkeypatch.setattr(cms, 'UPLOAD_FOLDER', str(tmp_path / 'images'))
+    monkeypatch.setattr(cms, 'json_store', json_store)
+    monkeypatch.setattr(cms, 'content_store', json_store)
+    monkeypatch.setattr(cms, 'media_store', media_store)
+    monkeypatch.setattr(cms.upload_processor, 'submit', lambda path: None)
+    monkeypatch.setattr(cms, 'NOTES_FILE', notes, raising=False)
+    monkeypatch.setattr(cms, 'SETTINGS_FILE', settings, raising=False)
+    return cms
@@ -0,0 +1,116 @@
+import json
+import os
+
+import pytest
+
+import build
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    path = tmp_path / 'docs'
+    path.mkdir()
+    return str(path)
+
+
+@pytest.fixture
+def manifest_path(tmp_path):
+    return str(tmp_path / 'cache' / 'manifest.json')
+
+
+def new_manifest(manifest_path, output_dir, **kwargs):
+    return build.BuildManifest(path=manifest_path, output_dir=output_dir, **kwargs)
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+
+
+def test_output_is_built_until_a_saved_build_recorded_the_same_inputs(manifest_path, output_dir):
+    page = os.path.join(output_dir, 'index.html')
+    manifest = new_manifest(manifest_path, output_dir)
+    assert manifest.is_empty
+    assert manifest.needs_build(page, {'template': 'a'})
+    write(page, '<html>')
+    manifest.save()
+
+    manifest = new_manifest(manifest_path, output_dir)
+    assert not manifest.needs_build(page, {'template': 'a'})
+    assert manifest.needs_build(page, {'template': 'b'})
+
+
+def test_missing_output_is_rebuilt_even_with_unchanged_inputs(manifest_path, output_dir):
+    page = os.path.join(output_dir, 'index.html')
+    manifest = new_manifest(manifest_path, output_dir)
+    manifest.needs_build(page, {'template': 'a'})
+    manifest.save()
+
+    assert new_manifest(manifest_path, output_dir).needs_build(page, {'template': 'a'})
+
+
+def test_outputs_not_produced_again_are_removed_as_stale(manifest_path, output_dir):
+    kept, stale = os.path.join(output_dir, 'index.html'), os.path.join(output_dir, 'blog', 'old.html')
+    manifest = new_manifest(manifest_path, output_dir)
+    for path in (kept, stale):
+        manifest.needs_build(path, {})
+        write(path, path)
+    manifest.save()
+
+    manifest = new_manifest(manifest_path, output_dir)
+    manifest.needs_build(kept, {})
+    assert manifest.remove_stale_outputs() == [os.path.join('blog', 'old.html')]
+    assert os.path.exists(kept)
+    assert not os.path.exists(os.path.join(output_dir, 'blog'))
+
+
+def test_a_changed_build_signature_discards_the_recorded_inputs(manifest_path, output_dir):
+    page = os.path.join(output_dir, 'index.html')
+    manifest = new_manifest(manifest_path, output_dir)
+    manifest.needs_build(page, {'template': 'a'})
+    write(page, '<html>')
+    manifest.save()
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    saved['build_signature'] = 'an older build.py'
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(saved, f)
+
+    manifest = new_manifest(manifest_path, output_dir)
+    assert manifest.is_empty
+    assert manifest.needs_build(page, {'template': 'a'})
+
+
+def test_hash_file_follows_content_and_skips_files_outside_changed_paths(tmp_path, manifest_path, output_dir):
+    source = str(tmp_path / 'post.md')
+    write(source, 'first')
+    manifest = new_manifest(manifest_path, output_dir)
+    first = manifest.hash_file(source)
+    manifest.save()
+
+    write(source, 'second version')
+    assert new_manifest(manifest_path, output_dir).hash_file(source) != first
+    # A targeted build only re-checks the files it was told about.
+    assert new_manifest(manifest_path, output_dir, changed_paths=[]).hash_file(source) == first
+
+
+def test_rewriting_identical_content_is_not_a_change(manifest_path, output_dir):
+    page, other = os.path.join(output_dir, 'index.html'), os.path.join(output_dir, 'about.html')
+    manifest = new_manifest(manifest_path, output_dir)
+    for path in (page, other):
+        manifest.needs_build(path, {})
+        write(path, path)
+    assert manifest.changed_outputs() == ['about.html', 'index.html']
+    manifest.save()
+    recorded_mtime = os.stat(page).st_mtime_ns
+
+    manifest = new_manifest(manifest_path, output_dir)
+    for path in (page, other):
+        manifest.needs_build(path, {})
+    write(page, page)
+    os.utime(page, ns=(recorded_mtime + 10**9, recorded_mtime + 10**9))
+    write(other, 'new content')
+    assert manifest.output_hash('index.html', os.stat(page)) == build.file_hash(page)
+    assert manifest.changed_outputs() == ['about.html']
+    assert os.stat(page).st_mtime_ns == recorded_mtime
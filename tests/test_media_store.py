@@ -0,0 +1,78 @@
+import io
+import json
+import os
+import time
+
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+
+
+def image_upload(filename, color=(200, 30, 30), format='PNG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), color).save(buffer, format)
+    buffer.seek(0)
+    return FileStorage(buffer, filename)
+
+
+def counts(cms):
+    with open(cms.media_store.refs_file, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save(cms, filepath, data):
+    with cms.edit_json_data(filepath) as current:
+        if isinstance(current, list):
+            current[:] = data
+        else:
+            current.clear()
+            current.update(data)
+
+
+def test_media_references_counts_every_occurrence(cms):
+    value = {'image': 'media/a.jpg', 'gallery': ['media/a.jpg', 'media/b.png', 'team/c.jpg'], 'nested': {'logo': 'media/b.png'}}
+    assert cms.media_references(value) == {'media/a.jpg': 2, 'media/b.png': 2}
+
+
+def test_store_names_blobs_by_content_and_detected_format(cms):
+    name = cms.media_store.store(image_upload('photo.jpg'))
+    assert name.startswith('media/') and name.endswith('.png')
+    assert cms.media_store.store(image_upload('copy.png')) == name
+    assert os.listdir(cms.media_store.folder) == [name[len('media/'):]]
+    with pytest.raises(cms.UploadError):
+        cms.media_store.store(FileStorage(io.BytesIO(b'<svg/>'), 'drawing.png'))
+
+
+def test_saves_only_apply_their_own_difference(cms):
+    save(cms, cms.NOTES_FILE, [{'image': 'media/a.jpg'}, {'image': 'media/a.jpg'}])
+    save(cms, cms.SETTINGS_FILE, {'logo': 'media/b.png'})
+    assert counts(cms) == {'media/a.jpg': 2, 'media/b.png': 1}
+
+    save(cms, cms.NOTES_FILE, [{'image': 'media/a.jpg'}, {'image': 'media/b.png'}])
+    assert counts(cms) == {'media/a.jpg': 1, 'media/b.png': 2}
+
+    save(cms, cms.SETTINGS_FILE, {})
+    save(cms, cms.NOTES_FILE, [{'image': 'media/b.png'}])
+    assert counts(cms) == {'media/b.png': 1}
+
+
+def test_unreadable_counts_are_recounted_from_all_content(cms):
+    save(cms, cms.SETTINGS_FILE, {'logo': 'media/b.png'})
+    with open(cms.media_store.refs_file, 'w', encoding='utf-8') as f:
+        f.write('{')
+    save(cms, cms.NOTES_FILE, [{'image': 'media/a.jpg'}])
+    assert counts(cms) == {'media/a.jpg': 1, 'media/b.png': 1}
+
+
+def test_refresh_collects_only_unreferenced_blobs_past_the_grace_period(cms):
+    used, unused = cms.media_store.store(image_upload('a.png')), cms.media_store.store(image_upload('b.png', color=(0, 0, 255)))
+    fresh = cms.media_store.store(image_upload('c.png', color=(0, 255, 0)))
+    save(cms, cms.NOTES_FILE, [{'image': used}])
+    an_hour_ago = time.time() - 3600
+    for name in (used, unused):
+        os.utime(os.path.join(cms.UPLOAD_FOLDER, name), (an_hour_ago, an_hour_ago))
+
+    removed = cms.media_store.refresh(grace=60)
+    assert removed == [os.path.join(cms.UPLOAD_FOLDER, unused)]
+    assert sorted(os.listdir(cms.media_store.folder)) == sorted(name[len('media/'):] for name in (used, fresh))
+    assert counts(cms) == {used: 1}
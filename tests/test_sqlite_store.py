@@ -0,0 +1,69 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def store(cms, tmp_path):
+    with open(cms.NOTES_FILE, 'w', encoding='utf-8') as f:
+        json.dump([{'title': 'one'}, {'title': 'two'}, {'title': 'three'}], f)
+    with open(cms.SETTINGS_FILE, 'w', encoding='utf-8') as f:
+        json.dump({'color': 'red'}, f)
+    return cms.SqliteStore(str(tmp_path / 'content.sqlite3'), cms.LIST_FILES + cms.DOCUMENT_FILES, cms.json_store)
+
+
+def titles(store, filepath):
+    return [record['title'] for _, record in store.records(filepath)[0]]
+
+
+def test_collections_are_seeded_from_the_json_files(cms, store):
+    assert titles(store, cms.NOTES_FILE) == ['one', 'two', 'three']
+    assert store.load(cms.SETTINGS_FILE).data == {'color': 'red'}
+
+
+def test_edit_with_a_stale_collection_version_conflicts_and_changes_nothing(cms, store):
+    version = store.load(cms.SETTINGS_FILE).version
+    with store.edit(cms.SETTINGS_FILE, version) as data:
+        data['color'] = 'blue'
+    with pytest.raises(cms.ConflictError):
+        with store.edit(cms.SETTINGS_FILE, version) as data:
+            data['color'] = 'green'
+    assert store.load(cms.SETTINGS_FILE).data == {'color': 'blue'}
+    with open(cms.SETTINGS_FILE, encoding='utf-8') as f:
+        assert json.load(f) == {'color': 'blue'}
+
+
+def test_an_unchanged_edit_keeps_the_version(cms, store):
+    version = store.load(cms.SETTINGS_FILE).version
+    with store.edit(cms.SETTINGS_FILE, version):
+        pass
+    assert store.load(cms.SETTINGS_FILE).version == version
+
+
+def test_record_versions_are_independent(cms, store):
+    (first_id, _), (second_id, _), _ = store.records(cms.NOTES_FILE)[0]
+    _, first_version = store.get_record(cms.NOTES_FILE, first_id)
+    _, second_version = store.get_record(cms.NOTES_FILE, second_id)
+
+    with store.edit_record(cms.NOTES_FILE, first_id, first_version) as record:
+        record['title'] = 'one, edited'
+    # Someone else's edit of another post does not conflict.
+    with store.edit_record(cms.NOTES_FILE, second_id, second_version) as record:
+        record['title'] = 'two, edited'
+    # A second edit from the same stale form does.
+    with pytest.raises(cms.ConflictError):
+        with store.edit_record(cms.NOTES_FILE, first_id, first_version) as record:
+            record['title'] = 'lost update'
+    assert titles(store, cms.NOTES_FILE) == ['one, edited', 'two, edited', 'three']
+
+
+def test_ids_stay_with_their_records_when_the_list_is_rewritten(cms, store):
+    ids = {record['title']: record_id for record_id, record in store.records(cms.NOTES_FILE)[0]}
+    with store.edit(cms.NOTES_FILE) as data:
+        data.reverse()
+        data.pop(1)
+    assert store.records(cms.NOTES_FILE)[0] == [(ids['three'], {'title': 'three'}), (ids['one'], {'title': 'one'})]
+    assert store.delete_record(cms.NOTES_FILE, ids['two']) is None
+    assert store.delete_record(cms.NOTES_FILE, ids['one']) == {'title': 'one'}
+    with open(cms.NOTES_FILE, encoding='utf-8') as f:
+        assert json.load(f) == [{'title': 'three'}]